@@ -1,95 +1,390 @@
-from db import get_connection,safe_close
+from db import get_connection,safe_close,redis_client
+from consts import ANALYTICS_PAGE_SIZE, ANALYTICS_OPEN_HOURS, ANALYTICS_SERIES_TTL
 import json
-from datetime import datetime
+import calendar
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
 
+# All helpers take the caller's cursor and never commit, so a click's analytics
+# run on one pooled connection inside one transaction (see record_click_analytics).
 
-def increment_hourly_analytics(url_id, fingerprint, suspicious=False):
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
+# Unique visitors: one HyperLogLog per url and hour, hll:<url_id>:<YYYYMMDDHH>.
+# hll:active:<YYYYMMDDHH> lists the urls that saw visitors, for the rollup.
+HLL_RETENTION = timedelta(days=8)  # enough for weekly PFCOUNT merges
+HLL_ACTIVE_RETENTION = timedelta(hours=3)
 
-        # Check URL exists
-        cursor.execute("SELECT 1 FROM urls WHERE id = %s", (url_id,))
-        if cursor.fetchone() is None:
-            return
+# analytics:version:<url_id> changes whenever an open bucket of that url does;
+# it is part of the /analytics ETag and response cache key.
+VERSION_RETENTION = timedelta(days=1)
 
-        # Current hour
-        now = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
 
-        cursor.execute("""
-            INSERT INTO url_analytics_hourly (url_id, fingerprint, date_hour, clicks, suspicious_clicks)
-            VALUES (%s, %s, %s, %s, %s)
-            ON DUPLICATE KEY UPDATE
-                clicks = clicks + VALUES(clicks),
-                suspicious_clicks = suspicious_clicks + VALUES(suspicious_clicks)
-        """, (url_id, fingerprint, now, 1 if not suspicious else 0, 1 if suspicious else 0))
-        conn.commit()
-    finally:
+def _hour_bucket(when: datetime) -> str:
+    return when.strftime("%Y%m%d%H")
+
+
+def _hll_key(url_id: str, when: datetime) -> str:
+    return f"hll:{url_id}:{_hour_bucket(when)}"
+
+
+def increment_hourly_analytics(cursor, url_id, suspicious=False, clicked_at=None):
+    # Click hour (event time, so a delayed worker still lands in the right bucket)
+    date_hour = (clicked_at or datetime.utcnow()).replace(minute=0, second=0, microsecond=0)
+
+    # No existence check: the url_id comes from a resolved code and the FK guards the rest
+    cursor.execute("""
+        INSERT INTO url_analytics_hourly (url_id, date_hour, clicks, suspicious_clicks)
+        VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            clicks = clicks + VALUES(clicks),
+            suspicious_clicks = suspicious_clicks + VALUES(suspicious_clicks)
+    """, (url_id, date_hour, 1 if not suspicious else 0, 1 if suspicious else 0))
+
+def update_url_referres(cursor, url_id:str, referrer:str|None):
+    if not referrer:
+      referrer = "unknown"
+    cursor.execute("""
+        INSERT INTO url_referrers (url_id, referrer, clicks)
+        VALUES (%s, %s, 1)
+        ON DUPLICATE KEY UPDATE clicks = clicks + 1
+        """,
+        (url_id, referrer))
+
+
+def update_user_sequence(cursor, fingerprint: str, url_code: str, max_length: int = 10):
+    cursor.execute("SELECT sequence FROM user_sequences WHERE fingerprint=%s FOR UPDATE", (fingerprint,))
+    row = cursor.fetchone()
+    raw = (row["sequence"] if isinstance(row, dict) else row[0]) if row else None
+
+    # Safely load JSON
+    if raw:
         try:
-            safe_close(conn) # type: ignore
-            cursor.close() #type: ignore
-        except Exception:
-            pass  # Ignore connection errors on close
+            sequence = json.loads(raw)
+            if not isinstance(sequence, list):
+                sequence = [sequence]  # wrap single string into a list
+        except json.JSONDecodeError:
+            sequence = []
+    else:
+        sequence = []
+
+    # Append new code
+    if url_code not in sequence:
+        sequence.append(url_code)
+
+    # Keep only last N
+    sequence = sequence[-max_length:]
+
+    cursor.execute("""
+        INSERT INTO user_sequences (fingerprint, sequence) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE sequence = VALUES(sequence), last_update = NOW()
+        """,
+        (fingerprint, json.dumps(sequence)))
+
 
-def update_url_referres(url_id:str,referrer:str|None):
+def record_click_analytics(url_id, fingerprint, referrer, clicked_at=None, cursor=None):
+    """
+    Hourly counters, visitor sequence and referrer for one clean click.
+    With `cursor` the caller owns the transaction; otherwise this checks out
+    one connection and commits once.
+    """
+    if cursor is not None:
+        increment_hourly_analytics(cursor, url_id, suspicious=False, clicked_at=clicked_at)
+        update_user_sequence(cursor, fingerprint, url_id)
+        update_url_referres(cursor, url_id=url_id, referrer=referrer)
+        return
+
+    conn = get_connection()
+    cursor = conn.cursor()
     try:
-        if not referrer:
-          referrer = "unknown"
-        conn = get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute("""
-            INSERT INTO url_referrers (url_id, referrer, clicks)
-            VALUES (%s, %s, 1)
-            ON DUPLICATE KEY UPDATE clicks = clicks + 1
-            """,
-            (url_id, referrer))
+        record_click_analytics(url_id, fingerprint, referrer, clicked_at=clicked_at, cursor=cursor)
         conn.commit()
     finally:
-        try:
-            safe_close(conn) # type: ignore
-            cursor.close() #type: ignore
-        except Exception:
-            pass  # Ignore connection errors on close
+        cursor.close()
+        safe_close(conn)
+
+
+def bump_analytics_version(url_id: str, pipe=None) -> None:
+    """Mark the url's open analytics buckets as changed (queued on `pipe` when given)."""
+    client = pipe if pipe is not None else redis_client.pipeline(transaction=False)
+    client.incr(f"analytics:version:{url_id}")
+    client.expire(f"analytics:version:{url_id}", VERSION_RETENTION)
+    if pipe is None:
+        client.execute()
+
+
+def get_analytics_version(url_id: str) -> int:
+    return int(redis_client.get(f"analytics:version:{url_id}") or 0)  # type: ignore
 
 
-def update_user_sequence(fingerprint: str, url_code: str, max_length: int = 10):
+# ---------------------------
+# Unique visitors (HyperLogLog)
+# ---------------------------
+def track_unique_visitor(url_id: str, fingerprint: str, clicked_at: datetime) -> None:
+    """PFADD the visitor to this url's HyperLogLog for the click hour (one round trip)."""
+    key = _hll_key(url_id, clicked_at)
+    active_key = f"hll:active:{_hour_bucket(clicked_at)}"
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.pfadd(key, fingerprint)
+    pipe.expire(key, HLL_RETENTION)
+    pipe.sadd(active_key, url_id)
+    pipe.expire(active_key, HLL_ACTIVE_RETENTION)
+    bump_analytics_version(url_id, pipe)
+    pipe.execute()
+
+
+def _hours(start: datetime, end: datetime) -> List[datetime]:
+    hour = start.replace(minute=0, second=0, microsecond=0)
+    hours = []
+    while hour < end:
+        hours.append(hour)
+        hour += timedelta(hours=1)
+    return hours
+
+
+def unique_visitors_between(url_id: str, start: datetime, end: datetime) -> Optional[int]:
+    """
+    Distinct visitors over [start, end) via one PFCOUNT across the hourly HLLs.
+    Returns None when the range reaches past HLL_RETENTION.
+    """
+    if start < datetime.utcnow() - HLL_RETENTION:
+        return None
+    keys = [_hll_key(url_id, hour) for hour in _hours(start, end)]
+    return int(redis_client.pfcount(*keys)) if keys else 0  # type: ignore
+
+
+def rollup_unique_visitors(hours_back: int = 1) -> int:
+    """
+    Write PFCOUNT of the current and previous `hours_back` hours into
+    url_analytics_hourly.unique_visitors. Returns the number of rows written.
+    """
+    now = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    rows = []
+    for hour in (now - timedelta(hours=h) for h in range(hours_back, -1, -1)):
+        url_ids = list(redis_client.smembers(f"hll:active:{_hour_bucket(hour)}"))  # type: ignore
+        if not url_ids:
+            continue
+        pipe = redis_client.pipeline(transaction=False)
+        for url_id in url_ids:
+            pipe.pfcount(_hll_key(url_id, hour))
+        rows += [(url_id, hour, count) for url_id, count in zip(url_ids, pipe.execute())]
+    if not rows:
+        return 0
+
     conn = get_connection()
-    cursor = conn.cursor(dictionary=True)
+    cursor = conn.cursor()
     try:
-        cursor.execute("SELECT sequence FROM user_sequences WHERE fingerprint=%s", (fingerprint,))
-        row = cursor.fetchone()
-
-        # Safely load JSON
-        if row and row['sequence']:
-            try:
-                sequence = json.loads(row['sequence'])
-                if not isinstance(sequence, list):
-                    sequence = [sequence]  # wrap single string into a list
-            except json.JSONDecodeError:
-                sequence = []
-        else:
-            sequence = []
-
-        # Append new code
-        if url_code not in sequence:
-            sequence.append(url_code)
-
-        # Keep only last N
-        sequence = sequence[-max_length:]
-
-        if row:
-            cursor.execute(
-                "UPDATE user_sequences SET sequence=%s, last_update=NOW() WHERE fingerprint=%s",
-                (json.dumps(sequence), fingerprint)
-            )
-        else:
-            cursor.execute(
-                "INSERT INTO user_sequences (fingerprint, sequence) VALUES (%s, %s)",
-                (fingerprint, json.dumps(sequence))
-            )
+        cursor.executemany("""
+            INSERT INTO url_analytics_hourly (url_id, date_hour, unique_visitors)
+            VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE unique_visitors = VALUES(unique_visitors)
+        """, rows)
         conn.commit()
     finally:
         cursor.close()
         safe_close(conn)
 
+    pipe = redis_client.pipeline(transaction=False)
+    for url_id in {row[0] for row in rows}:
+        bump_analytics_version(url_id, pipe)
+    pipe.execute()
+    return len(rows)
+
+
+# ---------------------------
+# Time series (GET /analytics/<code>)
+# ---------------------------
+# Bucket start per granularity; weeks start on Monday
+GRANULARITIES = {
+    "hour": ("date_hour", timedelta(hours=1)),
+    "day": ("TIMESTAMP(DATE(date_hour))", timedelta(days=1)),
+    "week": ("TIMESTAMP(DATE_SUB(DATE(date_hour), INTERVAL WEEKDAY(date_hour) DAY))", timedelta(weeks=1)),
+}
+
+
+def fetch_series_page(cursor, url_id: str, granularity: str, start: datetime, end: datetime,
+                      limit: int) -> List[Dict]:
+    """
+    Up to `limit` buckets of [start, end), aggregated in MySQL over the
+    (url_id, date_hour) primary key. The next page starts at the last bucket + one width.
+    """
+    period, width = GRANULARITIES[granularity]
+    cursor.execute(f"""
+        SELECT {period} AS period,
+            SUM(clicks) AS clicks,
+            SUM(unique_visitors) AS unique_visitors,
+            SUM(suspicious_clicks) AS suspicious_clicks
+        FROM url_analytics_hourly
+        WHERE url_id=%s AND date_hour >= %s AND date_hour < %s
+        GROUP BY period
+        ORDER BY period
+        LIMIT %s
+    """, (url_id, start, end, limit))
+    rows = []
+    for row in cursor.fetchall():
+        row = row if isinstance(row, dict) else dict(zip(("period", "clicks", "unique_visitors", "suspicious_clicks"), row))
+        if granularity != "hour":
+            # Hourly uniques don't add up; merge the HyperLogLogs while they are retained
+            row["unique_visitors"] = unique_visitors_between(url_id, row["period"], row["period"] + width)
+        rows.append({
+            "period": row["period"].isoformat(),
+            "clicks": int(row["clicks"] or 0),
+            "unique_visitors": int(row["unique_visitors"]) if row["unique_visitors"] is not None else None,
+            "suspicious_clicks": int(row["suspicious_clicks"] or 0),
+        })
+    return rows
+
+
+def next_series_start(rows: List[Dict], granularity: str) -> datetime:
+    _, width = GRANULARITIES[granularity]
+    return datetime.fromisoformat(rows[-1]["period"]) + width
+
+
+def _db_series(url_id: str, granularity: str, start: datetime, end: datetime,
+               page_size: int) -> Iterator[Dict]:
+    """
+    Every bucket of [start, end) from MySQL, page by page. The connection goes
+    back to the pool between pages, so a slow consumer never pins one.
+    """
+    while start < end:
+        conn = get_connection()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            rows = fetch_series_page(cursor, url_id, granularity, start, end, page_size)
+        finally:
+            cursor.close()
+            safe_close(conn)
+        yield from rows
+        if len(rows) < page_size:
+            return
+        start = next_series_start(rows, granularity)
+
+
+# Closed buckets are cached per url, granularity and segment of SEGMENT_BUCKETS buckets:
+#   analytics:series:<url_id>:<granularity>:<segment start epoch>   JSON list of its buckets
+# A request only touches the segments its range overlaps and fills the missing ones
+# with one paged MySQL scan. The last ANALYTICS_OPEN_HOURS hours stay open: the
+# unique-visitor rollup rewrites the previous hour. Segments expire after
+# ANALYTICS_SERIES_TTL, so clicks that land even later (a lagging stream consumer,
+# a retried task) show up once the segment is refilled.
+SEGMENT_BUCKETS = {"hour": 24, "day": 7, "week": 4}
+SEGMENT_ORIGIN = datetime(1970, 1, 5)  # a Monday, so segments line up with week buckets
+SEGMENTS_PER_READ = 256  # segment keys per MGET
+
+
+def bucket_start(when: datetime, granularity: str) -> datetime:
+    start = when.replace(minute=0, second=0, microsecond=0)
+    if granularity != "hour":
+        start = start.replace(hour=0)
+    if granularity == "week":
+        start -= timedelta(days=start.weekday())
+    return start
+
+
+def align_range(start: datetime, end: datetime, granularity: str):
+    """Widen [start, end) to whole buckets, so cached and live buckets always agree."""
+    _, width = GRANULARITIES[granularity]
+    aligned_end = bucket_start(end, granularity)
+    return bucket_start(start, granularity), aligned_end if aligned_end == end else aligned_end + width
+
+
+def series_range(cursor, url_id: str, start: Optional[datetime], end: datetime,
+                 granularity: str) -> Tuple[datetime, datetime]:
+    """
+    `align_range` of [start, end), with start clamped to the url's first hour of
+    data (`start` None means from the beginning), so no segment before the link
+    existed is ever read or cached.
+    """
+    cursor.execute("SELECT MIN(date_hour) AS first_hour FROM url_analytics_hourly WHERE url_id=%s", (url_id,))
+    row = cursor.fetchone()
+    first_hour = (row["first_hour"] if isinstance(row, dict) else row[0]) if row else None
+    # No clicks yet: nothing before `end` to show
+    first_hour = first_hour or end
+    return align_range(max(start or first_hour, first_hour), end, granularity)
+
+
+def closed_boundary(granularity: str, now: Optional[datetime] = None) -> datetime:
+    """Start of the first bucket that may still change."""
+    now = now or datetime.utcnow()
+    return bucket_start(now - timedelta(hours=ANALYTICS_OPEN_HOURS - 1), granularity)
+
+
+def _epoch(when: datetime) -> int:
+    return calendar.timegm(when.timetuple())
+
+
+def _segment_span(granularity: str) -> timedelta:
+    _, width = GRANULARITIES[granularity]
+    return width * SEGMENT_BUCKETS[granularity]
+
+
+def segment_start(when: datetime, granularity: str) -> datetime:
+    span = _segment_span(granularity)
+    return SEGMENT_ORIGIN + span * ((when - SEGMENT_ORIGIN) // span)
+
+
+def _fill_segments(url_id: str, granularity: str, segments: List[datetime]) -> Dict[datetime, List[Dict]]:
+    """Read contiguous `segments` from MySQL (paged) and cache each one, empty ones included."""
+    span = _segment_span(granularity)
+    filled: Dict[datetime, List[Dict]] = {segment: [] for segment in segments}
+    for row in _db_series(url_id, granularity, segments[0], segments[-1] + span, ANALYTICS_PAGE_SIZE):
+        filled[segment_start(datetime.fromisoformat(row["period"]), granularity)].append(row)
+    pipe = redis_client.pipeline(transaction=False)
+    for segment, rows in filled.items():
+        pipe.set(f"analytics:series:{url_id}:{granularity}:{_epoch(segment)}", json.dumps(rows), ex=ANALYTICS_SERIES_TTL)
+    pipe.execute()
+    return filled
+
+
+def _closed_buckets(url_id: str, granularity: str, start: datetime, end: datetime, limit: int) -> List[Dict]:
+    """Up to `limit` buckets of [start, end) from the segment cache; `end` is a closed segment's end."""
+    span = _segment_span(granularity)
+    rows: List[Dict] = []
+    segment = segment_start(start, granularity)
+    while segment < end and len(rows) < limit:
+        segments = []
+        while segment < end and len(segments) < SEGMENTS_PER_READ:
+            segments.append(segment)
+            segment += span
+        cached = redis_client.mget([f"analytics:series:{url_id}:{granularity}:{_epoch(s)}" for s in segments])
+        missing = [seg for seg, value in zip(segments, cached) if value is None]  # type: ignore
+        filled: Dict[datetime, List[Dict]] = {}
+        # One scan per run of adjacent missing segments
+        run: List[datetime] = []
+        for seg in missing:
+            if run and seg != run[-1] + span:
+                filled.update(_fill_segments(url_id, granularity, run))
+                run = []
+            run.append(seg)
+        if run:
+            filled.update(_fill_segments(url_id, granularity, run))
+        for seg, value in zip(segments, cached):  # type: ignore
+            rows += filled[seg] if value is None else json.loads(value)
+    return [row for row in rows if datetime.fromisoformat(row["period"]) >= start][:limit]
+
+
+def series_page(url_id: str, granularity: str, start: datetime, end: datetime, limit: int,
+                now: Optional[datetime] = None) -> List[Dict]:
+    """Up to `limit` buckets of [start, end): closed segments from Redis, the rest from MySQL."""
+    cache_end = min(end, segment_start(closed_boundary(granularity, now), granularity))
+    rows: List[Dict] = []
+    if start < cache_end:
+        rows = _closed_buckets(url_id, granularity, start, cache_end, limit)
+    if len(rows) < limit and end > max(start, cache_end):
+        conn = get_connection()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            rows += fetch_series_page(cursor, url_id, granularity, max(start, cache_end), end, limit - len(rows))
+        finally:
+            cursor.close()
+            safe_close(conn)
+    return rows
+
+
+def iter_series(url_id: str, granularity: str, start: datetime, end: datetime,
+                page_size: int) -> Iterator[Dict]:
+    """Every bucket of [start, end), page by page through `series_page`."""
+    while start < end:
+        rows = series_page(url_id, granularity, start, end, page_size)
+        yield from rows
+        if len(rows) < page_size:
+            return
+        start = next_series_start(rows, granularity)
@@ -1,25 +1,39 @@
 import logging
-from flask import Flask, request, jsonify, redirect
-from typing import Optional, TypedDict, cast
+from flask import Flask, Response, request, jsonify, redirect, stream_with_context
+from typing import Dict, List, Optional, TypedDict, cast
 import mysql.connector
-import nanoid
 from uuid import uuid4
 from auth import hash_password, check_password, create_refresh_token, create_access_token, jwt_required,hash_token
 import validators
 from errors import handle_errors, APIError
 from db import redis_client,get_connection,safe_close
-from consts import RATE_LIMIT
+from consts import (CLICK_INGEST_MODE, TRENDING_TOP_N, ANALYTICS_PAGE_SIZE, ANALYTICS_MAX_PAGE_SIZE,
+                    STATS_BATCH_MAX_CODES, STATS_BATCH_CODES_PER_TOKEN, SHORTEN_BULK_MAX_ITEMS)
+import rate_limit
 from celery import Task
 from typing import cast
-from tasks import log_click,check_fraud
+from tasks import log_click
 from prometheus_client import generate_latest,CONTENT_TYPE_LATEST
 from metrics import REQUEST_COUNT,REQUEST_LATENCY
+import math
 import time
 import json
-from fraud import get_fingerprint
+from fraud import get_fingerprint, collect_fraud_gauges, check_request_rules
+from url_cache import URLRecord, cache_url_record, get_url_record, get_url_records, register_new_url
+from click_export import EXPORT_FORMATS, export_clicks
+from bulk_shorten import shorten_batch, valid_custom_code
+from code_allocator import allocate_code
+from url_dedupe import url_hash, cached_code, find_code, remember_code
+from code_filter import code_may_exist, remember_missing
+from click_stream import publish_click
+from click_counters import get_click_total, get_click_totals, seed_click_total
+from analytics import (unique_visitors_between, get_analytics_version, GRANULARITIES, series_range,
+                       series_page, next_series_start, iter_series)
+from response_cache import make_etag, query_params, not_modified, tag, get_cached_response, cache_response
+from trending import top_trending
+from datetime import datetime, timedelta, timezone
     
 log_click_task = cast(Task, log_click)
-check_fraud_task=cast(Task,check_fraud)
 # ---------------------------
 # Logging setup
 # ---------------------------
@@ -38,6 +52,7 @@ class UserRow(TypedDict):
     id: str
     username: str
     password_hash: str  # stored in DB
+    user_role: str
 
 
 class URLRow(TypedDict):
@@ -73,30 +88,26 @@ def get_client_ip():
 # ---------------------------
 # Rate limiting helper
 # ---------------------------
-def check_rate_limit(user_id: str) -> bool:
-    key = f"rate:{user_id}"
-    current: Optional[int] = redis_client.get(key)  # type: ignore
-    if current is None:
-        redis_client.set(key, 1, ex=60)
-        logger.info(f"Rate limit: new counter for user {user_id}")
-        return True
-    elif int(current) < RATE_LIMIT:
-        redis_client.incr(key)
-        logger.info(f"Rate limit: increment counter for user {user_id} ({int(current)+1})")
-        return True
-    logger.warning(f"Rate limit exceeded for user {user_id}")
-    return False
-
-def check_ip_rate_limit(ip: str) -> bool:
-    key = f"rate_ip:{ip}"
-    current: Optional[str] = redis_client.get(key)
-    if current is None:
-        redis_client.set(key, 1, ex=60)
-        return True
-    elif int(current) < RATE_LIMIT:  # <-- cast to int
-        redis_client.incr(key)
-        return True
-    return False
+def enforce_rate_limit(route: str, cost: int = 1):
+    """
+    Check the caller's per-user and per-IP budgets; returns a 429 response (413 when
+    `cost` is larger than the whole budget) or None.
+    """
+    user_id: str = request.environ["user_id"]
+    tier = request.environ["claims"].get("role", "user")
+    ip_addr = get_client_ip()
+    if ip_addr is None:
+        return jsonify({}), 429
+    for identity, identity_tier in ((user_id, tier), (ip_addr, "ip")):
+        decision = rate_limit.check(route, identity, identity_tier, cost)
+        if not decision.allowed and math.isinf(decision.retry_after):
+            # Larger than the whole budget: retrying can never succeed, so no Retry-After
+            return jsonify({"error": f"Request too large: costs {cost}, limit is {decision.limit} per window"}), 413
+        if not decision.allowed:
+            logger.warning(f"Rate limit exceeded on {route} for {identity_tier} {identity}")
+            response = jsonify({"error": f"Rate limit exceeded: {decision.limit} requests per window"})
+            return response, 429, {"Retry-After": str(max(1, round(decision.retry_after)))}
+    return None
 
 
 # ---------------------------
@@ -127,6 +138,7 @@ def record_metrics(response):
 @app.route('/metrics')
 def metrics():
     """ Exposes application metrics in a Prometheus-compatible format. """
+    collect_fraud_gauges()
     return generate_latest(), 200, {'Content-Type': CONTENT_TYPE_LATEST}
 
 # ---------------------------
@@ -178,9 +190,9 @@ def login():
             return jsonify({"msg": "Bad credentials"}), 401
 
         # Generate tokens
-        access_token = create_access_token(row["id"])
+        access_token = create_access_token(row["id"], row["user_role"])
         jti=str(uuid4())
-        refresh_token = create_refresh_token(row["id"],jti)
+        refresh_token = create_refresh_token(row["id"],jti, row["user_role"])
         hashed_token = hash_token(refresh_token)
 
         # Store refresh token in DB (hashed)
@@ -206,7 +218,7 @@ def login():
 @jwt_required(token_type="refresh")
 def access_token():
     user_id = request.environ["user_id"]
-    token = create_access_token(user_id)
+    token = create_access_token(user_id, request.environ["claims"].get("role", "user"))
     logger.info(f"Issued access token for user_id: {user_id}")
     return jsonify({"access_token": token})
 
@@ -248,70 +260,126 @@ def shorten_url():
     data = request.get_json()
     original_url: str = data["url"]
     code: str = data.get("code")
-    ip_addr=get_client_ip()
-    if ip_addr is None:
-        return jsonify({}),429
-    if not check_rate_limit(user_id) or not check_ip_rate_limit(ip_addr):
-        logger.warning(f"Rate limit exceeded for user {user_id}")
-        return jsonify({"error": f"Rate limit exceeded: {RATE_LIMIT} requests per minute"}), 429
+    limited = enforce_rate_limit("shorten")
+    if limited:
+        return limited
 
     if not validators.url(original_url):
         logger.warning(f"Invalid URL submitted by user {user_id}: {original_url}")
         return jsonify({"error": "Invalid URL"}), 400
-
-    if not code:
-        code = nanoid.generate(size=8)
+    if code and not valid_custom_code(code):
+        logger.warning(f"Invalid custom code submitted by user {user_id}: {code}")
+        return jsonify({"error": "Invalid code"}), 400
+
+    # With "dedupe": true (and no custom code) an identical URL returns the caller's existing code
+    digest = url_hash(user_id, original_url)
+    dedupe = data.get("dedupe") is True and not code
+    if dedupe:
+        existing = cached_code(digest)
+        record = get_url_record(existing) if existing else None
+        if record is not None and record["user_id"] == user_id:
+            return jsonify({"short_url": f"http://localhost:5000/{existing}", "existing": True})
+
+    custom = bool(code)
+    url_id = str(uuid4())
     conn=get_connection()
     cursor= conn.cursor(dictionary=True)    
-    cursor.execute(
-        "INSERT INTO urls (id, code, original_url, user_id) VALUES (%s, %s, %s, %s)",
-        (str(uuid4()), code, original_url, user_id),
-    )
-    conn.commit()
-    cursor.close()
-    safe_close(conn)
-    redis_client.set(code, original_url, ex=86400)  # cache 1 day
+    try:
+        existing = find_code(cursor, user_id, digest) if dedupe else None
+        if existing:
+            remember_code(digest, existing)
+            return jsonify({"short_url": f"http://localhost:5000/{existing}", "existing": True})
+        # Allocate only once the link is really created, so deduped requests don't use up codes
+        if not custom:
+            code = allocate_code()
+        cursor.execute(
+            "INSERT INTO urls (id, code, original_url, user_id, url_hash) VALUES (%s, %s, %s, %s, %s)",
+            (url_id, code, original_url, user_id, digest),
+        )
+        conn.commit()
+    except mysql.connector.IntegrityError:
+        if not custom:
+            # Allocated codes are known to be free; losing one means a concurrent custom code took it
+            logger.error(f"Allocated code {code} already exists, user {user_id}")
+            raise APIError("Could not create the short code, please retry", 503)
+        logger.warning(f"Code already taken for user {user_id}: {code}")
+        raise APIError("Code already taken", 409)
+    finally:
+        cursor.close()
+        safe_close(conn)
+    pipe = redis_client.pipeline(transaction=False)
+    register_new_url(code, url_id, original_url, user_id, pipe=pipe)
+    remember_code(digest, code, pipe=pipe)
+    pipe.execute()
     logger.info(f"URL shortened by user {user_id}: {original_url} -> {code}")
 
-    return jsonify({"short_url": f"http://localhost:5000/{code}"})
+    return jsonify({"short_url": f"http://localhost:5000/{code}", "existing": False})
+
+
+@app.route("/shorten/bulk", methods=["POST"])
+@jwt_required(token_type="access")
+@handle_errors
+def shorten_bulk():
+    """
+    Body: {"urls": [{"url": ..., "code": optional}, ...]}. Returns one result per
+    item, in order; the rate limit counts links, not requests.
+    """
+    user_id: str = request.environ["user_id"]
+    data = request.get_json(silent=True) or {}
+    items = data.get("urls")
+    if not isinstance(items, list) or not items:
+        raise APIError("'urls' must be a non-empty list")
+    if len(items) > SHORTEN_BULK_MAX_ITEMS:
+        raise APIError(f"At most {SHORTEN_BULK_MAX_ITEMS} urls per request")
+    limited = enforce_rate_limit("shorten_bulk", cost=len(items))
+    if limited:
+        return limited
+
+    results = shorten_batch(items, user_id)
+    for result in results:
+        if "code" in result:
+            result["short_url"] = f"http://localhost:5000/{result['code']}"
+    created = sum("code" in result for result in results)
+    return jsonify({"created": created, "failed": len(results) - created, "results": results})
 
 
 @app.route("/<code>")
 @handle_errors
 def redirect_url(code: str):
-    # Try Redis first
-    original_url = redis_client.get(code)
-    url_id = None
-    # Always query DB if Redis misses
-    conn=get_connection()
-    cursor= conn.cursor(dictionary=True)
-  
-    if not original_url:
-        cursor.execute("SELECT * FROM urls WHERE code=%s", (code,))
-        row = cursor.fetchone()
+    # Worker-local tier, then one HGETALL; MySQL is only touched on a miss
+    record = get_url_record(code)
+    if record is None:
+        # Scanners probing random codes stop here instead of reaching MySQL
+        if not code_may_exist(code):
+            return "URL not found", 404
+        conn=get_connection()
+        cursor= conn.cursor(dictionary=True)
+        try:
+            cursor.execute("SELECT id, original_url, user_id FROM urls WHERE code=%s", (code,))
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+            safe_close(conn)
         if not row:
+            remember_missing(code)
             logger.warning(f"Redirect failed, code not found: {code}")
             return "URL not found", 404
-        original_url = row["original_url"] # pyright: ignore[reportArgumentType, reportCallIssue]
-        url_id = row["id"] # pyright: ignore[reportArgumentType, reportCallIssue]
-        redis_client.set(code, original_url, ex=86400) # pyright: ignore[reportArgumentType]
-    else:
-        # Even if cached, get url_id from DB
-        cursor.execute("SELECT id, code FROM urls WHERE code=%s", (code,))
-        row = cursor.fetchone()
-        url_id = row["id"] if row else None # type: ignore
-        url_code = row["code"] if row else code #type: ignore
-    if not url_id:
-        logger.warning(f"Redirect failed, URL ID not found in DB: {code}")
-        return "URL not found", 404
+        record = cache_url_record(code, row["id"], row["original_url"], row["user_id"]) # type: ignore
+
+    url_id = record["url_id"]
+    original_url = record["original_url"]
     fingerprint = get_fingerprint()
-    log_click_task.delay(url_id, get_client_ip(), request.headers.get("User-Agent"), request.referrer, fingerprint)
-    check_fraud_task.delay(get_client_ip(), url_code, request.headers.get("User-Agent"), request.referrer, fingerprint) # type: ignore# type: ignore
-    cursor.close()
-    safe_close(conn)
+    ip_addr = get_client_ip()
+    user_agent = request.headers.get("User-Agent")
+    # Request rules are cheap and run here; workers only run the counter-based ones
+    request_reasons = check_request_rules(user_agent, request.referrer)
+    if CLICK_INGEST_MODE == "stream":
+        publish_click(url_id, code, ip_addr, user_agent, request.referrer, fingerprint, request_reasons)
+    else:
+        log_click_task.delay(url_id, ip_addr, user_agent, request.referrer, fingerprint, code, request_reasons)
     logger.info(f"URL clicked: {code} by IP {request.remote_addr}")
 
-    return redirect(original_url) # type: ignore
+    return redirect(original_url)
 
 
 
@@ -323,75 +391,252 @@ def redirect_url(code: str):
 @handle_errors
 def stats(code: str):
     user_id: str = request.environ["user_id"]
-    ip_addr=get_client_ip()
-    if ip_addr is None:
-        return jsonify({}),429
-    if not check_rate_limit(user_id) or not check_ip_rate_limit(ip_addr):
-        logger.warning(f"Rate limit exceeded for user {user_id}")
-        return jsonify({"error": f"Rate limit exceeded: {RATE_LIMIT} requests per minute"}), 429
-    conn=get_connection()
-    cursor= conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM urls WHERE code=%s", (code,))
-    row = cast(Optional[URLRow], cursor.fetchone())
-    cursor.close()
-    safe_close(conn)
-    if not row or row["user_id"] != user_id:
+    limited = enforce_rate_limit("stats")
+    if limited:
+        return limited
+    # Ownership comes from the cached record and clicks from the live Redis counters
+    record = get_url_record(code)
+    clicks = get_click_total(record["url_id"]) if record else None
+    if record is None or clicks is None:
+        conn=get_connection()
+        cursor= conn.cursor(dictionary=True)
+        cursor.execute("SELECT * FROM urls WHERE code=%s", (code,))
+        row = cast(Optional[URLRow], cursor.fetchone())
+        cursor.close()
+        safe_close(conn)
+        if not row:
+            logger.warning(f"Stats access unauthorized for user {user_id}, code {code}")
+            return jsonify({"msg": "Not found or unauthorized"}), 404
+        record = cache_url_record(code, row["id"], row["original_url"], str(row["user_id"]))
+        clicks = seed_click_total(row["id"], row["clicks"])
+    if record["user_id"] != user_id:
         logger.warning(f"Stats access unauthorized for user {user_id}, code {code}")
         return jsonify({"msg": "Not found or unauthorized"}), 404
     logger.info(f"Stats retrieved for user {user_id}, code {code}")
-    return jsonify({
-        "original_url": row["original_url"],
-        "clicks": row["clicks"],
-    })
+    etag = make_etag(code, user_id, record["original_url"], clicks)
+    unchanged = not_modified(etag)
+    if unchanged:
+        return unchanged
+    return tag(jsonify({
+        "original_url": record["original_url"],
+        "clicks": clicks,
+    }), etag)
+
+@app.route("/stats/batch", methods=["POST"])
+@jwt_required(token_type="access")
+@handle_errors
+def stats_batch():
+    """
+    Body: {"codes": [...]}. Returns {"stats": {code: [original_url, clicks]}, "not_found": [...]};
+    codes the caller does not own are reported as not found, like /stats.
+    """
+    user_id: str = request.environ["user_id"]
+    data = request.get_json(silent=True) or {}
+    codes = data.get("codes")
+    if not isinstance(codes, list) or not all(isinstance(code, str) for code in codes):
+        raise APIError("'codes' must be a list of short codes")
+    codes = list(dict.fromkeys(codes))
+    if len(codes) > STATS_BATCH_MAX_CODES:
+        raise APIError(f"At most {STATS_BATCH_MAX_CODES} codes per request")
+    limited = enforce_rate_limit("stats", cost=1 + len(codes) // STATS_BATCH_CODES_PER_TOKEN)
+    if limited:
+        return limited
+
+    # Cached records and live counters first: two pipelined round trips for any batch size
+    records = get_url_records(codes)
+    totals = get_click_totals([record["url_id"] for record in records.values()])
+    misses = [code for code in codes if code not in records or totals[records[code]["url_id"]] is None]
+    if misses:
+        conn = get_connection()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            placeholders = ",".join(["%s"] * len(misses))
+            cursor.execute(f"SELECT id, code, original_url, user_id, clicks FROM urls WHERE code IN ({placeholders})",
+                           tuple(misses))
+            rows = cast(List[URLRow], cursor.fetchall())
+        finally:
+            cursor.close()
+            safe_close(conn)
+        pipe = redis_client.pipeline(transaction=False)
+        for row in rows:
+            records[row["code"]] = cache_url_record(row["code"], row["id"], row["original_url"],
+                                                    str(row["user_id"]), pipe=pipe)
+        pipe.execute()
+        totals.update(get_click_totals([row["id"] for row in rows], seeds={row["id"]: row["clicks"] for row in rows}))
+
+    stats: Dict[str, list] = {}
+    not_found: List[str] = []
+    for code in codes:
+        record = records.get(code)
+        if record is None or record["user_id"] != user_id:
+            not_found.append(code)
+        else:
+            stats[code] = [record["original_url"], totals.get(record["url_id"])]
+    logger.info(f"Batch stats retrieved for user {user_id}: {len(stats)} found, {len(not_found)} not found")
+    return jsonify({"stats": stats, "not_found": not_found})
+
+
+def _parse_time_arg(name: str) -> Optional[datetime]:
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise APIError(f"Invalid '{name}': expected an ISO 8601 date or datetime")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _lookup_url(code: str) -> Optional[URLRecord]:
+    """Cached record for a code, loaded from MySQL on a miss."""
+    record = get_url_record(code)
+    if record is not None:
+        return record
+    conn = get_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("SELECT id, original_url, user_id FROM urls WHERE code=%s", (code,))
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+        safe_close(conn)
+    if not row:
+        return None
+    return cache_url_record(code, row["id"], row["original_url"], str(row["user_id"]))  # type: ignore
+
+
+def _stream_series(summary: dict, url_id: str, granularity: str, start: datetime, end: datetime):
+    # Same document as a single page, written bucket by bucket
+    yield json.dumps(summary)[:-1] + ', "series": ['
+    for i, row in enumerate(iter_series(url_id, granularity, start, end, ANALYTICS_PAGE_SIZE)):
+        yield ("," if i else "") + json.dumps(row)
+    yield "]}"
+
 
 @app.route("/analytics/<code>", methods=["GET"])
 @jwt_required(token_type="access")
 @handle_errors
 def analytics(code: str):
+    """
+    Query params: from/to (ISO 8601, default all time), granularity (hour|day|week),
+    limit + cursor for keyset pages. Without limit/cursor the whole range is streamed.
+    """
+    granularity = request.args.get("granularity", "hour")
+    if granularity not in GRANULARITIES:
+        raise APIError(f"Invalid 'granularity': expected one of {', '.join(GRANULARITIES)}")
+    now = datetime.utcnow()
+    start = _parse_time_arg("from")
+    end = _parse_time_arg("to") or now
+    page_cursor = _parse_time_arg("cursor")
+    if page_cursor:
+        start = max(start, page_cursor) if start else page_cursor
+    paged = "limit" in request.args or page_cursor is not None
+    try:
+        limit = min(max(int(request.args.get("limit", ANALYTICS_PAGE_SIZE)), 1), ANALYTICS_MAX_PAGE_SIZE)
+    except ValueError:
+        raise APIError("Invalid 'limit': expected an integer")
+
+    record = _lookup_url(code)
+    if record is None:
+        return jsonify({"msg": "URL not found"}), 404
+    url_id = record["url_id"]
+
+    # Changes with every click or rollup of this url, and every hour (the open
+    # buckets and the unique-visitor windows move)
+    etag = make_etag(url_id, query_params(), get_analytics_version(url_id), now.strftime("%Y%m%d%H"))
+    unchanged = not_modified(etag)
+    if unchanged:
+        return unchanged
+    if paged:
+        body = get_cached_response(etag)
+        if body is not None:
+            return tag(Response(body, mimetype="application/json"), etag)
+
     conn = get_connection()
     cursor = conn.cursor(dictionary=True)
-    
-    # Get URL info
-    cursor.execute("SELECT id FROM urls WHERE code=%s", (code,))
-    row = cursor.fetchone()
-    if not row:
-        return jsonify({"msg": "URL not found"}), 404
-    url_id = row["id"]
-
-    # Fetch hourly analytics
-    cursor.execute("""
-        SELECT DATE_FORMAT(date_hour, '%%Y-%%m-%%d %%H:00') as hour, clicks, unique_visitors, suspicious_clicks
-        FROM url_analytics_hourly
-        WHERE url_id=%s
-        ORDER BY date_hour ASC
-    """, (url_id,))
-    hourly_data = cursor.fetchall()
-
-    # Fetch top referrers
-    cursor.execute("""
-        SELECT referrer, clicks
-        FROM url_referrers
-        WHERE url_id=%s
-        ORDER BY clicks DESC
-        LIMIT 10
-    """, (url_id,))
-    top_referrers = cursor.fetchall()
-    
-    cursor.close()
-    safe_close(conn)
-    return jsonify({
-        "hourly": hourly_data,
-        "top_referrers": top_referrers
-    })
+    try:
+        # Fetch top referrers
+        cursor.execute("""
+            SELECT referrer, clicks
+            FROM url_referrers
+            WHERE url_id=%s
+            ORDER BY clicks DESC
+            LIMIT 10
+        """, (url_id,))
+        top_referrers = cursor.fetchall()
+        # Whole buckets only, so closed ones can be served from the series cache, and
+        # nothing before the first click (an omitted "from" would otherwise mean 1970)
+        start, end = series_range(cursor, url_id, start, end, granularity)
+    finally:
+        cursor.close()
+        safe_close(conn)
+
+    # True distinct visitors over longer windows come from merged HyperLogLogs
+    summary = {
+        "granularity": granularity,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "top_referrers": top_referrers,
+        "unique_visitors": {
+            "last_24h": unique_visitors_between(url_id, now - timedelta(hours=23), now),
+            "last_7d": unique_visitors_between(url_id, now - timedelta(days=7, hours=-1), now),
+        },
+    }
+
+    if not paged:
+        # Whole range: stream so memory stays flat however old or busy the link is
+        return tag(Response(stream_with_context(_stream_series(summary, url_id, granularity, start, end)),
+                            mimetype="application/json"), etag)
+
+    series = series_page(url_id, granularity, start, end, limit + 1, now=now)
+    next_cursor = None
+    if len(series) > limit:
+        series = series[:limit]
+        next_cursor = next_series_start(series, granularity).isoformat()
+    response = jsonify({**summary, "series": series, "next_cursor": next_cursor})
+    cache_response(etag, response.get_data(as_text=True))
+    return tag(response, etag)
+
+
+@app.route("/export/<code>", methods=["GET"])
+@jwt_required(token_type="access")
+@handle_errors
+def export(code: str):
+    """
+    Raw clicks of one of the caller's links. Query params: from/to (ISO 8601,
+    default all time), format (ndjson|csv). Gzip-encoded when the client accepts it.
+    """
+    user_id: str = request.environ["user_id"]
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in EXPORT_FORMATS:
+        raise APIError(f"Invalid 'format': expected one of {', '.join(EXPORT_FORMATS)}")
+    start = _parse_time_arg("from") or datetime(1970, 1, 1)
+    end = _parse_time_arg("to") or datetime.utcnow()
+    limited = enforce_rate_limit("export")
+    if limited:
+        return limited
+
+    record = _lookup_url(code)
+    if record is None or record["user_id"] != user_id:
+        logger.warning(f"Export unauthorized for user {user_id}, code {code}")
+        return jsonify({"msg": "Not found or unauthorized"}), 404
+
+    compress = request.accept_encodings["gzip"] > 0
+    headers = {"Content-Disposition": f'attachment; filename="{code}-clicks.{fmt}"', "Vary": "Accept-Encoding"}
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    logger.info(f"Export started for user {user_id}, code {code} ({fmt}, gzip={compress})")
+    body = export_clicks(record["url_id"], start, end, fmt, compress)
+    return Response(stream_with_context(body), mimetype=EXPORT_FORMATS[fmt], headers=headers)
 
 
 @app.route("/trending_urls", methods=["GET"])
 @jwt_required(token_type="access")
 def get_trendings():
-    trending_json = redis_client.get("trending_urls")  # type: ignore
-    if not trending_json:
-        return jsonify([]), 200
-    return jsonify(json.loads(trending_json)), 200  # type: ignore
+    # Leaderboard sorted set, rebuilt every minute by tasks.update_trending_urls
+    return jsonify(top_trending(TRENDING_TOP_N)), 200
 
 
 
@@ -6,6 +6,10 @@ from functools import wraps
 from flask import request, jsonify
 from uuid import uuid4
 import hashlib
+import time
+from consts import JWT_CACHE_SIZE, JWT_NEGATIVE_CACHE_TTL
+from local_cache import LocalCache
+from metrics import JWT_DECODES
 PRIVATE_KEY = open(os.environ.get("JWT_PRIVATE_KEY", "private.pem"), "r").read()
 PUBLIC_KEY = open(os.environ.get("JWT_PUBLIC_KEY", "public.pem"), "r").read()
 
@@ -34,9 +38,10 @@ def hash_token(token: str) -> str:
 # ---------------------------
 # JWT Helpers
 # ---------------------------
-def create_access_token(user_id: str) -> str:
+def create_access_token(user_id: str, role: str = "user") -> str:
     payload = {
         "sub": user_id,
+        "role": role,  # rate-limit tier
         "iss": JWT_ISSUER,
         "aud": JWT_AUDIENCE,
         "iat": datetime.utcnow(),
@@ -48,9 +53,10 @@ def create_access_token(user_id: str) -> str:
     return jwt.encode(payload, PRIVATE_KEY, algorithm=JWT_ALGORITHM)
 
 
-def create_refresh_token(user_id: str,jti:str) -> str:
+def create_refresh_token(user_id: str,jti:str, role: str = "user") -> str:
     payload = {
         "sub": user_id,
+        "role": role,
         "iss": JWT_ISSUER,
         "aud": JWT_AUDIENCE,
         "iat": datetime.utcnow(),
@@ -62,7 +68,7 @@ def create_refresh_token(user_id: str,jti:str) -> str:
     return jwt.encode(payload, PRIVATE_KEY, algorithm=JWT_ALGORITHM)
 
 
-def decode_jwt(token: str):
+def _verify_jwt(token: str):
     try:
         return jwt.decode(
             token,
@@ -77,6 +83,61 @@ def decode_jwt(token: str):
         return None
 
 
+# ---------------------------
+# Verified-claims cache
+# ---------------------------
+# Polling clients present the same token many times; the RS256 check only has to
+# run once per token and process. Entries expire with the token (`exp`), failures
+# are remembered for JWT_NEGATIVE_CACHE_TTL. Keys include a fingerprint of the
+# public key, so claims verified under a rotated-out key are never served.
+_claims_cache = LocalCache("jwt_claims", maxsize=JWT_CACHE_SIZE)
+_INVALID = False  # cached verdict for a rejected token
+_key_fingerprint = ("", "")
+
+
+def _public_key_fingerprint() -> str:
+    global _key_fingerprint
+    key, fingerprint = _key_fingerprint
+    if key is not PUBLIC_KEY:
+        fingerprint = hashlib.sha256(PUBLIC_KEY.encode()).hexdigest()[:16]
+        _key_fingerprint = (PUBLIC_KEY, fingerprint)
+    return fingerprint
+
+
+def decode_jwt(token: str):
+    cache_key = hashlib.sha256(f"{_public_key_fingerprint()}:{token}".encode()).hexdigest()
+    cached = _claims_cache.get(cache_key)
+    if cached is not None:
+        # exp is re-checked: the entry may outlive the token by a clock tick
+        if cached is not _INVALID and cached["exp"] > time.time():
+            JWT_DECODES.labels(source="cache", result="valid").inc()
+            return dict(cached)
+        JWT_DECODES.labels(source="cache", result="invalid").inc()
+        return None
+
+    payload = _verify_jwt(token)
+    if payload is None:
+        JWT_DECODES.labels(source="verify", result="invalid").inc()
+        # A token that is not valid *yet* (nbf) may become valid; don't remember it
+        if not _not_yet_valid(token):
+            _claims_cache.set(cache_key, _INVALID, ttl=JWT_NEGATIVE_CACHE_TTL)
+        return None
+    JWT_DECODES.labels(source="verify", result="valid").inc()
+    exp = payload.get("exp")
+    if isinstance(exp, (int, float)) and exp > time.time():
+        _claims_cache.set(cache_key, payload, ttl=exp - time.time())
+    return dict(payload)
+
+
+def _not_yet_valid(token: str) -> bool:
+    try:
+        claims = jwt.decode(token, options={"verify_signature": False})
+    except jwt.InvalidTokenError:
+        return False
+    nbf = claims.get("nbf")
+    return isinstance(nbf, (int, float)) and nbf > time.time()
+
+
 # ---------------------------
 # JWT Decorator
 # ---------------------------
@@ -0,0 +1,136 @@
+"""
+Per-click MySQL round trips: legacy helpers vs. the single unit of work.
+
+Runs `tasks.process_click` against a counting fake connection (no MySQL or Redis
+needed) and compares it with a replica of the pre-refactor call sequence, where
+log_click, increment_hourly_analytics, update_user_sequence and
+update_url_referres each checked out, pinged, committed and reset their own
+pooled connection (click counters already live in Redis, so urls.clicks is not
+part of either side). Every simulated round trip sleeps --rtt-ms to show the effect
+on wall time.
+
+    python benchmarks/bench_click_pipeline.py --clicks 2000 --rtt-ms 0.3
+"""
+import os
+import sys
+import time
+import argparse
+from collections import Counter
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tasks import process_click  # noqa: E402
+
+
+class Stats(Counter):
+    rtt = 0.0
+
+    def hit(self, kind: str):
+        self[kind] += 1
+        if self.rtt:
+            time.sleep(self.rtt)
+
+
+class FakeCursor:
+    def __init__(self, stats: Stats):
+        self.stats = stats
+
+    def execute(self, sql, params=None):
+        self.stats.hit("statements")
+
+    def executemany(self, sql, rows):
+        self.stats.hit("statements")
+
+    def fetchone(self):
+        return None
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, stats: Stats):
+        self.stats = stats
+
+    def cursor(self, **kwargs):
+        return FakeCursor(self.stats)
+
+    def commit(self):
+        self.stats.hit("commits")
+
+    def close(self):
+        # pool_reset_session=True sends COM_RESET_CONNECTION on every return to the pool
+        self.stats.hit("session_resets")
+
+
+def fake_get_connection(stats: Stats):
+    def get_connection():
+        stats["checkouts"] += 1
+        stats.hit("pings")  # db.get_connection pings every checkout
+        return FakeConnection(stats)
+    return get_connection
+
+
+def legacy_click(get_connection):
+    """Replica of the per-click statements issued before the refactor."""
+    def unit(*statements):
+        conn = get_connection()
+        cursor = conn.cursor()
+        for sql in statements:
+            cursor.execute(sql)
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+    unit("INSERT INTO url_clicks")                                        # write_clicks
+    unit("SELECT 1 FROM urls", "INSERT INTO url_analytics_hourly")        # increment_hourly_analytics
+    unit("SELECT sequence FROM user_sequences", "UPDATE user_sequences")  # update_user_sequence
+    unit("INSERT INTO url_referrers")                                     # update_url_referres
+
+
+def run(clicks: int, rtt: float, fn) -> Stats:
+    stats = Stats()
+    stats.rtt = rtt
+    get_connection = fake_get_connection(stats)
+    # Every Redis call on the write path is stubbed out: MySQL round trips only
+    with patch("click_writer.get_connection", get_connection), \
+         patch("analytics.get_connection", get_connection), \
+         patch("click_writer.redis_client"), \
+         patch("click_writer.record_clicks"), \
+         patch("click_writer.record_trending"), \
+         patch("tasks.track_unique_visitor"):
+        started = time.perf_counter()
+        for _ in range(clicks):
+            fn(get_connection)
+        stats["elapsed_ms"] = int((time.perf_counter() - started) * 1000)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clicks", type=int, default=1000)
+    parser.add_argument("--rtt-ms", type=float, default=0.2, help="simulated MySQL round-trip time")
+    args = parser.parse_args()
+    rtt = args.rtt_ms / 1000
+
+    legacy = run(args.clicks, rtt, legacy_click)
+    current = run(args.clicks, rtt, lambda _: process_click(
+        "url-1", "203.0.113.7", "Mozilla/5.0", "https://ref.example", "f" * 64,
+    ))
+
+    kinds = ["checkouts", "pings", "statements", "commits", "session_resets"]
+    print(f"{args.clicks} clicks, simulated RTT {args.rtt_ms} ms\n")
+    print(f"{'per click':<16}{'legacy':>10}{'current':>10}")
+    for kind in kinds:
+        print(f"{kind:<16}{legacy[kind] / args.clicks:>10.1f}{current[kind] / args.clicks:>10.1f}")
+    round_trips = lambda s: sum(s[k] for k in kinds if k != "checkouts")
+    print(f"{'round trips':<16}{round_trips(legacy) / args.clicks:>10.1f}{round_trips(current) / args.clicks:>10.1f}")
+    print(f"{'wall time (ms)':<16}{legacy['elapsed_ms']:>10}{current['elapsed_ms']:>10}")
+
+
+if __name__ == "__main__":
+    main()
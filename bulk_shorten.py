@@ -0,0 +1,127 @@
+"""
+Bulk link creation (POST /shorten/bulk).
+
+A batch is validated up front, inserted with multi-row INSERT statements in one
+transaction and cached with one Redis pipeline. Generated codes come from
+code_allocator and are known to be free, so a chunk normally fails only on a
+requested code that is already taken; that chunk is then inserted row by row and
+the rows that still fail are reported. Failed items are not retried.
+"""
+import re
+import logging
+from typing import Dict, List, Optional, Set
+from uuid import uuid4
+
+import validators
+import mysql.connector
+from db import get_connection, safe_close, redis_client
+from url_cache import register_new_urls
+from code_allocator import allocate_codes
+from url_dedupe import url_hash, remember_code
+from consts import SHORTEN_BULK_INSERT_ROWS
+
+logger = logging.getLogger(__name__)
+
+# urls.code is VARCHAR(10); requested codes must also be safe in a URL path
+CUSTOM_CODE = re.compile(r"[A-Za-z0-9_-]{1,10}")
+INSERT_SQL = "INSERT INTO urls (id, code, original_url, user_id, url_hash) VALUES "
+ROW_PLACEHOLDERS = "(%s, %s, %s, %s, %s)"
+
+def valid_custom_code(code) -> bool:
+    """Whether a requested code can be stored as-is (also used by /shorten)."""
+    return isinstance(code, str) and CUSTOM_CODE.fullmatch(code) is not None
+
+def _chunks(items: list):
+    for i in range(0, len(items), SHORTEN_BULK_INSERT_ROWS):
+        yield items[i:i + SHORTEN_BULK_INSERT_ROWS]
+
+
+def _values(row: Dict, user_id: str) -> tuple:
+    return (row["id"], row["code"], row["url"], user_id, row["hash"])
+
+
+def _insert(cursor, rows: List[Dict], user_id: str) -> Set[str]:
+    """Insert the rows, chunk by chunk; returns the ids that were stored."""
+    stored: Set[str] = set()
+    for chunk in _chunks(rows):
+        try:
+            cursor.execute(INSERT_SQL + ", ".join([ROW_PLACEHOLDERS] * len(chunk)),
+                           tuple(v for row in chunk for v in _values(row, user_id)))
+            stored.update(row["id"] for row in chunk)
+            continue
+        except mysql.connector.IntegrityError:
+            # Only the failed statement is rolled back; find the offending rows one at a time
+            pass
+        for row in chunk:
+            try:
+                cursor.execute(INSERT_SQL + ROW_PLACEHOLDERS, _values(row, user_id))
+                stored.add(row["id"])
+            except mysql.connector.IntegrityError:
+                logger.info(f"Bulk shorten by user {user_id}: code {row['code']} already exists")
+    return stored
+
+
+def shorten_batch(items: list, user_id: str) -> List[Dict]:
+    """
+    Create links for `items` ({"url": ..., "code": optional}). Returns one result
+    per item, in order: {"url", "code"} on success, {"url", "error"} otherwise,
+    with error one of invalid_url, invalid_code, duplicate_code, code_taken,
+    code_collision.
+    """
+    results: List[Optional[Dict]] = [None] * len(items)
+    # urls.code compares case-insensitively, so "Abc" and "abc" are the same code
+    requested = {item["code"].lower() for item in items if isinstance(item, dict) and isinstance(item.get("code"), str)}
+    seen: Set[str] = set()
+    pending: List[Dict] = []
+    for index, item in enumerate(items):
+        url = item.get("url") if isinstance(item, dict) else None
+        code = item.get("code") if isinstance(item, dict) else None
+        if not isinstance(url, str) or not validators.url(url):
+            results[index] = {"url": url, "error": "invalid_url"}
+        elif code not in (None, "") and not valid_custom_code(code):
+            results[index] = {"url": url, "error": "invalid_code"}
+        elif code and code.lower() in seen:
+            results[index] = {"url": url, "error": "duplicate_code"}
+        else:
+            if code:
+                seen.add(code.lower())
+            pending.append({"index": index, "url": url, "custom": bool(code), "code": code})
+
+    generated = [row for row in pending if not row["custom"]]
+    if generated:
+        codes: List[str] = []
+        while len(codes) < len(generated):
+            # Skip allocated codes someone in this batch asked for (they would be ignored)
+            codes += [code for code in allocate_codes(len(generated) - len(codes)) if code.lower() not in requested]
+        for row, code in zip(generated, codes):
+            row["code"] = code
+    for row in pending:
+        row["id"] = str(uuid4())
+        row["hash"] = url_hash(user_id, row["url"])
+
+    created: List[Dict] = []
+    if pending:
+        conn = get_connection()
+        cursor = conn.cursor()
+        try:
+            stored = _insert(cursor, pending, user_id)
+            conn.commit()
+        finally:
+            cursor.close()
+            safe_close(conn)
+        for row in pending:
+            if row["id"] in stored:
+                created.append(row)
+            else:
+                # Only requested codes can be taken; an allocated one means a concurrent custom code won the race
+                results[row["index"]] = {"url": row["url"], "error": "code_taken" if row["custom"] else "code_collision"}
+
+    for row in created:
+        results[row["index"]] = {"url": row["url"], "code": row["code"]}
+    pipe = redis_client.pipeline(transaction=False)
+    register_new_urls([(row["code"], row["id"], row["url"], user_id) for row in created], pipe=pipe)
+    for row in created:
+        remember_code(row["hash"], row["code"], pipe=pipe)
+    pipe.execute()
+    logger.info(f"Bulk shorten by user {user_id}: {len(created)} created, {len(items) - len(created)} failed")
+    return results  # type: ignore
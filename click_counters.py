@@ -0,0 +1,164 @@
+"""
+Live click counters in Redis, flushed to urls.clicks in bulk.
+
+    clicks:pending   url_id -> clicks not yet written to MySQL (HINCRBY per click batch)
+    clicks:flushing  snapshot of clicks:pending taken by the running flush
+    clicks:base      url_id -> urls.clicks as of the last flush that touched it
+
+The live total is base + pending + flushing, so /stats never has to read MySQL
+once a URL has been seeded. A flush renames pending to flushing (snapshot-and-swap),
+applies it in one MySQL transaction that also records the flush id in
+click_counter_flushes, then drops the snapshot. A crash at any point leaves the
+snapshot behind; the next run finishes it, and the ledger makes the MySQL update
+happen exactly once.
+"""
+import logging
+from typing import Dict, List, Optional, Tuple
+from uuid import uuid4
+
+import mysql.connector
+from db import redis_client, get_connection, safe_close
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = "clicks:pending"
+FLUSHING_KEY = "clicks:flushing"
+FLUSH_ID_KEY = "clicks:flushing:id"
+BASE_KEY = "clicks:base"
+
+FLUSH_CHUNK_SIZE = 1000
+
+# Resume an unfinished snapshot, or atomically move pending -> flushing under a new id
+_SNAPSHOT_SCRIPT = redis_client.register_script("""
+local existing = redis.call('GET', KEYS[3])
+if existing and redis.call('EXISTS', KEYS[2]) == 1 then
+    return existing
+end
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+redis.call('RENAME', KEYS[1], KEYS[2])
+redis.call('SET', KEYS[3], ARGV[1])
+return ARGV[1]
+""")
+
+# Publish the new MySQL totals and drop the snapshot in one step
+_FINISH_SCRIPT = redis_client.register_script("""
+for i = 1, #ARGV, 2 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('DEL', KEYS[2], KEYS[3])
+return 1
+""")
+
+
+def build_click_increment(counts: Dict[str, int]) -> Tuple[str, tuple]:
+    """Fold per-URL click deltas into one `UPDATE urls ... CASE` statement."""
+    cases = " ".join(["WHEN %s THEN %s"] * len(counts))
+    placeholders = ",".join(["%s"] * len(counts))
+    sql = f"UPDATE urls SET clicks = clicks + CASE id {cases} ELSE 0 END WHERE id IN ({placeholders})"
+    params = tuple(v for pair in counts.items() for v in pair) + tuple(counts)
+    return sql, params
+
+
+# ---------------------------
+# Live counters
+# ---------------------------
+def record_clicks(counts: Dict[str, int], pipe=None) -> None:
+    """Add click deltas per url_id (one pipelined round trip)."""
+    client = pipe if pipe is not None else redis_client.pipeline(transaction=False)
+    for url_id, delta in counts.items():
+        client.hincrby(PENDING_KEY, url_id, delta)
+    if pipe is None:
+        client.execute()
+
+
+def _read_total(url_id: str, seed: Optional[int] = None) -> Optional[int]:
+    pipe = redis_client.pipeline(transaction=False)
+    if seed is not None:
+        pipe.hsetnx(BASE_KEY, url_id, seed)
+    pipe.hget(BASE_KEY, url_id)
+    pipe.hget(PENDING_KEY, url_id)
+    pipe.hget(FLUSHING_KEY, url_id)
+    base, pending, flushing = pipe.execute()[-3:]
+    if base is None:
+        return None
+    return int(base) + int(pending or 0) + int(flushing or 0)
+
+
+def get_click_total(url_id: str) -> Optional[int]:
+    """Live click total from Redis, or None if this URL has not been seeded yet."""
+    return _read_total(url_id)
+
+
+def seed_click_total(url_id: str, db_clicks: int) -> int:
+    """Seed the base from urls.clicks (no-op if a flush already set it) and return the live total."""
+    return _read_total(url_id, seed=db_clicks)  # type: ignore
+
+
+def get_click_totals(url_ids: List[str], seeds: Optional[Dict[str, int]] = None) -> Dict[str, Optional[int]]:
+    """
+    Live totals for many URLs in one round trip (one HMGET per hash), seeding
+    the base from `seeds` (url_id -> urls.clicks) first. None means not seeded yet.
+    """
+    if not url_ids:
+        return {}
+    pipe = redis_client.pipeline(transaction=False)
+    for url_id, clicks in (seeds or {}).items():
+        pipe.hsetnx(BASE_KEY, url_id, clicks)
+    pipe.hmget(BASE_KEY, url_ids)
+    pipe.hmget(PENDING_KEY, url_ids)
+    pipe.hmget(FLUSHING_KEY, url_ids)
+    bases, pendings, flushings = pipe.execute()[-3:]
+    return {
+        url_id: None if base is None else int(base) + int(pending or 0) + int(flushing or 0)
+        for url_id, base, pending, flushing in zip(url_ids, bases, pendings, flushings)
+    }
+
+
+# ---------------------------
+# Flush to MySQL
+# ---------------------------
+def _chunks(items: List[str]):
+    for i in range(0, len(items), FLUSH_CHUNK_SIZE):
+        yield items[i:i + FLUSH_CHUNK_SIZE]
+
+
+def flush_pending() -> int:
+    """Apply pending deltas to urls.clicks. Returns the number of clicks written."""
+    flush_id = _SNAPSHOT_SCRIPT(keys=[PENDING_KEY, FLUSHING_KEY, FLUSH_ID_KEY], args=[str(uuid4())])
+    if not flush_id:
+        return 0
+    snapshot: Dict[str, str] = redis_client.hgetall(FLUSHING_KEY)  # type: ignore
+    deltas = {url_id: int(v) for url_id, v in snapshot.items() if int(v)}
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    totals: List[str] = []
+    try:
+        try:
+            cursor.execute("INSERT INTO click_counter_flushes (id) VALUES (%s)", (flush_id,))
+            applied_before = False
+        except mysql.connector.errors.IntegrityError:
+            # A previous run committed this snapshot but died before dropping it
+            applied_before = True
+
+        ids = list(deltas)
+        for chunk in _chunks(ids):
+            if not applied_before:
+                cursor.execute(*build_click_increment({url_id: deltas[url_id] for url_id in chunk}))
+            placeholders = ",".join(["%s"] * len(chunk))
+            cursor.execute(f"SELECT id, clicks FROM urls WHERE id IN ({placeholders})", tuple(chunk))
+            for url_id, clicks in cursor.fetchall():
+                totals += [url_id, str(clicks)]  # type: ignore
+
+        cursor.execute("DELETE FROM click_counter_flushes WHERE flushed_at < NOW() - INTERVAL 1 DAY")
+        conn.commit()
+    finally:
+        cursor.close()
+        safe_close(conn)
+
+    _FINISH_SCRIPT(keys=[BASE_KEY, FLUSHING_KEY, FLUSH_ID_KEY], args=totals)
+    written = 0 if applied_before else sum(deltas.values())
+    logger.info(f"Flushed {written} clicks for {len(deltas)} URLs (flush {flush_id})")
+    return written
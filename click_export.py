@@ -0,0 +1,103 @@
+"""
+Raw click export for link owners (GET /export/<code>).
+
+Rows are read in keyset chunks ordered by (clicked_at, id), which the
+(url_id, clicked_at) index serves directly since InnoDB appends the primary key.
+Each chunk streams through an unbuffered cursor on a pooled connection that is
+returned as soon as the chunk is read, so a slow download never pins a
+connection and memory stays at one chunk however many rows are exported.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from db import get_connection, safe_close
+from consts import EXPORT_CHUNK_SIZE
+
+EXPORT_COLUMNS = ("id", "clicked_at", "ip", "user_agent", "referrer", "fingerprint")
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+WRITE_SIZE = 64 * 1024  # rows are handed to the server in pieces of about this many characters
+
+
+def _read_chunk(url_id: str, start: datetime, end: datetime, after: Optional[Tuple[datetime, str]],
+                chunk_size: int) -> List[tuple]:
+    sql = f"SELECT {', '.join(EXPORT_COLUMNS)} FROM url_clicks WHERE url_id = %s AND clicked_at < %s AND "
+    if after is None:
+        sql += "clicked_at >= %s"
+        params: tuple = (url_id, end, start)
+    else:
+        sql += "(clicked_at > %s OR (clicked_at = %s AND id > %s))"
+        params = (url_id, end, after[0], after[0], after[1])
+    sql += " ORDER BY clicked_at, id LIMIT %s"
+
+    conn = get_connection()
+    cursor = conn.cursor(buffered=False)
+    try:
+        cursor.execute(sql, params + (chunk_size,))
+        return list(cursor)
+    finally:
+        cursor.close()
+        safe_close(conn)
+
+
+def iter_clicks(url_id: str, start: datetime, end: datetime,
+                chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[tuple]:
+    """Every click of a url in [start, end), oldest first, as EXPORT_COLUMNS tuples."""
+    after = None
+    while True:
+        rows = _read_chunk(url_id, start, end, after, chunk_size)
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        after = (rows[-1][1], rows[-1][0])
+
+
+def _isoformat(row: tuple) -> tuple:
+    return tuple(value.isoformat() if isinstance(value, datetime) else value for value in row)
+
+
+def to_ndjson(rows: Iterable[tuple]) -> Iterator[str]:
+    lines: List[str] = []
+    size = 0
+    for row in rows:
+        line = json.dumps(dict(zip(EXPORT_COLUMNS, _isoformat(row)))) + "\n"
+        lines.append(line)
+        size += len(line)
+        if size >= WRITE_SIZE:
+            yield "".join(lines)
+            lines, size = [], 0
+    yield "".join(lines)
+
+
+def to_csv(rows: Iterable[tuple]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        writer.writerow(_isoformat(row))
+        # Hand out what the writer produced so far, then reuse the buffer
+        if buffer.tell() >= WRITE_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def gzipped(chunks: Iterable[str]) -> Iterator[bytes]:
+    """Gzip a text stream incrementally (one compressor, no buffering of the whole body)."""
+    compressor = zlib.compressobj(wbits=31)  # 16 + MAX_WBITS: gzip header and trailer
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_clicks(url_id: str, start: datetime, end: datetime, fmt: str, compress: bool = False) -> Iterator:
+    """The export body for one url, in `fmt` (see EXPORT_FORMATS)."""
+    rows = iter_clicks(url_id, start, end)
+    body = to_csv(rows) if fmt == "csv" else to_ndjson(rows)
+    return gzipped(body) if compress else body
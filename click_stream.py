@@ -0,0 +1,197 @@
+"""
+Redis Streams click ingest (CLICK_INGEST_MODE=stream).
+
+The redirect handler appends one compact event per click with `publish_click`.
+Consumers in the `click-workers` group read events in batches and run logging,
+enrichment and fraud checks. Start as many consumers as needed, on any host:
+
+    python click_stream.py [consumer-name]
+
+url_clicks rows and counter updates are buffered in a ClickBatchWriter and
+written per batch; events are acked only after the batch holding them commits.
+Row ids derive from stream entry ids, so an event replayed after a failed flush
+or a crash is recognised and not counted again. Fraud checks run once per event,
+after its ack, and are not retried.
+Each consumer also reclaims entries left pending by crashed consumers; entries
+that keep failing are moved to a dead-letter stream instead of looping forever.
+"""
+import os
+import sys
+from datetime import datetime
+import time
+import socket
+import logging
+from typing import Dict, List, Optional, Tuple
+from uuid import NAMESPACE_URL, uuid5
+
+import redis
+from db import redis_client
+from tasks import process_click, detect_fraud
+from click_writer import ClickBatchWriter, retry_unsent_counters
+from consts import (
+    CLICK_STREAM_MAXLEN, CLICK_STREAM_BATCH_SIZE, CLICK_STREAM_BLOCK_MS,
+    CLICK_STREAM_CLAIM_IDLE_MS, CLICK_STREAM_MAX_DELIVERIES,
+)
+
+logger = logging.getLogger(__name__)
+
+STREAM_KEY = "clicks:stream"
+DEAD_LETTER_KEY = "clicks:dead"
+GROUP = "click-workers"
+
+Event = Tuple[str, Dict[str, str]]
+
+
+# ---------------------------
+# Producer (redirect path)
+# ---------------------------
+def publish_click(url_id: str, code: str, ip: Optional[str], user_agent: Optional[str],
+                  referrer: Optional[str], fingerprint: str, request_reasons: Optional[List[str]] = None) -> None:
+    """
+    Append one click event to the stream (single XADD, trimmed approximately).
+    `request_reasons` are the request-rule reason codes found by the redirect handler.
+    """
+    redis_client.xadd(
+        STREAM_KEY,
+        {
+            "u": url_id,
+            "c": code,
+            "ip": ip or "",
+            "ua": user_agent or "",
+            "r": referrer or "",
+            "fp": fingerprint,
+            "t": f"{time.time():.3f}",
+            "rr": ",".join(request_reasons or []),
+        },
+        maxlen=CLICK_STREAM_MAXLEN,
+        approximate=True,
+    )
+
+
+# ---------------------------
+# Consumer
+# ---------------------------
+def ensure_group() -> None:
+    try:
+        redis_client.xgroup_create(STREAM_KEY, GROUP, id="0", mkstream=True)
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def click_id(event_id: str) -> str:
+    """url_clicks.id for a stream entry: the same on every delivery of the event."""
+    return str(uuid5(NAMESPACE_URL, f"{STREAM_KEY}/{event_id}"))
+
+
+def handle_events(events: List[Event], writer: Optional[ClickBatchWriter] = None) -> List[str]:
+    """Log the clicks of a batch of events; returns the ids that were handled (ack after `writer` flushes)."""
+    done = []
+    for event_id, fields in events:
+        try:
+            clicked_at = datetime.utcfromtimestamp(float(fields["t"])) if fields.get("t") else None
+            process_click(fields["u"], fields["ip"], fields.get("ua") or None, fields.get("r") or None,  # type: ignore
+                          fields["fp"], clicked_at, writer, click_id(event_id))
+            done.append(event_id)
+        except Exception as e:
+            # Left pending; reclaimed after CLICK_STREAM_CLAIM_IDLE_MS
+            logger.error(f"Error processing click event {event_id}: {e}", exc_info=True)
+    return done
+
+
+def check_events(events: List[Event]) -> None:
+    """Fraud checks for acked events. Not retried: replaying the event would log its click again."""
+    for event_id, fields in events:
+        try:
+            # Events queued before "rr" existed get their request rules evaluated here
+            request_reasons = [r for r in fields["rr"].split(",") if r] if "rr" in fields else None
+            # Score the click at its own time: a batch checked late or after a reclaim is not a burst
+            clicked_at = float(fields["t"]) if fields.get("t") else None
+            detect_fraud(fields["ip"], fields["c"], fields.get("ua") or None, fields.get("r") or None,  # type: ignore
+                         fields["fp"], fields["u"], request_reasons, clicked_at)
+        except Exception as e:
+            logger.error(f"Error checking click event {event_id} for fraud: {e}", exc_info=True)
+
+
+def ack(event_ids: List[str]) -> None:
+    if event_ids:
+        redis_client.xack(STREAM_KEY, GROUP, *event_ids)
+
+
+def reclaim_stale(consumer: str) -> List[Event]:
+    """
+    Take over entries other consumers read but never acked.
+    Entries delivered too many times are dead-lettered and acked.
+    """
+    pending = redis_client.xpending_range(
+        STREAM_KEY, GROUP, min="-", max="+", count=CLICK_STREAM_BATCH_SIZE,
+        idle=CLICK_STREAM_CLAIM_IDLE_MS,
+    )
+    if not pending:
+        return []
+
+    poisoned = [p["message_id"] for p in pending if p["times_delivered"] >= CLICK_STREAM_MAX_DELIVERIES]  # type: ignore
+    retry = [p["message_id"] for p in pending if p["times_delivered"] < CLICK_STREAM_MAX_DELIVERIES]  # type: ignore
+
+    if poisoned:
+        pipe = redis_client.pipeline(transaction=False)
+        for event_id in poisoned:
+            pipe.xrange(STREAM_KEY, min=event_id, max=event_id)
+        for entries in pipe.execute():
+            for event_id, fields in entries:
+                redis_client.xadd(DEAD_LETTER_KEY, {**fields, "id": event_id}, maxlen=CLICK_STREAM_MAXLEN, approximate=True)
+        ack(poisoned)
+        logger.warning(f"Dead-lettered {len(poisoned)} click events after {CLICK_STREAM_MAX_DELIVERIES} deliveries")
+
+    if not retry:
+        return []
+    claimed = redis_client.xclaim(STREAM_KEY, GROUP, consumer, CLICK_STREAM_CLAIM_IDLE_MS, retry)
+    # Entries trimmed from the stream come back without fields; nothing left to process
+    ack([event_id for event_id, fields in claimed if not fields])  # type: ignore
+    return [(event_id, fields) for event_id, fields in claimed if fields]  # type: ignore
+
+
+def read_batch(consumer: str, block_ms: int = CLICK_STREAM_BLOCK_MS) -> List[Event]:
+    response = redis_client.xreadgroup(
+        GROUP, consumer, {STREAM_KEY: ">"},
+        count=CLICK_STREAM_BATCH_SIZE, block=block_ms,
+    )
+    if not response:
+        return []
+    return response[0][1]  # type: ignore
+
+
+def run_consumer(consumer: str) -> None:
+    ensure_group()
+    writer = ClickBatchWriter()
+    # Handled events waiting for their batch to commit (keyed by id: a reclaim can deliver one twice)
+    unacked: Dict[str, Event] = {}
+    logger.info(f"Click stream consumer {consumer} started")
+    while True:
+        try:
+            # Never block past the point where the buffered batch is due
+            block_ms = max(1, int(writer.time_until_due() * 1000)) if len(writer) else CLICK_STREAM_BLOCK_MS
+            events = reclaim_stale(consumer) + read_batch(consumer, block_ms)
+            handled = set(handle_events(events, writer))
+            unacked.update((event_id, fields) for event_id, fields in events if event_id in handled)
+            if writer.due():
+                writer.flush()
+                ack(list(unacked))
+                acked, unacked = list(unacked.items()), {}
+                check_events(acked)
+            elif not len(writer):
+                # Idle: counter increments kept from a Redis outage shouldn't wait for the next click
+                retry_unsent_counters()
+        except redis.RedisError as e:
+            logger.error(f"Redis error in click consumer: {e}")
+            time.sleep(1)
+        except Exception as e:
+            # Failed flush: rows stay buffered and events stay pending until the next attempt
+            logger.error(f"Error flushing click batch: {e}", exc_info=True)
+            time.sleep(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    name = sys.argv[1] if len(sys.argv) > 1 else f"{socket.gethostname()}-{os.getpid()}"
+    run_consumer(name)
@@ -0,0 +1,183 @@
+import time
+import logging
+import threading
+from collections import Counter as TallyCounter
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+import redis
+from db import get_connection, safe_close, redis_client
+from click_counters import record_clicks
+from trending import record_trending
+from consts import CLICK_BATCH_MAX_ROWS, CLICK_BATCH_FLUSH_MS
+from metrics import CLICK_BATCH_ROWS, CLICK_BATCH_FLUSH_LATENCY
+
+logger = logging.getLogger(__name__)
+
+# (id, url_id, fingerprint, ip, user_agent, referrer, clicked_at)
+ClickRow = Tuple[str, str, Optional[str], Optional[str], Optional[str], Optional[str], datetime]
+
+
+def make_click_row(url_id: str, ip: Optional[str], user_agent: Optional[str], referrer: Optional[str],
+                   fingerprint: Optional[str], clicked_at: Optional[datetime] = None,
+                   click_id: Optional[str] = None) -> ClickRow:
+    """`click_id` makes the row id deterministic (stream events), so a replay maps to the same row."""
+    return (click_id or str(uuid4()), url_id, fingerprint, ip, user_agent, referrer, clicked_at or datetime.utcnow())
+
+
+def write_clicks(rows: List[ClickRow], in_transaction: Optional[Callable] = None) -> List[ClickRow]:
+    """
+    Persist clicks with one multi-row INSERT, then add the per-URL counts to the
+    live Redis counters (flushed to urls.clicks in bulk by click_counters) and the
+    hourly trending buckets, in one pipeline (kept for the next call if Redis fails).
+    Rows whose id is already stored (a replayed event) are skipped, so writing the
+    same rows twice changes nothing. `in_transaction(cursor, new_rows)` runs extra
+    statements on the same connection before the commit. Returns the new rows.
+    """
+    # Keep one row per id; a reclaimed event can be buffered again before its first write lands
+    unique: Dict[str, ClickRow] = {}
+    for row in rows:
+        unique.setdefault(row[0], row)
+    rows = list(unique.values())
+    if not rows:
+        return []
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        placeholders = ",".join(["%s"] * len(rows))
+        cursor.execute(f"SELECT id FROM url_clicks WHERE id IN ({placeholders})", tuple(row[0] for row in rows))
+        stored = {click_id for (click_id,) in cursor.fetchall()}
+        new_rows = [row for row in rows if row[0] not in stored]
+        if new_rows:
+            # mysql-connector rewrites executemany INSERTs into a single multi-row statement
+            cursor.executemany(
+                """
+                INSERT INTO url_clicks (id, url_id, fingerprint, ip, user_agent, referrer, clicked_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                """,
+                new_rows,
+            )
+        if in_transaction is not None:
+            in_transaction(cursor, new_rows)
+        conn.commit()
+    finally:
+        cursor.close()
+        safe_close(conn)
+
+    _update_counters(new_rows)
+    return new_rows
+
+
+# Counter increments whose pipeline failed. The rows are committed, so replaying
+# the batch would duplicate them; the deltas are kept here and sent with the next one.
+_unsent_lock = threading.Lock()
+_unsent_counts: TallyCounter = TallyCounter()    # url_id -> clicks
+_unsent_trending: TallyCounter = TallyCounter()  # (url_id, click hour) -> clicks
+
+
+def _update_counters(rows: List[ClickRow]) -> None:
+    with _unsent_lock:
+        counts = _unsent_counts + TallyCounter(row[1] for row in rows)
+        trending = _unsent_trending + TallyCounter(
+            (row[1], row[6].replace(minute=0, second=0, microsecond=0)) for row in rows)
+        _unsent_counts.clear()
+        _unsent_trending.clear()
+    if not counts:
+        return
+    try:
+        # MULTI/EXEC: either every increment lands or none does, so a retry never double counts
+        pipe = redis_client.pipeline()
+        record_clicks(dict(counts), pipe)
+        record_trending(trending.elements(), pipe)
+        pipe.execute()
+    except redis.RedisError as e:
+        with _unsent_lock:
+            _unsent_counts.update(counts)
+            _unsent_trending.update(trending)
+        logger.error(f"Failed to update live click counters, retrying {sum(counts.values())} clicks "
+                     f"with the next batch: {e}")
+
+
+def retry_unsent_counters() -> None:
+    """Send counter increments left over from a failed pipeline (no-op when there are none)."""
+    _update_counters([])
+
+
+class ClickBatchWriter:
+    """
+    Buffers clicks and writes them with `write_clicks` once CLICK_BATCH_MAX_ROWS rows
+    are queued or the oldest row has waited CLICK_BATCH_FLUSH_MS. The owner drives
+    flushing (see `due`/`flush`), so it can acknowledge inputs only after a commit.
+    Each row may carry hooks: `in_transaction(cursor)` runs in the batch transaction
+    and `after_commit()` after it, both only if the row was not stored already.
+    """
+
+    def __init__(self, max_rows: int = CLICK_BATCH_MAX_ROWS, flush_ms: int = CLICK_BATCH_FLUSH_MS):
+        self.max_rows = max_rows
+        self.flush_ms = flush_ms
+        self._rows: List[ClickRow] = []
+        self._hooks: Dict[str, Tuple[Optional[Callable], Optional[Callable]]] = {}
+        self._first_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def add(self, row: ClickRow, in_transaction: Optional[Callable] = None,
+            after_commit: Optional[Callable] = None) -> None:
+        with self._lock:
+            if not self._rows:
+                self._first_at = time.monotonic()
+            self._rows.append(row)
+            self._hooks.setdefault(row[0], (in_transaction, after_commit))
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def time_until_due(self) -> float:
+        """Seconds until the buffer must be flushed (0 if due, flush interval if empty)."""
+        if self._first_at is None:
+            return self.flush_ms / 1000
+        if len(self._rows) >= self.max_rows:
+            return 0
+        return max(0.0, self._first_at + self.flush_ms / 1000 - time.monotonic())
+
+    def due(self) -> bool:
+        return bool(self._rows) and self.time_until_due() == 0
+
+    def flush(self) -> int:
+        with self._lock:
+            rows, self._rows, self._first_at = self._rows, [], None
+            hooks, self._hooks = self._hooks, {}
+        if not rows:
+            return 0
+
+        def run_in_transaction(cursor, new_rows: List[ClickRow]) -> None:
+            # The hooks lock user_sequences rows per fingerprint (SELECT ... FOR UPDATE); taking
+            # them in key order keeps concurrent flushes from deadlocking. The sort is stable, so
+            # one visitor's clicks still reach their sequence in event order.
+            for row in sorted(new_rows, key=lambda row: row[2] or ""):
+                in_transaction = hooks[row[0]][0]
+                if in_transaction is not None:
+                    in_transaction(cursor)
+
+        started = time.perf_counter()
+        try:
+            new_rows = write_clicks(rows, in_transaction=run_in_transaction)
+        except Exception:
+            # Put the rows back so the next flush retries them
+            with self._lock:
+                self._rows = rows + self._rows
+                self._hooks = {**hooks, **self._hooks}
+                self._first_at = time.monotonic()
+            raise
+        CLICK_BATCH_FLUSH_LATENCY.observe(time.perf_counter() - started)
+        CLICK_BATCH_ROWS.observe(len(rows))
+        for row in new_rows:
+            after_commit = hooks[row[0]][1]
+            if after_commit is None:
+                continue
+            try:
+                after_commit()
+            except Exception as e:
+                # The batch is committed; a failed side effect must not replay it
+                logger.error(f"Post-commit click hook failed for {row[0]}: {e}")
+        return len(rows)
@@ -0,0 +1,113 @@
+"""
+Collision-free short codes.
+
+Every worker leases blocks of CODE_BLOCK_SIZE sequence numbers with one INCR on
+codes:next_block, so no two workers ever hold the same number. A number maps to
+an 8-character base36 code through a fixed bijection of [0, 36^8), so codes do
+not look sequential and the same code is never produced twice. (The mapping is
+scrambling, not secrecy; codes are not meant to be unguessable.) urls.code
+compares case-insensitively, which is why the alphabet has a single case: two
+codes differing only in case would be the same key.
+
+Codes created by other means (custom codes, older random codes) share the same
+space and may use any case, so each new block is checked once when it is leased
+with a single `WHERE code IN (...)` query, matched case-insensitively. (The Bloom
+filter is exact-case, so it cannot clear a code whose case variant exists.)
+Taken codes are skipped; an INSERT with an allocated code can then only fail if
+a custom code claims it between the lease and the insert.
+"""
+import os
+import logging
+import threading
+from collections import deque
+from typing import Deque, List, Optional
+
+from db import redis_client, get_connection, safe_close
+from consts import CODE_BLOCK_SIZE
+from metrics import CODE_ALLOCATOR_CODES
+
+logger = logging.getLogger(__name__)
+
+BLOCK_KEY = "codes:next_block"
+
+ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyz"
+CODE_LENGTH = 8
+CODE_SPACE = len(ALPHABET) ** CODE_LENGTH
+
+# n -> (n * MULTIPLIER + OFFSET) mod 36^8 is a bijection because the multiplier
+# shares no factor with 36 (it is odd and not a multiple of 3).
+# Changing either constant after codes were issued would re-issue numbers as new codes.
+MULTIPLIER = 1_578_472_964_393
+OFFSET = 91_734_210_553_017 % CODE_SPACE
+assert MULTIPLIER % 2 and MULTIPLIER % 3
+
+
+def encode(n: int) -> str:
+    """Code for sequence number `n`."""
+    n = (n * MULTIPLIER + OFFSET) % CODE_SPACE
+    chars = []
+    for _ in range(CODE_LENGTH):
+        n, digit = divmod(n, len(ALPHABET))
+        chars.append(ALPHABET[digit])
+    return "".join(reversed(chars))
+
+
+def _taken(codes: List[str]) -> set:
+    """The codes (lowercased) that already exist in any case."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        placeholders = ",".join(["%s"] * len(codes))
+        cursor.execute(f"SELECT code FROM urls WHERE code IN ({placeholders})", tuple(codes))
+        # The collation matches "AbC" for "abc"; the returned spelling is the stored one
+        return {code.lower() for (code,) in cursor.fetchall()}
+    finally:
+        cursor.close()
+        safe_close(conn)
+
+
+def lease_block(size: int = CODE_BLOCK_SIZE) -> List[str]:
+    """Lease the next block of sequence numbers; returns its codes that are still free."""
+    block = int(redis_client.incr(BLOCK_KEY))  # type: ignore
+    # Block 0 is never leased, INCR starts at 1
+    start = block * size
+    if start + size > CODE_SPACE:
+        raise RuntimeError("Short-code space exhausted")
+    codes = [encode(n) for n in range(start, start + size)]
+    taken = _taken(codes)
+    if taken:
+        logger.info(f"Skipping {len(taken)} taken codes in block {block}")
+    CODE_ALLOCATOR_CODES.labels(result="skipped").inc(len(taken))
+    CODE_ALLOCATOR_CODES.labels(result="issued").inc(len(codes) - len(taken))
+    return [code for code in codes if code not in taken]
+
+
+class CodeAllocator:
+    """Hands out codes from blocks leased by this process (thread-safe, fork-aware)."""
+
+    def __init__(self, block_size: int = CODE_BLOCK_SIZE):
+        self.block_size = block_size
+        self._codes: Deque[str] = deque()
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+
+    def allocate(self, count: int = 1) -> List[str]:
+        with self._lock:
+            # A block leased before a fork would otherwise be handed out by every child
+            if self._pid != os.getpid():
+                self._codes.clear()
+                self._pid = os.getpid()
+            while len(self._codes) < count:
+                self._codes.extend(lease_block(self.block_size))
+            return [self._codes.popleft() for _ in range(count)]
+
+
+_allocator = CodeAllocator()
+
+
+def allocate_code() -> str:
+    return _allocator.allocate()[0]
+
+
+def allocate_codes(count: int) -> List[str]:
+    return _allocator.allocate(count)
@@ -0,0 +1,138 @@
+import hashlib
+import logging
+import threading
+from typing import Iterable, List
+
+from db import redis_client, get_connection, safe_close
+from consts import CODE_FILTER_BITS, CODE_FILTER_HASHES, NEGATIVE_CACHE_TTL
+from metrics import CODE_FILTER_LOOKUPS, CODE_FILTER_FALSE_POSITIVE_RATE
+
+logger = logging.getLogger(__name__)
+
+# Redis-backed Bloom filter over urls.code (plain SETBIT/GETBIT, no modules needed)
+FILTER_KEY = "code_filter"
+FILTER_BUILD_KEY = "code_filter:building"
+NEGATIVE_KEY_PREFIX = "neg:"
+
+REBUILD_CHUNK_SIZE = 10000
+
+
+def _negative_key(code: str) -> str:
+    return f"{NEGATIVE_KEY_PREFIX}{code}"
+
+
+def _positions(code: str) -> List[int]:
+    # Double hashing (Kirsch-Mitzenmacher): k positions from one 128-bit digest
+    digest = hashlib.blake2b(code.encode(), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "big")
+    h2 = int.from_bytes(digest[8:], "big") | 1
+    return [(h1 + i * h2) % CODE_FILTER_BITS for i in range(CODE_FILTER_HASHES)]
+
+
+# ---------------------------
+# False-positive tracking (per process)
+# ---------------------------
+_stats_lock = threading.Lock()
+_rejected = 0
+_false_positives = 0
+
+
+def _observe(result: str) -> None:
+    global _rejected, _false_positives
+    CODE_FILTER_LOOKUPS.labels(result=result).inc()
+    if result not in ("rejected", "false_positive"):
+        return
+    with _stats_lock:
+        if result == "rejected":
+            _rejected += 1
+        else:
+            _false_positives += 1
+        # Share of unknown codes the filter failed to reject
+        CODE_FILTER_FALSE_POSITIVE_RATE.set(_false_positives / (_rejected + _false_positives))
+
+
+# ---------------------------
+# Lookups
+# ---------------------------
+def code_may_exist(code: str) -> bool:
+    """
+    Return False when the code certainly does not exist: either the Bloom filter
+    rules it out or it was looked up recently and found missing. One round trip.
+    Fails open (returns True) until the filter has been built.
+    """
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.exists(_negative_key(code))
+    pipe.exists(FILTER_KEY)
+    for pos in _positions(code):
+        pipe.getbit(FILTER_KEY, pos)
+    negative, built, *bits = pipe.execute()
+
+    if negative:
+        _observe("negative_cached")
+        return False
+    if not built:
+        _observe("filter_missing")
+        return True
+    if not all(bits):
+        _observe("rejected")
+        return False
+    _observe("passed")
+    return True
+
+
+def remember_missing(code: str) -> None:
+    """Negative-cache a code that passed the filter but is not in MySQL."""
+    redis_client.set(_negative_key(code), 1, ex=NEGATIVE_CACHE_TTL)
+    _observe("false_positive")
+
+
+# ---------------------------
+# Writes
+# ---------------------------
+def add_codes(codes: Iterable[str], pipe=None, key: str = FILTER_KEY) -> None:
+    """Add codes to the filter and clear any negative-cache entries for them."""
+    client = pipe if pipe is not None else redis_client.pipeline(transaction=False)
+    for code in codes:
+        for pos in _positions(code):
+            client.setbit(key, pos, 1)
+        if key == FILTER_KEY:
+            client.delete(_negative_key(code))
+    if pipe is None:
+        client.execute()
+
+
+def rebuild_code_filter() -> int:
+    """
+    Rebuild the filter from urls.code into a scratch key and swap it in with RENAME.
+    Codes created while the scan was running are re-added after the swap.
+    Returns the number of codes loaded.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    total = 0
+    try:
+        cursor.execute("SELECT NOW()")
+        started_at = cursor.fetchone()[0]  # type: ignore
+
+        redis_client.delete(FILTER_BUILD_KEY)
+        # Pre-size the bitmap so SETBIT never has to grow it
+        redis_client.setbit(FILTER_BUILD_KEY, CODE_FILTER_BITS - 1, 0)
+
+        cursor.execute("SELECT code FROM urls")
+        while True:
+            rows = cursor.fetchmany(REBUILD_CHUNK_SIZE)
+            if not rows:
+                break
+            add_codes((row[0] for row in rows), key=FILTER_BUILD_KEY)  # type: ignore
+            total += len(rows)
+
+        redis_client.rename(FILTER_BUILD_KEY, FILTER_KEY)
+
+        cursor.execute("SELECT code FROM urls WHERE created_at >= %s", (started_at,))
+        add_codes(row[0] for row in cursor.fetchall())  # type: ignore
+    finally:
+        cursor.close()
+        safe_close(conn)
+
+    logger.info(f"Rebuilt short-code filter with {total} codes")
+    return total
@@ -14,8 +14,81 @@ DB_USER=os.environ.get("MYSQL_USER", "root")
 DB_PASSWORD=os.environ.get("MYSQL_PASSWORD", "example")
 DB_DATABASE=os.environ.get("MYSQL_DB", "urlshortener")
 
-#Rate limiting
-RATE_LIMIT = 10 
+#Caching
+URL_CACHE_TTL = 86400  # redirect records, 1 day
+LOCAL_URL_CACHE_SIZE = int(os.environ.get("LOCAL_URL_CACHE_SIZE", 1000))  # per worker, 0 disables
+LOCAL_URL_CACHE_TTL = int(os.environ.get("LOCAL_URL_CACHE_TTL", 30))  # seconds, bounds staleness if pub/sub drops
+NEGATIVE_CACHE_TTL = 60  # unknown codes, seconds
+
+#Short-code Bloom filter (defaults: ~1% false positives at 14M codes, 16 MB)
+CODE_FILTER_BITS = int(os.environ.get("CODE_FILTER_BITS", 2**27))
+CODE_FILTER_HASHES = int(os.environ.get("CODE_FILTER_HASHES", 7))
+
+#Short-code allocation (see code_allocator.py)
+CODE_BLOCK_SIZE = int(os.environ.get("CODE_BLOCK_SIZE", 1000))  # codes leased per worker at a time
+
+#Click ingest: "celery" (two tasks per click) or "stream" (one XADD, see click_stream.py)
+CLICK_INGEST_MODE = os.environ.get("CLICK_INGEST_MODE", "celery")
+CLICK_STREAM_MAXLEN = int(os.environ.get("CLICK_STREAM_MAXLEN", 1_000_000))
+CLICK_STREAM_BATCH_SIZE = int(os.environ.get("CLICK_STREAM_BATCH_SIZE", 200))
+CLICK_STREAM_BLOCK_MS = 1000
+CLICK_STREAM_CLAIM_IDLE_MS = 60_000  # reclaim entries pending this long
+CLICK_STREAM_MAX_DELIVERIES = 5
+
+#Click batching (stream consumers buffer url_clicks rows, see click_writer.py)
+CLICK_BATCH_MAX_ROWS = int(os.environ.get("CLICK_BATCH_MAX_ROWS", 500))
+CLICK_BATCH_FLUSH_MS = int(os.environ.get("CLICK_BATCH_FLUSH_MS", 200))
+
+#Verified JWT claims (per-process cache, see auth.py)
+JWT_CACHE_SIZE = int(os.environ.get("JWT_CACHE_SIZE", 10000))
+JWT_NEGATIVE_CACHE_TTL = 30  # seconds a token that failed verification is rejected without re-checking
+
+#Click enrichment (per-process caches, see tasks.py)
+UA_CACHE_SIZE = int(os.environ.get("UA_CACHE_SIZE", 10000))
+GEOIP_CACHE_SIZE = int(os.environ.get("GEOIP_CACHE_SIZE", 50000))
+GEOIP_CACHE_BY_PREFIX = os.environ.get("GEOIP_CACHE_BY_PREFIX", "false").lower() == "true"  # key on /24 instead of IP
+# auto uses the libmaxminddb C extension when installed (it mmaps the file itself)
+# and falls back to the pure-Python mmap reader; mmap/memory force the pure-Python reader
+GEOIP_MODE = os.environ.get("GEOIP_MODE", "auto")  # auto | mmap | memory
+
+#Analytics API (GET /analytics/<code>): buckets per page / per streamed read
+ANALYTICS_PAGE_SIZE = 500
+ANALYTICS_MAX_PAGE_SIZE = 5000
+ANALYTICS_OPEN_HOURS = 2  # newest hours still recomputed from MySQL; older buckets are cached
+ANALYTICS_SERIES_TTL = int(os.environ.get("ANALYTICS_SERIES_TTL", 900))  # seconds, cached closed buckets (late clicks show up after this)
+ANALYTICS_RESPONSE_TTL = 3600  # seconds, cached /analytics pages (keys also change with every click)
+
+#Trending (see trending.py)
+TRENDING_TOP_N = int(os.environ.get("TRENDING_TOP_N", 20))
+
+#Rate limiting (see rate_limit.py); tiers are the token's role claim, or "ip" per client address
+RATE_LIMIT = 10  # requests per minute for routes/tiers without an entry below
+RATE_LIMITS = {
+    "shorten": {
+        "algorithm": "sliding_window",
+        "tiers": {"user": (10, 60), "admin": (100, 60), "ip": (10, 60)},
+    },
+    "stats": {
+        "algorithm": "token_bucket",
+        "tiers": {"user": (60, 60), "admin": (600, 60), "ip": (60, 60)},
+    },
+    # Bulk shortening spends one token per submitted link
+    "shorten_bulk": {
+        "algorithm": "token_bucket",
+        "tiers": {"user": (20000, 3600), "admin": (200000, 3600), "ip": (20000, 3600)},
+    },
+    "export": {
+        "algorithm": "token_bucket",
+        "tiers": {"user": (5, 60), "admin": (50, 60), "ip": (5, 60)},
+    },
+}
+EXPORT_CHUNK_SIZE = 5000  # url_clicks rows per keyset query of an export
+SHORTEN_BULK_MAX_ITEMS = 10000
+SHORTEN_BULK_INSERT_ROWS = 1000  # rows per multi-row INSERT
+STATS_BATCH_MAX_CODES = 1000
+STATS_BATCH_CODES_PER_TOKEN = 100  # a batch costs 1 + codes // this from the "stats" budget
+RATE_LIMIT_LOCAL_PRECHECK = os.environ.get("RATE_LIMIT_LOCAL_PRECHECK", "true").lower() == "true"
+RATE_LIMIT_LOCAL_SIZE = 10000  # denied clients remembered per worker
 
 # Config thresholds
 MAX_CLICKS_PER_MINUTE_PER_IP = 10
@@ -25,4 +98,7 @@ UNUSUAL_USER_AGENTS = ["python-requests", "curl", "bot", "spider"]
 VELOCITY_THRESHOLD = 1.0  # seconds between clicks
 MAX_CLICKS_PER_WINDOW = 5
 WINDOW_SECONDS = 10
+VELOCITY_MAX_ENTRIES = 20  # click timestamps kept per fingerprint (at least MAX_CLICKS_PER_WINDOW + 1)
 MAX_SEQUENCE_LENGTH = 5
+SUSPICIOUS_WINDOW_SECONDS = 60  # an IP counts as currently suspicious this long after its last flag
+FRAUD_GAUGE_INTERVAL = 15  # seconds between suspicious-IP gauge refreshes (per process)
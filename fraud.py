@@ -1,14 +1,12 @@
 from db import redis_client
-from typing import Optional
-from consts import (
-    MAX_CLICKS_PER_MINUTE_PER_IP,MAX_CLICKS_PER_MINUTE_PER_IP_URL,
-    RATE_THRESHOLD,UNUSUAL_USER_AGENTS,VELOCITY_THRESHOLD,
-    WINDOW_SECONDS,MAX_CLICKS_PER_WINDOW,MAX_SEQUENCE_LENGTH
-)
+from typing import List, Optional
+from consts import SUSPICIOUS_WINDOW_SECONDS,FRAUD_GAUGE_INTERVAL,VELOCITY_MAX_ENTRIES
+from fraud_rules import RULES
 import hashlib
 from flask import request
 from metrics import SUSPICIOUS_IP_URLS,SUSPICIOUS_IPS,SUSPICIOUS_REQUESTS
 import time
+from uuid import uuid4
 
 def get_fingerprint() -> str:
     """Generate a simple fingerprint for a visitor."""
@@ -23,106 +21,169 @@ def get_fingerprint() -> str:
 
 
 
-def is_fraud(ip: str, url_code: str, user_agent: Optional[str], referrer: Optional[str]) -> bool:
+# ---------------------------
+# Stateful rules: one atomic script per click
+# ---------------------------
+# Updates every per-click counter and returns all verdicts in one round trip.
+# INCR replaces the old GET-then-SET, so concurrent workers never lose updates.
+# Everything runs on the click's own time (`now`), not the worker's, so a batch
+# replayed late is scored the way it happened: per-IP counters are per event
+# minute and the sequence restarts after a minute without clicks.
+#   KEYS: suspicious_rate:<ip>:<minute>, fraud:ip:<ip>:<minute>, fraud:ip_url:<ip>:<code>:<minute>,
+#         velocity:<fp>, behavior_seq:<fp>,
+#         fraud:suspicious_ips, fraud:suspicious_ip_urls
+#   ARGV: now, url_code, ip_rate_threshold, ip_clicks, ip_url_clicks,
+#         velocity_seconds, window_seconds, max_clicks_per_window,
+#         max_sequence_length (fraud_rules thresholds), ip, SUSPICIOUS_WINDOW,
+#         click id, VELOCITY_MAX_ENTRIES
+_FRAUD_SCRIPT = redis_client.register_script("""
+local now = tonumber(ARGV[1])
+local url_code = ARGV[2]
+local verdicts = {0, 0, 0, 0, 0, 0}
+
+-- Rate per IP (checked before this click is counted)
+local rate = tonumber(redis.call('GET', KEYS[1]) or '0')
+if rate > tonumber(ARGV[3]) then verdicts[1] = 1 end
+redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], 120)
+
+-- IP click count
+local ip_clicks = redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], 120)
+if ip_clicks > tonumber(ARGV[4]) then verdicts[2] = 1 end
+
+-- IP+URL click count
+local ip_url_clicks = redis.call('INCR', KEYS[3])
+redis.call('EXPIRE', KEYS[3], 120)
+if ip_url_clicks > tonumber(ARGV[5]) then verdicts[3] = 1 end
+
+-- Velocity: sliding window over this fingerprint's click timestamps (sorted set).
+-- Too fast since the previous click, or too many clicks in the last window_seconds.
+local window = tonumber(ARGV[7])
+redis.call('ZREMRANGEBYSCORE', KEYS[4], '-inf', now - window)
+local previous = redis.call('ZRANGE', KEYS[4], -1, -1, 'WITHSCORES')
+if previous[2] and now - tonumber(previous[2]) < tonumber(ARGV[6]) then verdicts[4] = 1 end
+redis.call('ZADD', KEYS[4], now, ARGV[12])
+-- Keep only the newest entries so a flood from one fingerprint stays bounded
+redis.call('ZREMRANGEBYRANK', KEYS[4], 0, -tonumber(ARGV[13]) - 1)
+redis.call('EXPIRE', KEYS[4], math.ceil(window))
+if redis.call('ZCARD', KEYS[4]) > tonumber(ARGV[8]) then verdicts[5] = 1 end
+
+-- Behavior: the same URL over and over. Entries are "<time>|<code>"; a gap of
+-- more than a minute since the last one starts a new sequence.
+local max_len = tonumber(ARGV[9])
+local seq = redis.call('LRANGE', KEYS[5], 0, -1)
+local last = seq[#seq]
+if last and now - tonumber(string.match(last, '^([^|]*)')) > 60 then
+    redis.call('DEL', KEYS[5])
+    seq = {}
+end
+redis.call('RPUSH', KEYS[5], string.format('%.6f', now) .. '|' .. url_code)
+redis.call('LTRIM', KEYS[5], -max_len, -1)
+redis.call('EXPIRE', KEYS[5], 60)
+if #seq >= max_len then
+    local repeated = 1
+    for _, entry in ipairs(seq) do
+        if string.match(entry, '^[^|]*|(.*)$') ~= url_code then repeated = 0 break end
+    end
+    verdicts[6] = repeated
+end
+
+-- Flagged IPs and IP+URL pairs, scored by last flag time (see collect_fraud_gauges)
+local cutoff = now - tonumber(ARGV[11])
+if verdicts[1] == 1 or verdicts[2] == 1 or verdicts[3] == 1 then
+    redis.call('ZADD', KEYS[6], now, ARGV[10])
+    redis.call('ZREMRANGEBYSCORE', KEYS[6], '-inf', cutoff)
+    redis.call('EXPIRE', KEYS[6], ARGV[11])
+end
+if verdicts[3] == 1 then
+    redis.call('ZADD', KEYS[7], now, ARGV[10] .. ':' .. url_code)
+    redis.call('ZREMRANGEBYSCORE', KEYS[7], '-inf', cutoff)
+    redis.call('EXPIRE', KEYS[7], ARGV[11])
+end
+
+return verdicts
+""")
+
+SUSPICIOUS_IPS_KEY = "fraud:suspicious_ips"
+SUSPICIOUS_IP_URLS_KEY = "fraud:suspicious_ip_urls"
+
+# Reason codes, in script verdict order
+STATEFUL_RULES = ["ip_rate_threshold", "ip_clicks", "ip_url_clicks", "velocity", "click_window", "repeated_sequence"]
+
+
+def check_stateful_rules(ip: str, url_code: str, fingerprint: str, clicked_at: Optional[float] = None) -> List[str]:
     """
-    Combine suspicious heuristics and IP/url fraud detection.
-    Returns True if any fraud or suspicious condition is triggered.
+    Run the counter-based rules atomically; returns the reason codes that fired.
+    `clicked_at` is the click's epoch time (defaults to now).
     """
-    suspicious = False
-
-    # --- Rate per IP ---
-    rate_key = f"suspicious_rate:{ip}"
-    current: Optional[int] = redis_client.get(rate_key) # type: ignore
-    count = int(current) if current else 0
-    if count > RATE_THRESHOLD:
-        SUSPICIOUS_REQUESTS.labels(type="ip_rate_threshold").inc()
-        suspicious = True
-
-    # --- Unusual User-Agent ---
-    if user_agent:
-        ua = user_agent.lower()
-        if any(bot in ua for bot in UNUSUAL_USER_AGENTS):
-            SUSPICIOUS_REQUESTS.labels(type="unusual_user_agent").inc()
-            suspicious = True
-
-    # --- Referrer checks ---
-    if not referrer:
-        SUSPICIOUS_REQUESTS.labels(type="missing_referrer").inc()
-        suspicious = True
-    elif len(referrer) > 200:
-        SUSPICIOUS_REQUESTS.labels(type="long_referrer").inc()
-        suspicious = True
-
-    # --- IP click count ---
-    ip_key = f"fraud:ip:{ip}"
-    ip_clicks: Optional[int] = redis_client.get(ip_key) # type: ignore
-    if ip_clicks is None:
-        redis_client.set(ip_key, 1, ex=60)
-    else:
-        ip_clicks = int(ip_clicks) + 1
-        redis_client.set(ip_key, ip_clicks, ex=60)
-        if ip_clicks > MAX_CLICKS_PER_MINUTE_PER_IP:
-            SUSPICIOUS_REQUESTS.labels(type="ip_clicks").inc()
-            suspicious = True
-
-    # --- IP+URL click count ---
-    ip_url_key = f"fraud:ip_url:{ip}:{url_code}"
-    ip_url_clicks: Optional[int] = redis_client.get(ip_url_key) # pyright: ignore[reportAssignmentType]
-    if ip_url_clicks is None:
-        redis_client.set(ip_url_key, 1, ex=60)
-    else:
-        ip_url_clicks = int(ip_url_clicks) + 1
-        redis_client.set(ip_url_key, ip_url_clicks, ex=60)
-        if ip_url_clicks > MAX_CLICKS_PER_MINUTE_PER_IP_URL:
-            SUSPICIOUS_REQUESTS.labels(type="ip_url_clicks").inc()
-            suspicious = True
-
-    # --- Bot user-agent check ---
-    if user_agent and "bot" in user_agent.lower():
-        SUSPICIOUS_REQUESTS.labels(type="bot_user_agent").inc()
-        suspicious = True
-
-    # --- Update counter for rate per IP ---
-    redis_client.incr(rate_key)
-    redis_client.expire(rate_key, 60)
-
-    # --- Update Prometheus gauges ---
-    SUSPICIOUS_IPS.set(len(redis_client.keys("fraud:ip:*"))) # type: ignore
-    SUSPICIOUS_IP_URLS.set(len(redis_client.keys("fraud:ip_url:*"))) # type: ignore
-
-    return suspicious
-
-def check_velocity(fingerprint:str)->bool:
-    """Return True if velocity is suspicious."""
-    now=time.time()
-    last_click:Optional[float]=redis_client.get(f"last_click:{fingerprint}") # type: ignore
-    click_count:Optional[int]=redis_client.get(f"click_count:{fingerprint}") # type: ignore
-    last_click = float(last_click) if last_click else 0
-    click_count = int(click_count) if click_count else 0
-    # Measure interval between clicks
-    interval = now - last_click
-    if interval < VELOCITY_THRESHOLD:
-        return True  # too fast
-    # Increment click count and store expiration
-    click_count += 1
-    redis_client.set(f"click_count:{fingerprint}", click_count, ex=WINDOW_SECONDS)
-    redis_client.set(f"last_click:{fingerprint}", now, ex=WINDOW_SECONDS)
-
-    if click_count > MAX_CLICKS_PER_WINDOW:
-        return True  # too many clicks in window
-    return False
-
-def check_behavior(fingerprint:str,url_code:str)->bool:
-    """Return True if behavior is suspicious."""
-    key = f"behavior_seq:{fingerprint}"
-    seq= redis_client.lrange(key, 0, -1)
-    #Add current url
-    redis_client.rpush(key,url_code)
-    redis_client.ltrim(key,-MAX_SEQUENCE_LENGTH,-1)
-    redis_client.expire(key,60)
-    # If the sequence is too repetitive or random,flag
-    if len(seq)>=MAX_SEQUENCE_LENGTH: # type: ignore
-        # simple check: all URLs identical
-        if all(u == url_code for u in seq): # type: ignore
-            return True
-    return False
\ No newline at end of file
+    t = RULES.thresholds
+    now = clicked_at if clicked_at is not None else time.time()
+    minute = int(now // 60)
+    verdicts = _FRAUD_SCRIPT(
+        keys=[
+            f"suspicious_rate:{ip}:{minute}",
+            f"fraud:ip:{ip}:{minute}",
+            f"fraud:ip_url:{ip}:{url_code}:{minute}",
+            f"velocity:{fingerprint}",
+            f"behavior_seq:{fingerprint}",
+            SUSPICIOUS_IPS_KEY,
+            SUSPICIOUS_IP_URLS_KEY,
+        ],
+        args=[
+            f"{now:.6f}", url_code, t.ip_rate_threshold, t.ip_clicks,
+            t.ip_url_clicks, t.velocity_seconds, t.window_seconds,
+            t.max_clicks_per_window, t.max_sequence_length, ip, SUSPICIOUS_WINDOW_SECONDS,
+            uuid4().hex, max(VELOCITY_MAX_ENTRIES, t.max_clicks_per_window + 1),
+        ],
+    )
+    return [rule for rule, hit in zip(STATEFUL_RULES, verdicts) if hit]  # type: ignore
+
+
+def check_request_rules(user_agent: Optional[str], referrer: Optional[str]) -> List[str]:
+    """Stateless rules on the request itself (no I/O, safe to run in the redirect handler)."""
+    return RULES.check_request(user_agent, referrer)
+
+
+def evaluate_click(ip: str, url_code: str, user_agent: Optional[str], referrer: Optional[str],
+                   fingerprint: str, request_reasons: Optional[List[str]] = None,
+                   clicked_at: Optional[float] = None) -> List[str]:
+    """
+    Run every fraud heuristic for one click (one Redis round trip).
+    `request_reasons` are the request rules already evaluated by the redirect handler;
+    `clicked_at` is the click's epoch time when it is checked after the fact.
+    Returns the reason codes that fired; an empty list means the click looks clean.
+    """
+    if request_reasons is None:
+        request_reasons = check_request_rules(user_agent, referrer)
+    reasons = request_reasons + check_stateful_rules(ip, url_code, fingerprint, clicked_at)
+    for reason in reasons:
+        SUSPICIOUS_REQUESTS.labels(type=reason).inc()
+    return reasons
+
+
+# ---------------------------
+# Gauges (periodic collector)
+# ---------------------------
+_last_collected = 0.0
+
+
+def collect_fraud_gauges(force: bool = False) -> None:
+    """
+    Refresh SUSPICIOUS_IPS / SUSPICIOUS_IP_URLS from the flagged sorted sets.
+    Called on /metrics scrapes; runs at most once per FRAUD_GAUGE_INTERVAL per process.
+    """
+    global _last_collected
+    now = time.time()
+    if not force and now - _last_collected < FRAUD_GAUGE_INTERVAL:
+        return
+    _last_collected = now
+
+    cutoff = now - SUSPICIOUS_WINDOW_SECONDS
+    pipe = redis_client.pipeline(transaction=False)
+    for key in (SUSPICIOUS_IPS_KEY, SUSPICIOUS_IP_URLS_KEY):
+        pipe.zremrangebyscore(key, "-inf", cutoff)
+        pipe.zcard(key)
+    _, ips, _, ip_urls = pipe.execute()
+    SUSPICIOUS_IPS.set(ips)
+    SUSPICIOUS_IP_URLS.set(ip_urls)
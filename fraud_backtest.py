@@ -0,0 +1,391 @@
+"""
+Offline fraud backtest: replay the fraud rules over historical clicks and report
+how often each rule would have fired, for the configured thresholds and for a
+grid of alternatives, before any of them is deployed.
+
+    python fraud_backtest.py                                    # url_clicks, last 7 days
+    python fraud_backtest.py --since 2025-01-01 --until 2025-02-01
+    python fraud_backtest.py --file clicks.csv                  # export ordered by clicked_at
+    python fraud_backtest.py --grid ip_clicks=5,10,20 --grid velocity_seconds=0.5,1,2 --json
+
+Clicks are read in chunks (keyset pagination over (clicked_at, id), or
+pandas.read_csv chunks) and each rule is computed with vectorized NumPy
+operations per chunk. Rows are sorted by key and time, diff/cumsum rebuild the Redis
+counters that reset after COUNTER_TTL seconds without clicks, and searchsorted
+counts the sliding velocity window. State that spans chunks (open counter runs,
+the last window of clicks) is carried over, so the result does not depend on
+the chunk size. It matches the live script as long as workers see clicks in
+clicked_at order.
+"""
+import sys
+import json
+import logging
+import argparse
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from fraud_rules import RULES, RuleSet, Thresholds, load_rules
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ["clicked_at", "id", "ip", "fingerprint", "url_id", "user_agent", "referrer"]
+COUNTER_TTL = 60  # seconds; fraud.py counters and sequence lists expire this long after the last click
+CHUNK_SIZE = 1_000_000
+
+# Rules keyed by fingerprint; rows without one (written before fingerprints were
+# stored) are left out of them instead of being pooled under one empty key
+FINGERPRINT_RULES = {"velocity", "click_window", "repeated_sequence"}
+
+INT_THRESHOLDS = {"ip_rate_threshold", "ip_clicks", "ip_url_clicks", "window_seconds",
+                  "max_clicks_per_window", "max_sequence_length"}
+
+
+# ---------------------------
+# Click sources
+# ---------------------------
+def read_clicks_mysql(since: datetime, until: datetime, chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """Stream url_clicks in (clicked_at, id) order, one keyset page per chunk."""
+    from db import get_connection, safe_close
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    last_at, last_id = since, ""
+    try:
+        while True:
+            # Expanded row comparison so MySQL range-scans idx_url_clicks_clicked_at
+            cursor.execute("""
+                SELECT clicked_at, id, ip, fingerprint, url_id, user_agent, referrer
+                FROM url_clicks
+                WHERE (clicked_at > %s OR (clicked_at = %s AND id > %s)) AND clicked_at < %s
+                ORDER BY clicked_at, id
+                LIMIT %s
+            """, (last_at, last_at, last_id, until, chunk_size))
+            rows = cursor.fetchall()
+            if not rows:
+                return
+            last_at, last_id = rows[-1][0], rows[-1][1]
+            yield pd.DataFrame(rows, columns=COLUMNS)
+    finally:
+        cursor.close()
+        safe_close(conn)
+
+
+def read_clicks_file(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """Stream a CSV export with the url_clicks columns, already ordered by clicked_at."""
+    for chunk in pd.read_csv(path, chunksize=chunk_size, dtype=str, keep_default_na=False):
+        yield chunk
+
+
+def _seconds(clicked_at: pd.Series) -> np.ndarray:
+    return pd.to_datetime(clicked_at).to_numpy().astype("datetime64[ns]").astype(np.int64) / 1e9
+
+
+# ---------------------------
+# Vectorized rule replay
+# ---------------------------
+def _run_positions(keys: np.ndarray, t: np.ndarray, state: pd.DataFrame,
+                   values: Optional[np.ndarray] = None) -> Tuple[np.ndarray, pd.DataFrame]:
+    """
+    1-based position of each click in its key's current run. A run ends when the
+    key would have expired in Redis (COUNTER_TTL seconds without clicks) or, with
+    `values`, when the value changes. `state` (index: key; last_t, count, value)
+    carries runs still open at the end of the previous chunk.
+    Returns positions in input order and the state to carry forward.
+    """
+    n = len(keys)
+    if n == 0:
+        return np.zeros(0, np.int64), state
+    codes, uniques = pd.factorize(keys)
+    order = np.argsort(codes, kind="stable")  # input is time-ordered, so each key stays time-ordered
+    k, ts = codes[order], t[order]
+    v = values[order] if values is not None else None
+
+    first = np.ones(n, bool)
+    first[1:] = k[1:] != k[:-1]
+    new_run = first.copy()
+    new_run[1:] |= ts[1:] - ts[:-1] >= COUNTER_TTL
+    if v is not None:
+        new_run[1:] |= v[1:] != v[:-1]
+
+    run_id = np.cumsum(new_run) - 1
+    run_start = np.flatnonzero(new_run)
+    positions = np.arange(n) - run_start[run_id] + 1
+
+    # Continue runs left open by the previous chunk
+    first_idx = np.flatnonzero(first)
+    carried = state.reindex(uniques[k[first_idx]])
+    cont = (ts[first_idx] - carried["last_t"].to_numpy(dtype=float)) < COUNTER_TTL
+    if v is not None:
+        cont &= carried["value"].to_numpy() == v[first_idx]
+    run_offset = np.zeros(len(run_start), np.int64)
+    run_offset[run_id[first_idx[cont]]] = carried["count"].to_numpy()[cont]
+    positions += run_offset[run_id]
+
+    last_idx = np.flatnonzero(np.r_[first[1:], True])
+    latest = pd.DataFrame(
+        {"last_t": ts[last_idx], "count": positions[last_idx], "value": v[last_idx] if v is not None else None},
+        index=uniques[k[last_idx]],
+    )
+    state = pd.concat([state[~state.index.isin(latest.index)], latest])
+    state = state[state["last_t"] > ts.max() - COUNTER_TTL]
+
+    out = np.empty(n, np.int64)
+    out[order] = positions
+    return out, state
+
+
+def _window_stats(keys: np.ndarray, t: np.ndarray, windows: List[float]) -> Tuple[np.ndarray, Dict[float, np.ndarray]]:
+    """
+    Seconds since the key's previous click (inf if none) and, per window, the
+    number of the key's clicks in (t - window, t] including this one.
+    """
+    n = len(keys)
+    codes, _ = pd.factorize(keys)
+    order = np.argsort(codes, kind="stable")
+    k, ts = codes[order].astype(np.int64), t[order]
+
+    gaps = np.full(n, np.inf)
+    same = k[1:] == k[:-1]
+    gaps[1:][same] = (ts[1:] - ts[:-1])[same]
+
+    # One sorted int64 key per click (key, ms) so searchsorted stays inside the key's clicks
+    ms = np.round((ts - ts.min()) * 1000).astype(np.int64) if n else np.zeros(0, np.int64)
+    counts = {}
+    for window in windows:
+        window_ms = int(round(window * 1000))
+        stride = (ms.max() if n else 0) + window_ms + 1
+        composite = k * stride + ms
+        left = np.searchsorted(composite, composite - window_ms, side="right")
+        sorted_counts = np.arange(n) - left + 1
+        counts[window] = np.empty(n, np.int64)
+        counts[window][order] = sorted_counts
+
+    out_gaps = np.empty(n)
+    out_gaps[order] = gaps
+    return out_gaps, counts
+
+
+def _threshold_label(value) -> str:
+    return f"{value:g}" if isinstance(value, float) else str(value)
+
+
+def default_grid(thresholds: Thresholds) -> Dict[str, List[float]]:
+    """Half, configured and double of every threshold."""
+    grid = {}
+    for name, value in thresholds._asdict().items():
+        candidates = [value / 2, value, value * 2]
+        if name in INT_THRESHOLDS:
+            candidates = [int(c) for c in candidates]
+        grid[name] = sorted({c for c in candidates if c > 0})
+    return grid
+
+
+class Backtest:
+    """Accumulates per-rule flag counts over chunks of time-ordered clicks."""
+
+    def __init__(self, rules: RuleSet = RULES, grid: Optional[Dict[str, List[float]]] = None):
+        self.rules = rules
+        self.thresholds = rules.thresholds
+        self.grid = default_grid(self.thresholds)
+        self.grid.update(grid or {})
+        for name, value in self.thresholds._asdict().items():
+            if value not in self.grid[name]:
+                self.grid[name] = sorted(self.grid[name] + [value])
+
+        self.total = 0
+        self.without_fingerprint = 0
+        self.flagged_any = 0
+        self.flagged: Dict[str, Dict[str, int]] = {}
+        self._ip_state = self._empty_state()
+        self._ip_url_state = self._empty_state()
+        self._sequence_state = self._empty_state()
+        self._tail = pd.DataFrame({"fingerprint": pd.Series(dtype=object), "t": pd.Series(dtype=float)})
+        self._ua_reasons: Dict[str, List[str]] = {}
+
+    @staticmethod
+    def _empty_state() -> pd.DataFrame:
+        return pd.DataFrame({"last_t": pd.Series(dtype=float), "count": pd.Series(dtype=np.int64),
+                             "value": pd.Series(dtype=object)})
+
+    def _count(self, rule: str, threshold: str, hits: np.ndarray) -> None:
+        self.flagged.setdefault(rule, {})
+        self.flagged[rule][threshold] = self.flagged[rule].get(threshold, 0) + int(hits.sum())
+
+    def feed(self, chunk: pd.DataFrame) -> None:
+        n = len(chunk)
+        if n == 0:
+            return
+        t = _seconds(chunk["clicked_at"])
+        ip = chunk["ip"].fillna("").to_numpy(dtype=object)
+        url = chunk["url_id"].fillna("").to_numpy(dtype=object)
+        fp = chunk["fingerprint"].fillna("").to_numpy(dtype=object)
+        has_fp = fp != ""
+        self.without_fingerprint += int(n - has_fp.sum())
+        th = self.thresholds
+        any_hit = np.zeros(n, bool)
+
+        # --- Request rules (evaluated once per distinct User-Agent) ---
+        ua = chunk["user_agent"].fillna("")
+        distinct = ua.unique()
+        for value in distinct:
+            if value not in self._ua_reasons:
+                self._ua_reasons[value] = self.rules.user_agent_reasons(value)
+        for reason in self.rules.user_agent_reason_codes:
+            matching = [value for value in distinct if reason in self._ua_reasons[value]]
+            hits = ua.isin(matching).to_numpy()
+            self._count(reason, "configured", hits)
+            any_hit |= hits
+        referrer = chunk["referrer"].fillna("")
+        if self.rules.missing_referrer:
+            hits = (referrer == "").to_numpy()
+            self._count("missing_referrer", "configured", hits)
+            any_hit |= hits
+        if self.rules.max_referrer_length is not None:
+            hits = (referrer.str.len() > self.rules.max_referrer_length).to_numpy()
+            self._count("long_referrer", "configured", hits)
+            any_hit |= hits
+
+        # --- Per-IP and per-IP+URL counters ---
+        ip_pos, self._ip_state = _run_positions(ip, t, self._ip_state)
+        for value in self.grid["ip_rate_threshold"]:
+            self._count("ip_rate_threshold", _threshold_label(value), ip_pos - 1 > value)
+        for value in self.grid["ip_clicks"]:
+            self._count("ip_clicks", _threshold_label(value), ip_pos > value)
+        ip_url_pos, self._ip_url_state = _run_positions(ip + "\0" + url, t, self._ip_url_state)
+        for value in self.grid["ip_url_clicks"]:
+            self._count("ip_url_clicks", _threshold_label(value), ip_url_pos > value)
+        any_hit |= (ip_pos - 1 > th.ip_rate_threshold) | (ip_pos > th.ip_clicks) | (ip_url_pos > th.ip_url_clicks)
+
+        # --- Velocity (sliding window per fingerprint, previous chunk's tail prepended) ---
+        windows = self.grid["window_seconds"]
+        all_fp = np.concatenate([self._tail["fingerprint"].to_numpy(dtype=object), fp[has_fp]])
+        all_t = np.concatenate([self._tail["t"].to_numpy(dtype=float), t[has_fp]])
+        fp_gaps, fp_counts = _window_stats(all_fp, all_t, windows)
+        skip = len(self._tail)
+        # Rows without a fingerprint: no previous click, nothing in the window
+        gaps = np.full(n, np.inf)
+        gaps[has_fp] = fp_gaps[skip:]
+        window_counts = {}
+        for window in windows:
+            window_counts[window] = np.zeros(n, np.int64)
+            window_counts[window][has_fp] = fp_counts[window][skip:]
+        # Timestamps older than the window are trimmed, so only a recent previous click counts
+        for value in self.grid["velocity_seconds"]:
+            self._count("velocity", _threshold_label(value), gaps < min(value, th.window_seconds))
+        for window in windows:
+            for value in self.grid["max_clicks_per_window"]:
+                self._count("click_window", f"{_threshold_label(value)} in {_threshold_label(window)}s",
+                            window_counts[window] > value)
+        any_hit |= (gaps < min(th.velocity_seconds, th.window_seconds))
+        any_hit |= window_counts[th.window_seconds] > th.max_clicks_per_window
+        keep = all_t > t.max() - max(windows)
+        self._tail = pd.DataFrame({"fingerprint": all_fp[keep], "t": all_t[keep]})
+
+        # --- Repeated sequence: same URL several times in a row ---
+        seq_pos = np.ones(n, np.int64)
+        seq_pos[has_fp], self._sequence_state = _run_positions(
+            fp[has_fp], t[has_fp], self._sequence_state, values=url[has_fp])
+        for value in self.grid["max_sequence_length"]:
+            self._count("repeated_sequence", _threshold_label(value), seq_pos - 1 >= value)
+        any_hit |= seq_pos - 1 >= th.max_sequence_length
+
+        self.total += n
+        self.flagged_any += int(any_hit.sum())
+
+    def report(self) -> dict:
+        th = self.thresholds
+        configured = {
+            "ip_rate_threshold": _threshold_label(th.ip_rate_threshold),
+            "ip_clicks": _threshold_label(th.ip_clicks),
+            "ip_url_clicks": _threshold_label(th.ip_url_clicks),
+            "velocity": _threshold_label(th.velocity_seconds),
+            "click_window": f"{_threshold_label(th.max_clicks_per_window)} in {_threshold_label(th.window_seconds)}s",
+            "repeated_sequence": _threshold_label(th.max_sequence_length),
+        }
+        rules = {}
+        for rule, by_threshold in self.flagged.items():
+            # Per-fingerprint rules only ever saw the clicks that had a fingerprint
+            evaluated = self.total - self.without_fingerprint if rule in FINGERPRINT_RULES else self.total
+            rules[rule] = {
+                threshold: {
+                    "flagged": flagged,
+                    "rate": flagged / evaluated if evaluated else 0.0,
+                    "configured": configured.get(rule, "configured") == threshold,
+                }
+                for threshold, flagged in by_threshold.items()
+            }
+        return {
+            "clicks": self.total,
+            "clicks_without_fingerprint": self.without_fingerprint,
+            "flagged_any": self.flagged_any,
+            "flagged_any_rate": self.flagged_any / self.total if self.total else 0.0,
+            "rules": rules,
+        }
+
+
+def run(chunks: Iterator[pd.DataFrame], rules: RuleSet = RULES, grid: Optional[Dict[str, List[float]]] = None) -> dict:
+    backtest = Backtest(rules, grid)
+    for chunk in chunks:
+        backtest.feed(chunk)
+        logger.info(f"Backtested {backtest.total} clicks")
+    return backtest.report()
+
+
+# ---------------------------
+# CLI
+# ---------------------------
+def _parse_grid(entries: List[str]) -> Dict[str, List[float]]:
+    grid = {}
+    for entry in entries:
+        name, _, values = entry.partition("=")
+        if name not in Thresholds._fields:
+            raise SystemExit(f"Unknown threshold {name!r}; expected one of {', '.join(Thresholds._fields)}")
+        cast = int if name in INT_THRESHOLDS else float
+        grid[name] = sorted({cast(v) for v in values.split(",") if v})
+    return grid
+
+
+def print_report(report: dict) -> None:
+    print(f"{report['clicks']} clicks, {report['flagged_any']} flagged by any rule "
+          f"({report['flagged_any_rate']:.2%}) at the configured thresholds")
+    if report["clicks_without_fingerprint"]:
+        print(f"{report['clicks_without_fingerprint']} clicks without a fingerprint skipped by "
+              f"{', '.join(sorted(FINGERPRINT_RULES))} (their rates are over the rest)")
+    print()
+    print(f"{'rule':<22}{'threshold':<16}{'flagged':>12}{'rate':>10}")
+    for rule, by_threshold in report["rules"].items():
+        for threshold, result in by_threshold.items():
+            marker = " *" if result["configured"] else ""
+            print(f"{rule:<22}{threshold:<16}{result['flagged']:>12}{result['rate']:>10.2%}{marker}")
+    print("\n* configured threshold")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Replay fraud rules over historical clicks.")
+    parser.add_argument("--file", help="CSV export of url_clicks ordered by clicked_at (default: read MySQL)")
+    parser.add_argument("--since", type=datetime.fromisoformat, default=datetime.utcnow() - timedelta(days=7))
+    parser.add_argument("--until", type=datetime.fromisoformat, default=datetime.utcnow())
+    parser.add_argument("--rules", help="fraud rules file (default: FRAUD_RULES_PATH)")
+    parser.add_argument("--grid", action="append", default=[], metavar="NAME=V1,V2",
+                        help="threshold values to try, e.g. ip_clicks=5,10,20 (repeatable)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    rules = load_rules(args.rules) if args.rules else RULES
+    chunks = (read_clicks_file(args.file, args.chunk_size) if args.file
+              else read_clicks_mysql(args.since, args.until, args.chunk_size))
+    report = run(chunks, rules, _parse_grid(args.grid))
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
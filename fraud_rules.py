@@ -0,0 +1,123 @@
+"""
+Fraud rule definitions, loaded from fraud_rules.yaml (FRAUD_RULES_PATH).
+
+Request rules look only at the request (User-Agent, referrer) and are cheap enough
+to run inline in the redirect handler. Stateful rules need per-IP/fingerprint
+counters in Redis; fraud.check_stateful_rules runs them in the click workers
+with the thresholds configured here. Every rule reports its own reason code,
+which ends up in suspicious_clicks.reason.
+"""
+import os
+import re
+import logging
+from typing import Dict, List, Optional, NamedTuple
+
+import yaml
+from consts import (
+    MAX_CLICKS_PER_MINUTE_PER_IP, MAX_CLICKS_PER_MINUTE_PER_IP_URL,
+    RATE_THRESHOLD, UNUSUAL_USER_AGENTS, VELOCITY_THRESHOLD,
+    WINDOW_SECONDS, MAX_CLICKS_PER_WINDOW, MAX_SEQUENCE_LENGTH,
+)
+
+logger = logging.getLogger(__name__)
+
+FRAUD_RULES_PATH = os.environ.get("FRAUD_RULES_PATH", os.path.join(os.path.dirname(__file__), "fraud_rules.yaml"))
+
+# Used when the file is missing, and for any key it leaves out
+DEFAULT_RULES = {
+    "user_agent_rules": {
+        "unusual_user_agent": UNUSUAL_USER_AGENTS,
+        "bot_user_agent": ["bot"],
+    },
+    "referrer_rules": {
+        "missing_referrer": True,
+        "long_referrer": 200,
+    },
+    "thresholds": {
+        "ip_rate_threshold": RATE_THRESHOLD,
+        "ip_clicks": MAX_CLICKS_PER_MINUTE_PER_IP,
+        "ip_url_clicks": MAX_CLICKS_PER_MINUTE_PER_IP_URL,
+        "velocity_seconds": VELOCITY_THRESHOLD,
+        "window_seconds": WINDOW_SECONDS,
+        "max_clicks_per_window": MAX_CLICKS_PER_WINDOW,
+        "max_sequence_length": MAX_SEQUENCE_LENGTH,
+    },
+}
+
+
+class Thresholds(NamedTuple):
+    ip_rate_threshold: int
+    ip_clicks: int
+    ip_url_clicks: int
+    velocity_seconds: float
+    window_seconds: int
+    max_clicks_per_window: int
+    max_sequence_length: int
+
+
+class RuleSet:
+    """Compiled rules: one UA regex for all patterns, plus referrer rules and thresholds."""
+
+    def __init__(self, config: dict):
+        ua_rules: Dict[str, List[str]] = config["user_agent_rules"]
+        referrer_rules = config["referrer_rules"]
+
+        # pattern -> reasons, in rule order. A pattern containing another one
+        # (e.g. "googlebot" and "bot") also carries the shorter pattern's reasons,
+        # since the regex only reports the longest match at each position.
+        self._reasons_by_pattern: Dict[str, List[str]] = {}
+        for reason, patterns in ua_rules.items():
+            for pattern in patterns:
+                self._reasons_by_pattern.setdefault(pattern.lower(), []).append(reason)
+        self.user_agent_reason_codes = list(ua_rules)
+        direct = {pattern: list(reasons) for pattern, reasons in self._reasons_by_pattern.items()}
+        for pattern, reasons in self._reasons_by_pattern.items():
+            for other, other_reasons in direct.items():
+                if other != pattern and other in pattern:
+                    reasons += [r for r in other_reasons if r not in reasons]
+
+        alternatives = sorted(self._reasons_by_pattern, key=len, reverse=True)
+        self._ua_regex = re.compile("|".join(map(re.escape, alternatives)), re.IGNORECASE) if alternatives else None
+
+        self.missing_referrer: bool = bool(referrer_rules.get("missing_referrer"))
+        self.max_referrer_length: Optional[int] = referrer_rules.get("long_referrer")
+        self.thresholds = Thresholds(**config["thresholds"])
+
+    def user_agent_reasons(self, user_agent: Optional[str]) -> List[str]:
+        if not user_agent or self._ua_regex is None:
+            return []
+        matched = set()
+        for match in self._ua_regex.finditer(user_agent):
+            matched.update(self._reasons_by_pattern[match.group(0).lower()])
+        return [reason for reason in self.user_agent_reason_codes if reason in matched]
+
+    def check_request(self, user_agent: Optional[str], referrer: Optional[str]) -> List[str]:
+        """Stateless rules on the request itself; returns the reason codes that fired."""
+        reasons = self.user_agent_reasons(user_agent)
+        if not referrer:
+            if self.missing_referrer:
+                reasons.append("missing_referrer")
+        elif self.max_referrer_length is not None and len(referrer) > self.max_referrer_length:
+            reasons.append("long_referrer")
+        return reasons
+
+
+def load_rules(path: str = FRAUD_RULES_PATH) -> RuleSet:
+    config = {section: dict(values) for section, values in DEFAULT_RULES.items()}
+    try:
+        with open(path) as f:
+            overrides = yaml.safe_load(f) or {}
+    except FileNotFoundError:
+        logger.warning(f"⚠️ Fraud rules file {path} not found, using defaults")
+        overrides = {}
+    for section, values in overrides.items():
+        if section not in config:
+            raise ValueError(f"Unknown fraud rules section: {section}")
+        if section == "user_agent_rules":
+            config[section] = dict(values or {})  # replaces the default UA rules entirely
+        else:
+            config[section].update(values or {})
+    return RuleSet(config)
+
+
+RULES = load_rules()
@@ -0,0 +1,62 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from metrics import LOCAL_CACHE_HITS, LOCAL_CACHE_MISSES, LOCAL_CACHE_EVICTIONS
+
+_MISSING = object()
+
+
+class LocalCache:
+    """
+    Bounded, thread-safe LRU cache with an optional per-entry TTL.
+    Lives in process memory, so every Gunicorn/Celery worker has its own copy;
+    callers are responsible for cross-process invalidation.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: Optional[float] = None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple[Any, Optional[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = LOCAL_CACHE_HITS.labels(cache=name)
+        self._misses = LOCAL_CACHE_MISSES.labels(cache=name)
+        self._evictions = LOCAL_CACHE_EVICTIONS.labels(cache=name)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires_at = entry  # type: ignore
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self._hits.inc()
+                    return value
+                del self._data[key]
+        self._misses.inc()
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        if self.maxsize <= 0:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._evictions.inc()
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -35,14 +35,15 @@ SUSPICIOUS_REQUESTS = Counter(
 )
 
 # Current number of unique IPs flagged as suspicious (active cases).
-# Derived from suspicious_clicks.ip field in the database.
+# IPs flagged by an IP rule within SUSPICIOUS_WINDOW_SECONDS (fraud:suspicious_ips),
+# refreshed by fraud.collect_fraud_gauges on /metrics scrapes.
 SUSPICIOUS_IPS = Gauge(
     "suspicious_ips_current",
     "Number of currently suspicious IPs"
 )
 
 # Current number of URL-specific suspicious activities,
-# showing how many unique IP+URL combinations were flagged.
+# showing how many unique IP+URL combinations were flagged (fraud:suspicious_ip_urls).
 SUSPICIOUS_IP_URLS = Gauge(
     "suspicious_ip_urls_current",
     "Number of currently suspicious IP+URL combinations"
@@ -88,6 +89,13 @@ SUSPICIOUS_CLICKS = Counter(
     ["url", "type"]
 )
 
+# Wall time of one tasks.update_trending_urls run
+# (leaderboard rebuild + bulk urls.trending_score write-back).
+TRENDING_UPDATE_DURATION = Histogram(
+    "trending_update_seconds",
+    "Trending job duration in seconds"
+)
+
 # -------------------------------------------------------
 # 🌍 Enriched Analytics: Geo & Device Insights
 # -------------------------------------------------------
@@ -125,3 +133,107 @@ CLICKS_BY_HOUR = Histogram(
     "Clicks by hour of day",
     ["url"]
 )
+
+
+# -------------------------------------------------------
+# ⚡ Caching
+# -------------------------------------------------------
+
+# In-process (per-worker) cache lookups, labelled by cache name:
+# "url_records" (hot redirect tier in front of Redis), "user_agents" and
+# "geoip" (click enrichment). Hit rate = hits / (hits + misses).
+LOCAL_CACHE_HITS = Counter(
+    "local_cache_hits_total",
+    "In-process cache hits",
+    ["cache"]
+)
+
+LOCAL_CACHE_MISSES = Counter(
+    "local_cache_misses_total",
+    "In-process cache misses (including expired entries)",
+    ["cache"]
+)
+
+# Entries dropped because the cache reached its size bound.
+LOCAL_CACHE_EVICTIONS = Counter(
+    "local_cache_evictions_total",
+    "In-process cache LRU evictions",
+    ["cache"]
+)
+
+# Short-code membership filter lookups on redirect cache misses.
+# result: "rejected" (filter ruled it out), "negative_cached", "passed",
+# "false_positive" (passed but missing in MySQL), "filter_missing" (not built yet).
+CODE_FILTER_LOOKUPS = Counter(
+    "code_filter_lookups_total",
+    "Short-code filter lookups by result",
+    ["result"]
+)
+
+# Observed share of unknown codes that the filter let through to MySQL.
+CODE_FILTER_FALSE_POSITIVE_RATE = Gauge(
+    "code_filter_false_positive_rate",
+    "Observed false-positive rate of the short-code filter"
+)
+
+# Codes drawn from leased allocator blocks.
+# result: "issued" (free) or "skipped" (already in urls, e.g. a custom or legacy code).
+CODE_ALLOCATOR_CODES = Counter(
+    "code_allocator_codes_total",
+    "Short codes drawn from leased blocks by result",
+    ["result"]
+)
+
+
+# -------------------------------------------------------
+# 🗄️ Click persistence
+# -------------------------------------------------------
+
+# Rows written per url_clicks batch flush.
+CLICK_BATCH_ROWS = Histogram(
+    "click_batch_rows",
+    "Clicks written per batch flush",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+)
+
+# Time spent writing one batch (dedupe SELECT + multi-row INSERT + per-row hooks + commit).
+CLICK_BATCH_FLUSH_LATENCY = Histogram(
+    "click_batch_flush_seconds",
+    "Click batch flush latency in seconds"
+)
+
+
+# -------------------------------------------------------
+# 🚦 Rate limiting
+# -------------------------------------------------------
+
+# Limiter decisions per route.
+# result: "allowed", "denied", "denied_local" (in-process pre-check, no Redis call),
+# "error" (Redis unavailable, request allowed).
+RATE_LIMIT_DECISIONS = Counter(
+    "rate_limit_decisions_total",
+    "Rate limiter decisions by route and result",
+    ["route", "result"]
+)
+
+# Time to reach a decision; source is "local" (pre-check) or "redis" (Lua call).
+RATE_LIMIT_LATENCY = Histogram(
+    "rate_limit_decision_seconds",
+    "Rate limiter decision latency in seconds",
+    ["source"],
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+)
+
+
+# -------------------------------------------------------
+# 🔐 Authentication
+# -------------------------------------------------------
+
+# JWT checks on protected routes.
+# source: "verify" (RS256 signature check) or "cache" (verified-claims cache);
+# result: "valid" or "invalid". cache / (cache + verify) is the hit ratio.
+JWT_DECODES = Counter(
+    "jwt_decodes_total",
+    "JWT checks by source and result",
+    ["source", "result"]
+)
@@ -0,0 +1,148 @@
+"""
+Rate limiting: token bucket and sliding-window log, each one atomic Lua call.
+
+Limits are configured per route and tier in consts.RATE_LIMITS:
+
+    route -> {"algorithm": "token_bucket" | "sliding_window",
+              "tiers": {tier: (limit, window_seconds)}}
+
+The tier is the caller's `role` claim ("user", "admin") for per-user limits and
+"ip" for per-address limits. `cost` lets one request spend several units (bulk
+endpoints); a cost above the whole budget can never be allowed and is rejected
+without a Redis call (retry_after is infinite). Denials are remembered in-process until they expire, so a client
+hammering past its limit is rejected without a Redis call.
+"""
+import math
+import time
+import logging
+from typing import NamedTuple
+from uuid import uuid4
+
+import redis
+from db import redis_client
+from local_cache import LocalCache
+from consts import RATE_LIMIT, RATE_LIMITS, RATE_LIMIT_LOCAL_PRECHECK, RATE_LIMIT_LOCAL_SIZE
+from metrics import RATE_LIMIT_DECISIONS, RATE_LIMIT_LATENCY
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMIT = {"algorithm": "sliding_window", "tiers": {}}
+
+
+class Decision(NamedTuple):
+    allowed: bool
+    limit: int
+    remaining: int
+    retry_after: float  # seconds until the request would be allowed, 0 when allowed, inf when never
+
+
+# ---------------------------
+# Lua scripts
+# ---------------------------
+# KEYS: bucket hash (tokens, ts)
+# ARGV: capacity, refill per second, now, cost
+_TOKEN_BUCKET_SCRIPT = redis_client.register_script("""
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return {allowed, math.floor(tokens), tostring(retry_after)}
+""")
+
+# KEYS: log zset (one member per unit spent, scored by time)
+# ARGV: limit, window seconds, now, cost, member prefix
+_SLIDING_WINDOW_SCRIPT = redis_client.register_script("""
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+local count = redis.call('ZCARD', KEYS[1])
+if count + cost <= limit then
+    for i = 1, cost do
+        redis.call('ZADD', KEYS[1], now, ARGV[5] .. ':' .. i)
+    end
+    redis.call('PEXPIRE', KEYS[1], math.ceil(window * 1000))
+    return {1, limit - count - cost, '0'}
+end
+
+-- Wait until enough of the oldest entries leave the window
+local retry_after = window
+local needed = count + cost - limit
+local entry = redis.call('ZRANGE', KEYS[1], needed - 1, needed - 1, 'WITHSCORES')
+if entry[2] then
+    retry_after = tonumber(entry[2]) + window - now
+end
+return {0, math.max(0, limit - count), tostring(retry_after)}
+""")
+
+
+# ---------------------------
+# Local pre-check
+# ---------------------------
+# key -> (cost Redis denied, monotonic deadline); expires when that denial's retry_after does
+_denials = LocalCache("rate_limit_denials", maxsize=RATE_LIMIT_LOCAL_SIZE if RATE_LIMIT_LOCAL_PRECHECK else 0)
+
+
+def _limit_for(route: str, tier: str):
+    config = RATE_LIMITS.get(route, DEFAULT_LIMIT)
+    limit, window = config["tiers"].get(tier, (RATE_LIMIT, 60))
+    return config["algorithm"], limit, window
+
+
+def check(route: str, identity: str, tier: str = "user", cost: int = 1) -> Decision:
+    """
+    Spend `cost` units of `identity`'s budget for `route` (one Redis call, none if
+    a recent denial is still in effect). Fails open if Redis is unavailable.
+    """
+    algorithm, limit, window = _limit_for(route, tier)
+    key = f"rl:{route}:{tier}:{identity}"
+    started = time.perf_counter()
+
+    if cost > limit:
+        # The scripts would report a finite wait for a request no amount of waiting lets through
+        RATE_LIMIT_DECISIONS.labels(route=route, result="too_large").inc()
+        return Decision(False, limit, 0, math.inf)
+
+    denial = _denials.get(key)
+    if denial is not None and cost >= denial[0]:
+        RATE_LIMIT_LATENCY.labels(source="local").observe(time.perf_counter() - started)
+        RATE_LIMIT_DECISIONS.labels(route=route, result="denied_local").inc()
+        return Decision(False, limit, 0, max(0.0, denial[1] - time.monotonic()))
+
+    try:
+        if algorithm == "token_bucket":
+            allowed, remaining, retry_after = _TOKEN_BUCKET_SCRIPT(
+                keys=[key], args=[limit, limit / window, f"{time.time():.6f}", cost])
+        else:
+            allowed, remaining, retry_after = _SLIDING_WINDOW_SCRIPT(
+                keys=[key], args=[limit, window, f"{time.time():.6f}", cost, uuid4().hex])
+    except redis.RedisError as e:
+        logger.error(f"Rate limiter unavailable, allowing request: {e}")
+        RATE_LIMIT_DECISIONS.labels(route=route, result="error").inc()
+        return Decision(True, limit, limit, 0)
+    finally:
+        RATE_LIMIT_LATENCY.labels(source="redis").observe(time.perf_counter() - started)
+
+    decision = Decision(bool(allowed), limit, int(remaining), float(retry_after))
+    if not decision.allowed:
+        _denials.set(key, (cost, time.monotonic() + decision.retry_after), ttl=decision.retry_after)
+    RATE_LIMIT_DECISIONS.labels(route=route, result="allowed" if decision.allowed else "denied").inc()
+    return decision
@@ -0,0 +1,54 @@
+import hashlib
+import logging
+from typing import Iterable, Optional
+
+import redis
+from flask import Response, request
+from db import redis_client
+from consts import ANALYTICS_RESPONSE_TTL
+
+logger = logging.getLogger(__name__)
+
+# Dashboards poll the same reports over and over. Every response gets an ETag
+# derived from what it depends on, so an unchanged report costs a 304 and no
+# serialization; analytics pages are also kept whole in analytics:resp:<etag>.
+RESPONSE_KEY_PREFIX = "analytics:resp:"
+
+
+def make_etag(*parts) -> str:
+    return hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()
+
+
+def query_params(exclude: Iterable[str] = ()) -> str:
+    """The request's query string in a stable order, for ETags."""
+    return "&".join(f"{key}={value}" for key, value in sorted(request.args.items(multi=True)) if key not in exclude)
+
+
+def not_modified(etag: str) -> Optional[Response]:
+    """A 304 when the client already holds this version, None otherwise."""
+    if not request.if_none_match.contains(etag):
+        return None
+    response = Response(status=304)
+    return tag(response, etag)
+
+
+def tag(response: Response, etag: str) -> Response:
+    response.set_etag(etag)
+    # Clients may keep the body but must revalidate every time
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def get_cached_response(etag: str) -> Optional[str]:
+    try:
+        return redis_client.get(f"{RESPONSE_KEY_PREFIX}{etag}")  # type: ignore
+    except redis.RedisError:
+        logger.warning("Response cache unavailable, recomputing", exc_info=True)
+        return None
+
+
+def cache_response(etag: str, body: str) -> None:
+    try:
+        redis_client.set(f"{RESPONSE_KEY_PREFIX}{etag}", body, ex=ANALYTICS_RESPONSE_TTL)
+    except redis.RedisError:
+        logger.warning("Response cache unavailable, not storing", exc_info=True)
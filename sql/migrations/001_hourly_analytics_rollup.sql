@@ -0,0 +1,35 @@
+-- =====================================
+-- url_analytics_hourly: one row per URL per hour
+-- =====================================
+-- Collapses the per-fingerprint rows into per-hour rows. Historical
+-- unique_visitors become the number of distinct fingerprints with clean clicks;
+-- from now on the column is filled from Redis HyperLogLogs.
+-- Run once, with click workers stopped.
+
+ALTER TABLE url_analytics_hourly DROP FOREIGN KEY fk_analytics_url;
+
+CREATE TABLE url_analytics_hourly_new (
+    url_id CHAR(36),
+    date_hour DATETIME NOT NULL, -- truncated to hour
+    clicks INT DEFAULT 0,
+    unique_visitors INT DEFAULT 0,
+    suspicious_clicks INT DEFAULT 0,
+    PRIMARY KEY(url_id, date_hour),
+    CONSTRAINT fk_analytics_url FOREIGN KEY (url_id) REFERENCES urls(id) ON DELETE CASCADE
+);
+
+INSERT INTO url_analytics_hourly_new (url_id, date_hour, clicks, unique_visitors, suspicious_clicks)
+SELECT url_id,
+       date_hour,
+       SUM(clicks),
+       COUNT(DISTINCT CASE WHEN clicks > 0 THEN fingerprint END),
+       SUM(suspicious_clicks)
+FROM url_analytics_hourly
+GROUP BY url_id, date_hour;
+
+RENAME TABLE url_analytics_hourly TO url_analytics_hourly_old,
+             url_analytics_hourly_new TO url_analytics_hourly;
+
+DROP TABLE url_analytics_hourly_old;
+
+CREATE INDEX idx_analytics_hour ON url_analytics_hourly(date_hour);
@@ -0,0 +1,7 @@
+-- =====================================
+-- urls.trending_score index
+-- =====================================
+-- tasks.update_trending_urls resets every score outside the current top N
+-- (WHERE trending_score > 0); the index keeps that a range scan.
+
+CREATE INDEX idx_urls_trending_score ON urls(trending_score);
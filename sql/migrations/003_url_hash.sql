@@ -0,0 +1,9 @@
+-- =====================================
+-- urls.url_hash (per-user URL dedupe)
+-- =====================================
+-- SHA-256 hex of "<user_id>\n<normalized url>" (see url_dedupe.py), written on
+-- every insert. Rows created before this migration keep NULL and are simply
+-- never matched by dedupe lookups.
+
+ALTER TABLE urls ADD COLUMN url_hash CHAR(64) NULL;
+CREATE INDEX idx_urls_url_hash ON urls(url_hash);
@@ -0,0 +1,13 @@
+-- =====================================
+-- click_counter_flushes (click counter flush ledger)
+-- =====================================
+-- One row per applied clicks:pending snapshot (see click_counters.py), so a
+-- flush that crashed after committing is never applied twice. Required before
+-- deploying the Redis click counters; flush_pending fails without it.
+
+CREATE TABLE IF NOT EXISTS click_counter_flushes (
+    id CHAR(36) PRIMARY KEY,
+    flushed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_click_counter_flushes_flushed_at ON click_counter_flushes(flushed_at);
@@ -42,6 +42,11 @@ CREATE INDEX idx_urls_user_id_created_at ON urls(user_id, created_at);
 CREATE INDEX idx_urls_code_user_id ON urls(code, user_id);
 CREATE INDEX idx_urls_created_at ON urls(created_at);
 ALTER TABLE urls ADD COLUMN trending_score DOUBLE DEFAULT 0;
+-- Lets the trending job find scores to reset without scanning urls
+CREATE INDEX idx_urls_trending_score ON urls(trending_score);
+ALTER TABLE urls ADD COLUMN url_hash CHAR(64) NULL;
+-- Per-user dedupe of identical destinations (url_dedupe.py)
+CREATE INDEX idx_urls_url_hash ON urls(url_hash);
 -- =====================================
 -- URL Clicks Table
 -- =====================================
@@ -65,6 +70,18 @@ CREATE INDEX idx_clicks_fingerprint ON url_clicks(fingerprint);
 CREATE INDEX idx_url_clicks_url_ip ON url_clicks(url_id, ip);
 CREATE INDEX idx_url_clicks_url_user_agent ON url_clicks(url_id, user_agent(50));
 
+-- =====================================
+-- Click Counter Flush Ledger
+-- =====================================
+-- One row per applied clicks:pending snapshot, so a flush that crashed
+-- after committing is never applied twice.
+CREATE TABLE IF NOT EXISTS click_counter_flushes (
+    id CHAR(36) PRIMARY KEY,
+    flushed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_click_counter_flushes_flushed_at ON click_counter_flushes(flushed_at);
+
 -- =====================================
 -- Suspicious Clicks Table
 -- =====================================
@@ -83,6 +100,9 @@ CREATE TABLE IF NOT EXISTS suspicious_clicks (
 -- =====================================
 -- Hourly Analytics Table
 -- =====================================
+-- One row per URL per hour. unique_visitors is rolled up from Redis
+-- HyperLogLogs (hll:<url_id>:<YYYYMMDDHH>) by tasks.rollup_unique_visitors_task.
+-- Existing installs keyed by fingerprint: see migrations/001_hourly_analytics_rollup.sql
 CREATE TABLE IF NOT EXISTS url_analytics_hourly (
     url_id CHAR(36),
     date_hour DATETIME NOT NULL, -- truncated to hour
@@ -92,12 +112,8 @@ CREATE TABLE IF NOT EXISTS url_analytics_hourly (
     PRIMARY KEY(url_id, date_hour),
     CONSTRAINT fk_analytics_url FOREIGN KEY (url_id) REFERENCES urls(id) ON DELETE CASCADE
 );
-ALTER TABLE url_analytics_hourly ADD COLUMN fingerprint CHAR(64) NOT NULL AFTER url_id;
-ALTER TABLE url_analytics_hourly
-DROP PRIMARY KEY,
-ADD PRIMARY KEY (url_id, fingerprint, date_hour);
 
-CREATE INDEX idx_analytics_url_hour ON url_analytics_hourly(url_id, date_hour);
+CREATE INDEX idx_analytics_hour ON url_analytics_hourly(date_hour);
 
 -- =====================================
 -- User Sequences Table (Behavioral Tracking)
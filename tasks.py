@@ -1,16 +1,21 @@
 import logging
-import json
+import time
+from functools import partial
 from uuid import uuid4
 from datetime import datetime
+from typing import List, Optional
 
 from celery import Celery
 from celery.schedules import crontab
+from celery.signals import worker_ready
+import ipaddress
 import geoip2.database
+from maxminddb import MODE_AUTO, MODE_MMAP, MODE_MEMORY
 import user_agents
-from decimal import Decimal
 from db import get_connection, redis_client,safe_close
-from consts import REDIS_HOST, REDIS_PORT
-from fraud import is_fraud, check_velocity, check_behavior
+from consts import TRENDING_TOP_N, REDIS_HOST, REDIS_PORT, GEOIP_MODE, GEOIP_CACHE_BY_PREFIX, UA_CACHE_SIZE, GEOIP_CACHE_SIZE
+from local_cache import LocalCache
+from fraud import evaluate_click
 from metrics import (
     UNIQUE_VISITORS,
     TOP_REFERRERS,
@@ -19,18 +24,14 @@ from metrics import (
     CLICKS_BY_BROWSER,
     CLICKS_BY_HOUR,
     SUSPICIOUS_CLICKS,
-    SUSPICIOUS_IP_URLS,
-    SUSPICIOUS_IPS,
-    SUSPICIOUS_REQUESTS
+    SUSPICIOUS_REQUESTS,
+    TRENDING_UPDATE_DURATION
 )
-from analytics import increment_hourly_analytics, update_user_sequence,update_url_referres
-
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, obj): # type: ignore
-        if isinstance(obj, Decimal):
-            return float(obj)   # or str(obj) if you prefer exact
-        return super(DecimalEncoder, self).default(obj)
-
+from analytics import increment_hourly_analytics, record_click_analytics, track_unique_visitor, rollup_unique_visitors, bump_analytics_version
+from code_filter import rebuild_code_filter, FILTER_KEY
+from click_writer import ClickBatchWriter, make_click_row, write_clicks
+from click_counters import flush_pending
+from trending import rebuild_leaderboard, top_trending, build_score_update
 
 # ---------- Logging ----------
 logging.basicConfig(level=logging.INFO)
@@ -44,20 +45,45 @@ celery.conf.update(
         "update-trending-scores-every-1-minute": {
             "task": "tasks.update_trending_urls",
             "schedule": crontab(minute="*/1"),
-        }
+        },
+        "rollup-unique-visitors-every-1-minute": {
+            "task": "tasks.rollup_unique_visitors_task",
+            "schedule": crontab(minute="*/1"),
+        },
+        "flush-click-counters-every-10-seconds": {
+            "task": "tasks.flush_click_counters",
+            "schedule": 10.0,
+        },
+        # Full rebuild drops codes that no longer exist from the Bloom filter
+        "rebuild-code-filter-daily": {
+            "task": "tasks.rebuild_code_filter_task",
+            "schedule": crontab(minute="0", hour="3"),
+        },
     },
     timezone="UTC",
 )
 
 # ---------- GeoIP ----------
+# MODE_AUTO picks the C reader (libmaxminddb) when available, else the pure-Python
+# mmap reader; both map the database file instead of reading it into each process.
+# Opened at import time, before the prefork pool forks, so workers share the pages.
+GEOIP_MODES = {"auto": MODE_AUTO, "mmap": MODE_MMAP, "memory": MODE_MEMORY}
 try:
-    GEOIP_READER = geoip2.database.Reader("data/GeoLite2-City.mmdb")
+    GEOIP_READER = geoip2.database.Reader("data/GeoLite2-City.mmdb", mode=GEOIP_MODES.get(GEOIP_MODE, MODE_AUTO))
 except FileNotFoundError:
     GEOIP_READER = None
     logger.warning("⚠️ GeoLite2-City.mmdb not found. Falling back to 'unknown' country")
 
+# ---------- Enrichment caches ----------
+# The same UA strings and client IPs repeat constantly; both lookups are pure
+_ua_cache = LocalCache("user_agents", maxsize=UA_CACHE_SIZE)
+_geoip_cache = LocalCache("geoip", maxsize=GEOIP_CACHE_SIZE)
+
 
 def parse_user_agent(ua_string: str):
+    cached = _ua_cache.get(ua_string)
+    if cached is not None:
+        return cached
     ua = user_agents.parse(ua_string)
     if ua.is_mobile:
         device = "mobile"
@@ -68,100 +94,105 @@ def parse_user_agent(ua_string: str):
     else:
         device = "other"
     browser = ua.browser.family.lower() or "unknown"
+    _ua_cache.set(ua_string, (device, browser))
     return device, browser
 
 
+def _geoip_cache_key(ip: str) -> str:
+    if not GEOIP_CACHE_BY_PREFIX:
+        return ip
+    try:
+        addr = ipaddress.ip_address(ip)
+    except ValueError:
+        return ip
+    # Country never changes inside a /24 (IPv4) or /48 (IPv6) in practice
+    prefix = 24 if addr.version == 4 else 48
+    return str(ipaddress.ip_network(f"{ip}/{prefix}", strict=False))
+
+
 def get_country_from_ip(ip: str) -> str:
     if not GEOIP_READER:
         return "unknown"
+    key = _geoip_cache_key(ip)
+    cached = _geoip_cache.get(key)
+    if cached is not None:
+        return cached
     try:
         response = GEOIP_READER.city(ip)
-        return response.country.iso_code.lower() if response.country.iso_code else "unknown"
+        country = response.country.iso_code.lower() if response.country.iso_code else "unknown"
     except Exception:
-        return "unknown"
+        country = "unknown"
+    _geoip_cache.set(key, country)
+    return country
 
 
-# ---------------- Celery Tasks ----------------
+# ---------------- Click processing ----------------
 
-@celery.task(bind=True, max_retries=3, default_retry_delay=5)
-def log_click(self, url_id: str, ip: str, user_agent: str, referrer: str, fingerprint: str):
+def process_click(url_id: str, ip: str, user_agent: str, referrer: str, fingerprint: str,
+                  clicked_at: Optional[datetime] = None, writer: Optional[ClickBatchWriter] = None,
+                  click_id: Optional[str] = None):
     """
     Log a click event:
-    - Stores click in DB
-    - Updates Prometheus metrics
+    - Stores click in DB (buffered in `writer` when given, written immediately otherwise)
     - Updates analytics
+    - Updates Prometheus metrics
+    With `click_id` (stream events) a replayed click is recognised and changes nothing.
     """
-    conn = None
-    cursor = None
-    try:
-        country = get_country_from_ip(ip)
-        device, browser = parse_user_agent(user_agent or "")
-        click_id = str(uuid4())
-        now = datetime.utcnow()
-        date_str = now.strftime("%Y-%m-%d")
-        hour = now.hour
-
-        # --- DB ---
-        conn = get_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute(
-            """
-            INSERT INTO url_clicks (id, url_id, ip, user_agent, referrer)
-            VALUES (%s, %s, %s, %s, %s)
-            """,
-            (click_id, url_id, ip, user_agent, referrer)
-        )
-        cursor.execute(
-            "UPDATE urls SET clicks = clicks + 1 WHERE id=%s",
-            (url_id,)
-        )
-        conn.commit()
+    now = clicked_at or datetime.utcnow()
 
-        # --- Metrics ---
-        UNIQUE_VISITORS.labels(url=url_id, date=date_str).inc()
-        if referrer:
-            TOP_REFERRERS.labels(url=url_id, referrer=referrer).inc()
-        CLICKS_BY_COUNTRY.labels(url=url_id, country=country).inc()
-        CLICKS_BY_DEVICE.labels(url=url_id, device=device).inc()
-        CLICKS_BY_BROWSER.labels(url=url_id, browser=browser).inc()
-        CLICKS_BY_HOUR.labels(url=url_id).observe(hour)
-
-        # --- Analytics ---
-        increment_hourly_analytics(url_id, fingerprint, suspicious=False)
-        update_user_sequence(fingerprint, url_id)
-        update_url_referres(url_id=url_id,referrer=referrer)
-    except Exception as e:
-        logger.error(f"Error logging click: {e}", exc_info=True)
-        raise self.retry(exc=e)
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+    # --- DB + Analytics ---
+    # Analytics share the click row's transaction and only run when the row is new
+    row = make_click_row(url_id, ip, user_agent, referrer, fingerprint, now, click_id)
+    analytics = partial(record_click_analytics, url_id, fingerprint, referrer, clicked_at=now)
+    tracking = partial(_track_click, url_id, ip, user_agent, referrer, fingerprint, now)
+    if writer is not None:
+        writer.add(row, in_transaction=lambda cursor: analytics(cursor=cursor), after_commit=tracking)
+    else:
+        # One connection and one transaction for the click row and its analytics
+        stored = write_clicks([row], in_transaction=lambda cursor, new_rows: analytics(cursor=cursor) if new_rows else None)
+        if stored:
+            tracking()
 
 
-@celery.task(bind=True, max_retries=3, default_retry_delay=5)
-def check_fraud(self, ip: str, url_id: str, user_agent: str, referrer: str, fingerprint: str):
+def _track_click(url_id: str, ip: str, user_agent: str, referrer: str, fingerprint: str, now: datetime) -> None:
+    """Unique visitors and Prometheus metrics for a stored click."""
+    country = get_country_from_ip(ip)
+    device, browser = parse_user_agent(user_agent or "")
+    date_str = now.strftime("%Y-%m-%d")
+    hour = now.hour
+
+    track_unique_visitor(url_id, fingerprint, now)
+
+    # --- Metrics ---
+    UNIQUE_VISITORS.labels(url=url_id, date=date_str).inc()
+    if referrer:
+        TOP_REFERRERS.labels(url=url_id, referrer=referrer).inc()
+    CLICKS_BY_COUNTRY.labels(url=url_id, country=country).inc()
+    CLICKS_BY_DEVICE.labels(url=url_id, device=device).inc()
+    CLICKS_BY_BROWSER.labels(url=url_id, browser=browser).inc()
+    CLICKS_BY_HOUR.labels(url=url_id).observe(hour)
+
+
+def detect_fraud(ip: str, url_code: str, user_agent: str, referrer: str, fingerprint: str,
+                 url_id: Optional[str] = None, request_reasons: Optional[List[str]] = None,
+                 clicked_at: Optional[float] = None) -> bool:
     """
     Detect suspicious activity:
-    - Checks heuristic fraud rules
-    - Stores suspicious clicks
-    - Updates analytics & metrics
+    - Checks fraud rules (`request_reasons`: request rules already run by the redirect handler;
+      `clicked_at`: the click's epoch time, for clicks checked after the fact)
+    - Stores suspicious clicks with their reason codes
+    - Updates analytics & metrics (hourly analytics need the resolved `url_id`)
     """
-    suspicious = (
-        is_fraud(ip, url_id, user_agent, referrer) or
-        check_velocity(fingerprint) or
-        check_behavior(fingerprint, url_id)
-    )
+    reasons = evaluate_click(ip, url_code, user_agent, referrer, fingerprint, request_reasons, clicked_at)
+    suspicious = bool(reasons)
 
     if suspicious:
-        logger.warning(f"🚨 Suspicious click: ip={ip}, url={url_id}, fingerprint={fingerprint}")
+        logger.warning(f"🚨 Suspicious click: ip={ip}, url={url_code}, fingerprint={fingerprint}, reasons={reasons}")
 
         # --- Prometheus Metrics ---
         SUSPICIOUS_REQUESTS.labels(type="task_detected").inc()
-        SUSPICIOUS_CLICKS.labels(url=url_id, type="heuristic_detected").inc()
-        SUSPICIOUS_IPS.inc()
-        SUSPICIOUS_IP_URLS.inc()
+        for reason in reasons:
+            SUSPICIOUS_CLICKS.labels(url=url_code, type=reason).inc()
 
         # --- Store in DB ---
         conn = None
@@ -175,65 +206,79 @@ def check_fraud(self, ip: str, url_id: str, user_agent: str, referrer: str, fing
                 (id, fingerprint, ip, user_agent, referrer, reason, url_code)
                 VALUES (%s, %s, %s, %s, %s, %s, %s)
                 """,
-                (str(uuid4()), fingerprint, ip, user_agent, referrer, "heuristic_detected", url_id)
+                (str(uuid4()), fingerprint, ip, user_agent, referrer, ",".join(reasons), url_code)
             )
+            # Analytics for suspicious click, same transaction
+            if url_id:
+                increment_hourly_analytics(cursor, url_id, suspicious=True)
             conn.commit()
-
-            # Analytics for suspicious click
-            increment_hourly_analytics(url_id, fingerprint, suspicious=True)
-
-        except Exception as e:
-            logger.error(f"Error logging suspicious click: {e}", exc_info=True)
-            raise self.retry(exc=e)
         finally:
             if cursor:
                 cursor.close()
             if conn:
                 safe_close(conn)
+        if url_id:
+            bump_analytics_version(url_id)
 
     return suspicious
 
 
+# ---------------- Celery Tasks ----------------
+
+@celery.task(bind=True, max_retries=3, default_retry_delay=5)
+def log_click(self, url_id: str, ip: str, user_agent: str, referrer: str, fingerprint: str,
+              url_code: Optional[str] = None, request_reasons: Optional[List[str]] = None):
+    """
+    Celery wrapper around process_click (CLICK_INGEST_MODE=celery).
+    With `url_code` it also runs the stateful fraud rules, so a click is one task.
+    """
+    try:
+        # The task id survives retries, so a retried click keeps its row id
+        process_click(url_id, ip, user_agent, referrer, fingerprint, click_id=self.request.id)
+    except Exception as e:
+        logger.error(f"Error logging click: {e}", exc_info=True)
+        raise self.retry(exc=e)
+    if url_code is None:
+        return
+    try:
+        detect_fraud(ip, url_code, user_agent, referrer, fingerprint, url_id, request_reasons)
+    except Exception as e:
+        # Not retried: the click row is committed and a retry would log it twice
+        logger.error(f"Error checking click for fraud: {e}", exc_info=True)
+
+
+@celery.task(bind=True, max_retries=3, default_retry_delay=5)
+def check_fraud(self, ip: str, url_id: str, user_agent: str, referrer: str, fingerprint: str,
+                resolved_url_id: Optional[str] = None, request_reasons: Optional[List[str]] = None):
+    """
+    Celery wrapper around detect_fraud, for callers that check a click on its own
+    (the redirect handler uses log_click). `url_id` carries the short code; `resolved_url_id` is urls.id.
+    """
+    try:
+        return detect_fraud(ip, url_id, user_agent, referrer, fingerprint, resolved_url_id, request_reasons)
+    except Exception as e:
+        logger.error(f"Error logging suspicious click: {e}", exc_info=True)
+        raise self.retry(exc=e)
+
+
 @celery.task
-def update_trending_urls(top_n: int = 20):
+def update_trending_urls(top_n: int = TRENDING_TOP_N):
     """
-    Updates trending URLs based on last 4 hours of hourly analytics
-    Stores result in MySQL and Redis
+    Rebuilds the trending leaderboard from the hourly Redis buckets and writes
+    the top N to urls.trending_score in one statement (other scores reset to 0)
     """
     conn = None
     cursor = None
+    started = time.perf_counter()
     try:
+        rebuild_leaderboard()
+        trending = top_trending(top_n)
+
         conn = get_connection()
-        cursor = conn.cursor(dictionary=True)
-
-        cursor.execute("""
-            SELECT url_id,
-                SUM(
-                    clicks * CASE
-                        WHEN TIMESTAMPDIFF(HOUR, date_hour, NOW()) < 1 THEN 1
-                        WHEN TIMESTAMPDIFF(HOUR, date_hour, NOW()) < 2 THEN 0.5
-                        WHEN TIMESTAMPDIFF(HOUR, date_hour, NOW()) < 4 THEN 0.25
-                        ELSE 0
-                    END
-                ) AS trending_score
-            FROM url_analytics_hourly
-            WHERE date_hour >= NOW() - INTERVAL 4 HOUR
-            GROUP BY url_id
-            ORDER BY trending_score DESC
-            LIMIT %s
-        """, (top_n,))
-        trending = cursor.fetchall()
-
-        for row in trending:
-            cursor.execute(
-                "UPDATE urls SET trending_score=%s WHERE id=%s",
-                (row["trending_score"], row["url_id"])
-            )
+        cursor = conn.cursor()
+        cursor.execute(*build_score_update({row["url_id"]: row["trending_score"] for row in trending}))
         conn.commit()
-
-        # Store in Redis
-        redis_client.set("trending_urls", json.dumps(trending, cls=DecimalEncoder))
-        logger.info(f"✅ Updated trending URLs ({len(trending)} rows)")
+        logger.info(f"✅ Updated trending URLs ({len(trending)} rows, {cursor.rowcount} changed)")
 
     except Exception as e:
         logger.error(f"Error updating trending URLs: {e}", exc_info=True)
@@ -242,3 +287,39 @@ def update_trending_urls(top_n: int = 20):
             cursor.close()
         if conn:
             safe_close(conn)
+        TRENDING_UPDATE_DURATION.observe(time.perf_counter() - started)
+
+
+@celery.task
+def rebuild_code_filter_task():
+    """Rebuild the short-code Bloom filter from urls.code."""
+    try:
+        return rebuild_code_filter()
+    except Exception as e:
+        logger.error(f"Error rebuilding code filter: {e}", exc_info=True)
+
+
+@worker_ready.connect
+def build_code_filter_if_missing(sender=None, **kwargs):
+    # Redirects fail open until the filter exists, so build it on first start
+    if not redis_client.exists(FILTER_KEY):
+        rebuild_code_filter_task.delay()  # type: ignore
+
+
+@celery.task
+def flush_click_counters():
+    """Flush live Redis click counters to urls.clicks (snapshot-and-swap, idempotent)."""
+    try:
+        return flush_pending()
+    except Exception as e:
+        # The snapshot stays in Redis and is finished by the next run
+        logger.error(f"Error flushing click counters: {e}", exc_info=True)
+
+
+@celery.task
+def rollup_unique_visitors_task():
+    """Copy HyperLogLog unique-visitor counts into url_analytics_hourly."""
+    try:
+        return rollup_unique_visitors()
+    except Exception as e:
+        logger.error(f"Error rolling up unique visitors: {e}", exc_info=True)
@@ -0,0 +1,199 @@
+# tests/test_analytics.py
+import json
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+from analytics import (
+    record_click_analytics, update_user_sequence, increment_hourly_analytics,
+    track_unique_visitor, unique_visitors_between, rollup_unique_visitors,
+    fetch_series_page, iter_series, series_page, align_range, series_range,
+)
+from consts import ANALYTICS_SERIES_TTL
+
+# ----------------------------
+# Test record_click_analytics
+# ----------------------------
+def test_record_click_analytics_single_checkout_and_commit(mocker):
+    mock_conn = mocker.patch("analytics.get_connection")
+    mock_cursor = MagicMock()
+    mock_cursor.fetchone.return_value = None
+    mock_conn.return_value.cursor.return_value = mock_cursor
+
+    record_click_analytics("url123", "fp123", "https://ref.com")
+
+    mock_conn.assert_called_once()
+    mock_conn.return_value.commit.assert_called_once()
+    statements = [c[0][0] for c in mock_cursor.execute.call_args_list]
+    assert not any("SELECT 1 FROM urls" in s for s in statements)
+
+def test_record_click_analytics_uses_callers_cursor(mocker):
+    mock_conn = mocker.patch("analytics.get_connection")
+    cursor = MagicMock()
+    cursor.fetchone.return_value = None
+
+    record_click_analytics("url123", "fp123", None, cursor=cursor)
+
+    mock_conn.assert_not_called()
+    assert cursor.execute.call_count == 4
+
+# ----------------------------
+# Test update_user_sequence
+# ----------------------------
+def test_update_user_sequence_appends_and_trims():
+    cursor = MagicMock()
+    cursor.fetchone.return_value = (json.dumps(["a", "b", "c"]),)
+
+    update_user_sequence(cursor, "fp123", "d", max_length=3)
+
+    _, params = cursor.execute.call_args[0]
+    assert params == ("fp123", json.dumps(["b", "c", "d"]))
+
+# ----------------------------
+# Test hourly rollup rows
+# ----------------------------
+def test_increment_hourly_analytics_is_per_url_per_hour():
+    cursor = MagicMock()
+    clicked_at = datetime(2024, 5, 1, 13, 45, 10)
+
+    increment_hourly_analytics(cursor, "url123", suspicious=True, clicked_at=clicked_at)
+
+    sql, params = cursor.execute.call_args[0]
+    assert "fingerprint" not in sql
+    assert params == ("url123", datetime(2024, 5, 1, 13), 0, 1)
+
+# ----------------------------
+# Test unique visitors
+# ----------------------------
+def test_track_unique_visitor_pfadds_hour_bucket(mocker):
+    mock_redis = mocker.patch("analytics.redis_client")
+    pipe = mock_redis.pipeline.return_value
+
+    track_unique_visitor("url123", "fp123", datetime(2024, 5, 1, 13, 45))
+
+    pipe.pfadd.assert_called_once_with("hll:url123:2024050113", "fp123")
+    pipe.sadd.assert_called_once_with("hll:active:2024050113", "url123")
+    pipe.execute.assert_called_once()
+
+def test_unique_visitors_between_merges_hours(mocker):
+    mock_redis = mocker.patch("analytics.redis_client")
+    mock_redis.pfcount.return_value = 42
+    end = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+
+    assert unique_visitors_between("url123", end - timedelta(days=1), end) == 42
+    assert len(mock_redis.pfcount.call_args[0]) == 24
+
+def test_unique_visitors_between_outside_retention(mocker):
+    mocker.patch("analytics.redis_client")
+    start = datetime.utcnow() - timedelta(days=30)
+    assert unique_visitors_between("url123", start, start + timedelta(days=1)) is None
+
+def test_rollup_writes_pfcounts(mocker):
+    mock_redis = mocker.patch("analytics.redis_client")
+    mock_redis.smembers.side_effect = [set(), {"url123"}]
+    mock_redis.pipeline.return_value.execute.return_value = [7]
+    mock_conn = mocker.patch("analytics.get_connection")
+    cursor = MagicMock()
+    mock_conn.return_value.cursor.return_value = cursor
+
+    assert rollup_unique_visitors() == 1
+    rows = cursor.executemany.call_args[0][1]
+    assert rows[0][0] == "url123" and rows[0][2] == 7
+
+# ----------------------------
+# Test analytics time series
+# ----------------------------
+def test_fetch_series_page_hourly_uses_rolled_up_uniques(mocker):
+    mock_uniques = mocker.patch("analytics.unique_visitors_between")
+    cursor = MagicMock()
+    cursor.fetchall.return_value = [
+        {"period": datetime(2025, 1, 1, 10), "clicks": 5, "unique_visitors": 3, "suspicious_clicks": 1},
+    ]
+
+    rows = fetch_series_page(cursor, "url123", "hour", datetime(2025, 1, 1), datetime(2025, 1, 2), 100)
+
+    assert rows == [{"period": "2025-01-01T10:00:00", "clicks": 5, "unique_visitors": 3, "suspicious_clicks": 1}]
+    sql, params = cursor.execute.call_args[0]
+    assert "GROUP BY period" in sql and params[-1] == 100
+    mock_uniques.assert_not_called()
+
+def test_fetch_series_page_weekly_merges_hyperloglogs(mocker):
+    mock_uniques = mocker.patch("analytics.unique_visitors_between", return_value=None)
+    cursor = MagicMock()
+    cursor.fetchall.return_value = [
+        {"period": datetime(2025, 1, 6), "clicks": 50, "unique_visitors": 40, "suspicious_clicks": 0},
+    ]
+
+    rows = fetch_series_page(cursor, "url123", "week", datetime(2025, 1, 1), datetime(2025, 2, 1), 10)
+
+    assert "WEEKDAY(date_hour)" in cursor.execute.call_args[0][0]
+    mock_uniques.assert_called_once_with("url123", datetime(2025, 1, 6), datetime(2025, 1, 13))
+    assert rows[0]["unique_visitors"] is None  # summed hourly uniques would overcount
+
+def test_iter_series_pages_by_keyset(mocker):
+    mocker.patch("analytics.closed_boundary", return_value=datetime(2000, 1, 1))  # every bucket open
+    mock_conn = mocker.patch("analytics.get_connection")
+    day = lambda d: {"period": datetime(2025, 1, d), "clicks": d, "unique_visitors": None, "suspicious_clicks": 0}
+    cursor = mock_conn.return_value.cursor.return_value
+    cursor.fetchall.side_effect = [[day(1), day(2)], [day(3)]]
+    mocker.patch("analytics.unique_visitors_between", return_value=None)
+
+    rows = list(iter_series("url123", "day", datetime(2025, 1, 1), datetime(2025, 2, 1), page_size=2))
+
+    assert [r["clicks"] for r in rows] == [1, 2, 3]
+    # Second page starts right after the last bucket of the first
+    assert cursor.execute.call_args_list[1][0][1][1] == datetime(2025, 1, 3)
+
+def test_series_page_fills_only_missing_segments_of_the_range(mocker):
+    epoch = lambda d: int((datetime(2025, 1, d) - datetime(1970, 1, 1)).total_seconds())
+    day = lambda d: {"period": datetime(2025, 1, d).isoformat(), "clicks": d, "unique_visitors": None, "suspicious_clicks": 0}
+    mock_redis = mocker.patch("analytics.redis_client")
+    # Week of Jan 6 is cached, week of Jan 13 is not
+    mock_redis.mget.return_value = [json.dumps([day(6), day(7)]), None]
+    mock_db = mocker.patch("analytics._db_series", return_value=[day(14)])
+    mock_conn = mocker.patch("analytics.get_connection")
+    mock_conn.return_value.cursor.return_value.fetchall.return_value = [
+        {"period": datetime(2025, 1, 24), "clicks": 24, "unique_visitors": 1, "suspicious_clicks": 0}]
+    mocker.patch("analytics.unique_visitors_between", return_value=1)
+
+    rows = series_page("url123", "day", datetime(2025, 1, 7), datetime(2025, 1, 26), 10,
+                       now=datetime(2025, 1, 25, 12))
+
+    assert [r["clicks"] for r in rows] == [7, 14, 24]
+    mock_redis.mget.assert_called_once_with([f"analytics:series:url123:day:{epoch(6)}",
+                                             f"analytics:series:url123:day:{epoch(13)}"])
+    mock_db.assert_called_once_with("url123", "day", datetime(2025, 1, 13), datetime(2025, 1, 20), mocker.ANY)
+    # Closed buckets expire, so late clicks are picked up on the next fill
+    mock_redis.pipeline.return_value.set.assert_called_once_with(
+        f"analytics:series:url123:day:{epoch(13)}", json.dumps([day(14)]), ex=ANALYTICS_SERIES_TTL)
+    # The week still holding open days is read live
+    assert mock_conn.return_value.cursor.return_value.execute.call_args[0][1][1] == datetime(2025, 1, 20)
+
+def test_omitted_from_only_touches_segments_after_first_click(mocker):
+    mock_redis = mocker.patch("analytics.redis_client")
+    mock_redis.mget.side_effect = lambda keys: [None] * len(keys)
+    mock_db = mocker.patch("analytics._db_series", return_value=[])
+    mocker.patch("analytics.get_connection")
+    cursor = MagicMock()
+    cursor.fetchone.return_value = {"first_hour": datetime(2025, 1, 20, 10)}
+
+    start, end = series_range(cursor, "url123", None, datetime(2025, 1, 23, 12, 30), "hour")
+    series_page("url123", "hour", start, end, 11, now=datetime(2025, 1, 23, 12, 30))
+
+    assert start == datetime(2025, 1, 20, 10)
+    # Jan 20-22 closed (today is live), never anything since 1970
+    keys = [key for c in mock_redis.mget.call_args_list for key in c[0][0]]
+    assert len(keys) == 3
+    assert mock_db.call_args[0][2] == datetime(2025, 1, 20)
+    assert mock_redis.pipeline.return_value.set.call_count == 3
+
+def test_series_range_without_clicks_is_empty():
+    cursor = MagicMock()
+    cursor.fetchone.return_value = {"first_hour": None}
+
+    assert series_range(cursor, "url123", None, datetime(2025, 1, 23, 12), "hour") == (
+        datetime(2025, 1, 23, 12), datetime(2025, 1, 23, 12))
+
+def test_align_range_widens_to_whole_buckets():
+    assert align_range(datetime(2025, 1, 8, 13, 30), datetime(2025, 1, 9, 2), "week") == (
+        datetime(2025, 1, 6), datetime(2025, 1, 13))
+    assert align_range(datetime(2025, 1, 8, 13, 30), datetime(2025, 1, 8, 15), "hour") == (
+        datetime(2025, 1, 8, 13), datetime(2025, 1, 8, 15))
@@ -0,0 +1,37 @@
+# tests/test_app.py
+import pytest
+from app import app
+from auth import create_access_token
+
+@pytest.fixture
+def client(mocker):
+    mocker.patch("app.enforce_rate_limit", return_value=None)
+    return app.test_client()
+
+def auth_header():
+    return {"Authorization": f"Bearer {create_access_token('user-1')}"}
+
+# ----------------------------
+# Test /shorten
+# ----------------------------
+@pytest.mark.parametrize("code", ["has space", "a/b", "x" * 11, "ümlaut", 12345])
+def test_shorten_rejects_invalid_custom_code(client, mocker, code):
+    get_connection = mocker.patch("app.get_connection")
+
+    response = client.post("/shorten", json={"url": "https://example.com", "code": code}, headers=auth_header())
+
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Invalid code"}
+    get_connection.assert_not_called()
+
+def test_shorten_accepts_valid_custom_code(client, mocker):
+    mock_conn = mocker.patch("app.get_connection")
+    mocker.patch("app.redis_client")
+    mocker.patch("app.register_new_url")
+    mocker.patch("app.remember_code")
+
+    response = client.post("/shorten", json={"url": "https://example.com", "code": "my-Code_1"}, headers=auth_header())
+
+    assert response.status_code == 200
+    params = mock_conn.return_value.cursor.return_value.execute.call_args[0][1]
+    assert params[1] == "my-Code_1"
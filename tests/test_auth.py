@@ -95,3 +95,44 @@ def test_jwt_required_invalid_token(app):
     response = client.get("/protected", headers=headers)
     assert response.status_code == 401
     assert "Invalid or expired token" in response.get_json()["error"]
+
+# -----------------------------
+# Verified-claims cache Tests
+# -----------------------------
+@pytest.fixture
+def claims_cache():
+    import auth
+    auth._claims_cache.clear()
+    yield auth._claims_cache
+    auth._claims_cache.clear()
+
+def test_decode_verifies_each_token_once(mocker, claims_cache, user_id):
+    import auth
+    token = create_access_token(user_id)
+    verify = mocker.spy(auth, "_verify_jwt")
+
+    first = decode_jwt(token)
+    second = decode_jwt(token)
+
+    assert first == second and second["sub"] == user_id
+    verify.assert_called_once()
+
+def test_decode_negatively_caches_invalid_tokens(mocker, claims_cache):
+    import auth
+    verify = mocker.spy(auth, "_verify_jwt")
+
+    assert decode_jwt("invalidtoken") is None
+    assert decode_jwt("invalidtoken") is None
+    verify.assert_called_once()
+
+def test_decode_cache_is_keyed_by_public_key(mocker, claims_cache, user_id):
+    import auth
+    token = create_access_token(user_id)
+    decode_jwt(token)
+    # Rotating the verification key must not serve claims verified under the old one
+    mocker.patch.object(auth, "PUBLIC_KEY", auth.PUBLIC_KEY + "\n")
+    verify = mocker.spy(auth, "_verify_jwt")
+
+    decode_jwt(token)
+
+    verify.assert_called_once()
@@ -0,0 +1,13 @@
+# tests/test_bench_click_pipeline.py
+from benchmarks.bench_click_pipeline import run, legacy_click
+from tasks import process_click
+
+# ----------------------------
+# Smoke test (no MySQL or Redis)
+# ----------------------------
+def test_benchmark_runs_without_services():
+    current = run(3, 0, lambda _: process_click("url-1", "203.0.113.7", "Mozilla/5.0", None, "f" * 64))
+    legacy = run(3, 0, legacy_click)
+
+    assert current["checkouts"] == current["commits"] == 3
+    assert legacy["checkouts"] == 12
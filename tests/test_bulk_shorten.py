@@ -0,0 +1,77 @@
+# tests/test_bulk_shorten.py
+import pytest
+import mysql.connector
+from bulk_shorten import shorten_batch
+
+@pytest.fixture
+def db(mocker):
+    mock_conn = mocker.patch("bulk_shorten.get_connection")
+    cursor = mock_conn.return_value.cursor.return_value
+    register = mocker.patch("bulk_shorten.register_new_urls")
+    mocker.patch("bulk_shorten.redis_client")
+    codes = iter(f"gen{n:05d}" for n in range(1000))
+    mocker.patch("bulk_shorten.allocate_codes", side_effect=lambda count: [next(codes) for _ in range(count)])
+    return mock_conn.return_value, cursor, register
+
+def taken(cursor, codes=()):
+    # Any INSERT carrying one of `codes` fails like a duplicate key
+    def execute(sql, params):
+        if any(code in params for code in codes):
+            raise mysql.connector.IntegrityError("Duplicate entry")
+    cursor.execute.side_effect = execute
+
+def inserts(cursor):
+    return [c[0][0] for c in cursor.execute.call_args_list if c[0][0].startswith("INSERT INTO urls")]
+
+# ----------------------------
+# Test shorten_batch
+# ----------------------------
+def test_batch_is_one_insert_and_one_cache_fill(db):
+    conn, cursor, register = db
+    taken(cursor)
+
+    results = shorten_batch([{"url": "https://a.com"}, {"url": "https://b.com", "code": "mine"}], "user1")
+
+    assert results[1] == {"url": "https://b.com", "code": "mine"}
+    assert results[0]["code"] == "gen00000"
+    assert len(inserts(cursor)) == 1 and inserts(cursor)[0].count("(%s, %s, %s, %s, %s)") == 2
+    conn.commit.assert_called_once()
+    assert [row[0] for row in register.call_args[0][0]] == [results[0]["code"], "mine"]
+
+def test_invalid_and_duplicate_items_are_reported(db):
+    _, cursor, register = db
+    taken(cursor)
+
+    results = shorten_batch([
+        {"url": "not a url"},
+        {"url": "https://a.com", "code": "dup"},
+        {"url": "https://b.com", "code": "DUP"},
+        "https://c.com",
+        {"url": "https://d.com", "code": "much-too-long"},
+        {"url": "https://e.com", "code": "a/b"},
+        {"url": "https://f.com", "code": 7},
+    ], "user1")
+
+    assert [r.get("error") for r in results] == [
+        "invalid_url", None, "duplicate_code", "invalid_url", "invalid_code", "invalid_code", "invalid_code",
+    ]
+    assert len(register.call_args[0][0]) == 1
+
+def test_taken_custom_code_falls_back_to_row_inserts(db):
+    _, cursor, register = db
+    taken(cursor, codes={"taken"})
+
+    results = shorten_batch([{"url": "https://a.com", "code": "taken"}, {"url": "https://b.com"}], "user1")
+
+    assert results == [{"url": "https://a.com", "error": "code_taken"}, {"url": "https://b.com", "code": "gen00000"}]
+    # The failed chunk, then one INSERT per row of it
+    assert [sql.count("(%s") for sql in inserts(cursor)] == [2, 1, 1]
+    assert [row[0] for row in register.call_args[0][0]] == ["gen00000"]
+
+def test_allocated_code_requested_in_the_same_batch_is_skipped(db):
+    _, cursor, _ = db
+    taken(cursor)
+
+    results = shorten_batch([{"url": "https://a.com"}, {"url": "https://b.com", "code": "GEN00000"}], "user1")
+
+    assert [r["code"] for r in results] == ["gen00001", "GEN00000"]
@@ -0,0 +1,85 @@
+# tests/test_click_counters.py
+import mysql.connector
+from unittest.mock import MagicMock
+from click_counters import build_click_increment, get_click_total, get_click_totals, seed_click_total, flush_pending
+
+# ----------------------------
+# Test build_click_increment
+# ----------------------------
+def test_build_click_increment_folds_counts():
+    sql, params = build_click_increment({"url1": 3, "url2": 1})
+    assert sql.count("WHEN %s THEN %s") == 2
+    assert "WHERE id IN (%s,%s)" in sql
+    assert params == ("url1", 3, "url2", 1, "url1", "url2")
+
+# ----------------------------
+# Test live totals
+# ----------------------------
+def test_total_is_base_plus_pending_plus_flushing(mocker):
+    mock_redis = mocker.patch("click_counters.redis_client")
+    mock_redis.pipeline.return_value.execute.return_value = ["10", "2", "3"]
+    assert get_click_total("url1") == 15
+
+def test_total_unknown_until_seeded(mocker):
+    mock_redis = mocker.patch("click_counters.redis_client")
+    mock_redis.pipeline.return_value.execute.return_value = [None, "2", None]
+    assert get_click_total("url1") is None
+
+def test_seed_uses_hsetnx(mocker):
+    mock_redis = mocker.patch("click_counters.redis_client")
+    pipe = mock_redis.pipeline.return_value
+    pipe.execute.return_value = [1, "7", None, None]
+
+    assert seed_click_total("url1", 7) == 7
+    pipe.hsetnx.assert_called_once_with("clicks:base", "url1", 7)
+
+def test_totals_for_many_urls_in_one_round_trip(mocker):
+    mock_redis = mocker.patch("click_counters.redis_client")
+    pipe = mock_redis.pipeline.return_value
+    pipe.execute.return_value = [1, ["10", None, "4"], ["2", "5", None], [None, None, "1"]]
+
+    totals = get_click_totals(["url1", "url2", "url3"], seeds={"url3": 4})
+
+    assert totals == {"url1": 12, "url2": None, "url3": 5}
+    pipe.hsetnx.assert_called_once_with("clicks:base", "url3", 4)
+    pipe.execute.assert_called_once()
+
+# ----------------------------
+# Test flush_pending
+# ----------------------------
+def mock_flush(mocker, flush_id, snapshot):
+    mocker.patch("click_counters._SNAPSHOT_SCRIPT", return_value=flush_id)
+    finish = mocker.patch("click_counters._FINISH_SCRIPT")
+    mock_redis = mocker.patch("click_counters.redis_client")
+    mock_redis.hgetall.return_value = snapshot
+    mock_conn = mocker.patch("click_counters.get_connection")
+    mock_cursor = MagicMock()
+    mock_conn.return_value.cursor.return_value = mock_cursor
+    mock_cursor.fetchall.return_value = [("url1", 12)]
+    return finish, mock_cursor
+
+def test_flush_nothing_pending(mocker):
+    mocker.patch("click_counters._SNAPSHOT_SCRIPT", return_value=None)
+    conn = mocker.patch("click_counters.get_connection")
+    assert flush_pending() == 0
+    conn.assert_not_called()
+
+def test_flush_applies_snapshot_once(mocker):
+    finish, cursor = mock_flush(mocker, "flush-1", {"url1": "2"})
+
+    assert flush_pending() == 2
+    statements = [c[0][0] for c in cursor.execute.call_args_list]
+    assert any(s.startswith("UPDATE urls SET clicks") for s in statements)
+    finish.assert_called_once()
+    assert finish.call_args.kwargs["args"] == ["url1", "12"]
+
+def test_flush_resumes_already_committed_snapshot(mocker):
+    finish, cursor = mock_flush(mocker, "flush-1", {"url1": "2"})
+    cursor.execute.side_effect = lambda sql, *a: (_ for _ in ()).throw(
+        mysql.connector.errors.IntegrityError("duplicate")
+    ) if sql.startswith("INSERT INTO click_counter_flushes") else None
+
+    assert flush_pending() == 0
+    statements = [c[0][0] for c in cursor.execute.call_args_list]
+    assert not any(s.startswith("UPDATE urls SET clicks") for s in statements)
+    finish.assert_called_once()
@@ -0,0 +1,46 @@
+# tests/test_click_export.py
+import gzip
+import json
+from datetime import datetime
+from click_export import iter_clicks, to_ndjson, to_csv, gzipped, export_clicks
+
+def click(n):
+    return (f"id{n}", datetime(2025, 1, 1, 12, n), "1.2.3.4", "ua", None, "fp")
+
+# ----------------------------
+# Test keyset chunks
+# ----------------------------
+def test_iter_clicks_resumes_after_last_row_of_each_chunk(mocker):
+    mock_conn = mocker.patch("click_export.get_connection")
+    cursor = mock_conn.return_value.cursor.return_value
+    cursor.__iter__.side_effect = [iter([click(1), click(2)]), iter([click(3)])]
+
+    rows = list(iter_clicks("url123", datetime(2025, 1, 1), datetime(2025, 2, 1), chunk_size=2))
+
+    assert [r[0] for r in rows] == ["id1", "id2", "id3"]
+    mock_conn.return_value.cursor.assert_called_with(buffered=False)
+    # One pooled connection per chunk, returned before the rows are handed out
+    assert mock_conn.return_value.close.call_count == 2
+    sql, params = cursor.execute.call_args_list[1][0]
+    assert "ORDER BY clicked_at, id" in sql
+    assert params == ("url123", datetime(2025, 2, 1), click(2)[1], click(2)[1], "id2", 2)
+
+# ----------------------------
+# Test formats
+# ----------------------------
+def test_ndjson_rows_are_objects():
+    line = "".join(to_ndjson([click(1)])).splitlines()[0]
+    assert json.loads(line) == {"id": "id1", "clicked_at": "2025-01-01T12:01:00", "ip": "1.2.3.4",
+                                "user_agent": "ua", "referrer": None, "fingerprint": "fp"}
+
+def test_csv_has_header_and_rows():
+    lines = "".join(to_csv([click(1), click(2)])).splitlines()
+    assert lines[0] == "id,clicked_at,ip,user_agent,referrer,fingerprint"
+    assert lines[2] == "id2,2025-01-01T12:02:00,1.2.3.4,ua,,fp"
+
+def test_gzipped_stream_decompresses_to_the_same_text(mocker):
+    mocker.patch("click_export.iter_clicks", return_value=iter([click(1), click(2)]))
+    plain = "".join(to_csv([click(1), click(2)]))
+    body = b"".join(export_clicks("url123", datetime(2025, 1, 1), datetime(2025, 2, 1), "csv", compress=True))
+    assert gzip.decompress(body).decode() == plain
+    assert gzip.decompress(b"".join(gzipped(["a", "", "b"]))) == b"ab"
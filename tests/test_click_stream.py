@@ -0,0 +1,158 @@
+# tests/test_click_stream.py
+from datetime import datetime
+import pytest
+from click_stream import (
+    publish_click, handle_events, check_events, click_id, reclaim_stale, STREAM_KEY, GROUP, DEAD_LETTER_KEY,
+)
+from click_writer import ClickBatchWriter
+from consts import CLICK_STREAM_MAX_DELIVERIES
+
+EVENT = {"u": "url123", "c": "abc", "ip": "1.2.3.4", "ua": "", "r": "", "fp": "fp123", "t": "1.0"}
+
+
+class FakeClickDB:
+    """url_clicks ids and url_analytics_hourly increments; uncommitted statements are dropped."""
+
+    def __init__(self):
+        self.clicks = []
+        self.hourly = 0
+        self.fail_next_commit = False
+
+    def connect(self):
+        db = self
+        pending = {"clicks": [], "hourly": 0}
+
+        class Cursor:
+            def execute(self, sql, params=()):
+                self.result = []
+                if sql.startswith("SELECT id FROM url_clicks"):
+                    self.result = [(i,) for i in params if i in db.clicks]
+                elif "url_analytics_hourly" in sql:
+                    pending["hourly"] += 1
+
+            def executemany(self, sql, rows):
+                pending["clicks"] += [row[0] for row in rows]
+
+            def fetchall(self):
+                return self.result
+
+            def fetchone(self):
+                return None
+
+            def close(self):
+                pass
+
+        class Connection:
+            def cursor(self):
+                return Cursor()
+
+            def commit(self):
+                if db.fail_next_commit:
+                    db.fail_next_commit = False
+                    raise Exception("lost connection")
+                db.clicks += pending["clicks"]
+                db.hourly += pending["hourly"]
+
+            def close(self):
+                pass
+
+        return Connection()
+
+# ----------------------------
+# Test publish_click
+# ----------------------------
+def test_publish_click_is_one_xadd(mocker):
+    mock_redis = mocker.patch("click_stream.redis_client")
+
+    publish_click("url123", "abc", "1.2.3.4", None, None, "fp123")
+
+    mock_redis.xadd.assert_called_once()
+    key, fields = mock_redis.xadd.call_args[0]
+    assert key == STREAM_KEY
+    assert fields["u"] == "url123"
+    assert fields["ua"] == ""  # None is not a valid stream value
+
+# ----------------------------
+# Test handle_events
+# ----------------------------
+def test_handle_events_returns_only_processed_ids(mocker):
+    process = mocker.patch("click_stream.process_click", side_effect=[None, Exception("db down")])
+    fraud = mocker.patch("click_stream.detect_fraud")
+
+    done = handle_events([("1-0", EVENT), ("2-0", EVENT)])
+
+    assert done == ["1-0"]
+    assert process.call_count == 2
+    # Fraud checks wait for the ack (check_events)
+    fraud.assert_not_called()
+
+def test_handle_events_passes_writer_event_time_and_click_id(mocker):
+    process = mocker.patch("click_stream.process_click")
+    writer = object()
+
+    handle_events([("1-0", EVENT)], writer)  # type: ignore
+    handle_events([("1-0", EVENT)], writer)  # type: ignore
+
+    args = process.call_args[0]
+    assert args[5] == datetime(1970, 1, 1, 0, 0, 1)
+    assert args[6] is writer
+    # Every delivery of an entry maps to the same url_clicks row
+    assert args[7] == click_id("1-0") == process.call_args_list[0][0][7]
+    assert click_id("1-0") != click_id("2-0")
+
+def test_reclaimed_event_after_failed_flush_is_counted_once(mocker):
+    db = FakeClickDB()
+    mocker.patch("click_writer.get_connection", side_effect=db.connect)
+    mocker.patch("click_writer.redis_client")
+    mock_counters = mocker.patch("click_writer.record_clicks")
+    mocker.patch("click_writer.record_trending")
+    mock_hll = mocker.patch("tasks.track_unique_visitor")
+    mocker.patch("tasks.get_country_from_ip", return_value="us")
+    writer = ClickBatchWriter(max_rows=1)
+
+    handle_events([("1-0", EVENT)], writer)
+    db.fail_next_commit = True
+    with pytest.raises(Exception):
+        writer.flush()
+    # The entry is still pending and gets reclaimed while its row waits in the buffer
+    handle_events([("1-0", EVENT)], writer)
+    writer.flush()
+    # Delivered again after a commit whose ack was lost
+    handle_events([("1-0", EVENT)], writer)
+    writer.flush()
+
+    assert db.clicks == [click_id("1-0")]
+    assert db.hourly == 1
+    mock_counters.assert_called_once_with({"url123": 1}, mocker.ANY)
+    mock_hll.assert_called_once()
+
+# ----------------------------
+# Test check_events
+# ----------------------------
+def test_check_events_forwards_request_reasons(mocker):
+    fraud = mocker.patch("click_stream.detect_fraud", side_effect=[Exception("redis down"), False])
+
+    check_events([("1-0", {**EVENT, "rr": "bot_user_agent,missing_referrer"}), ("2-0", {**EVENT, "rr": ""})])
+
+    assert fraud.call_args_list[0][0] == ("1.2.3.4", "abc", None, None, "fp123", "url123",
+                                          ["bot_user_agent", "missing_referrer"], 1.0)
+    # A failed check does not stop the rest of the batch
+    assert fraud.call_args_list[1][0][6] == []
+
+# ----------------------------
+# Test reclaim_stale
+# ----------------------------
+def test_reclaim_stale_dead_letters_poisoned_entries(mocker):
+    mock_redis = mocker.patch("click_stream.redis_client")
+    mock_redis.xpending_range.return_value = [
+        {"message_id": "1-0", "times_delivered": CLICK_STREAM_MAX_DELIVERIES},
+        {"message_id": "2-0", "times_delivered": 1},
+    ]
+    mock_redis.pipeline.return_value.execute.return_value = [[("1-0", EVENT)]]
+    mock_redis.xclaim.return_value = [("2-0", EVENT)]
+
+    claimed = reclaim_stale("consumer-1")
+
+    assert claimed == [("2-0", EVENT)]
+    assert mock_redis.xadd.call_args[0][0] == DEAD_LETTER_KEY
+    mock_redis.xack.assert_called_once_with(STREAM_KEY, GROUP, "1-0")
@@ -0,0 +1,135 @@
+# tests/test_click_writer.py
+import pytest
+from unittest.mock import MagicMock
+from click_writer import ClickBatchWriter, make_click_row, write_clicks, retry_unsent_counters
+
+# ----------------------------
+# Test write_clicks
+# ----------------------------
+def test_write_clicks_one_insert_and_redis_counters(mocker):
+    mock_record = mocker.patch("click_writer.record_clicks")
+    mock_trending = mocker.patch("click_writer.record_trending")
+    mock_redis = mocker.patch("click_writer.redis_client")
+    mock_conn = mocker.patch("click_writer.get_connection")
+    mock_cursor = MagicMock()
+    mock_cursor.fetchall.return_value = []
+    mock_conn.return_value.cursor.return_value = mock_cursor
+    rows = [make_click_row("url1", "1.2.3.4", "ua", None, "fp") for _ in range(3)]
+
+    assert write_clicks(rows) == rows
+
+    mock_cursor.executemany.assert_called_once()
+    assert len(mock_cursor.executemany.call_args[0][1]) == 3
+    mock_cursor.execute.assert_called_once()  # the stored-id lookup
+    mock_conn.return_value.commit.assert_called_once()
+    # Counters and trending buckets share one pipeline
+    pipe = mock_redis.pipeline.return_value
+    mock_record.assert_called_once_with({"url1": 3}, pipe)
+    assert [url_id for url_id, _ in mock_trending.call_args[0][0]] == ["url1"] * 3
+    pipe.execute.assert_called_once()
+
+def test_write_clicks_skips_stored_and_repeated_rows(mocker):
+    mock_record = mocker.patch("click_writer.record_clicks")
+    mocker.patch("click_writer.record_trending")
+    mocker.patch("click_writer.redis_client")
+    mock_conn = mocker.patch("click_writer.get_connection")
+    mock_cursor = MagicMock()
+    mock_cursor.fetchall.return_value = [("old",)]
+    mock_conn.return_value.cursor.return_value = mock_cursor
+    old = make_click_row("url1", None, None, None, None, click_id="old")
+    new = make_click_row("url2", None, None, None, None, click_id="new")
+    hook = MagicMock()
+
+    assert write_clicks([old, new, new], in_transaction=hook) == [new]
+
+    assert mock_cursor.executemany.call_args[0][1] == [new]
+    hook.assert_called_once_with(mock_cursor, [new])
+    mock_record.assert_called_once_with({"url2": 1}, mocker.ANY)
+
+def test_failed_counter_update_is_sent_with_the_next_batch(mocker):
+    import redis
+    mock_record = mocker.patch("click_writer.record_clicks")
+    mock_trending = mocker.patch("click_writer.record_trending")
+    mock_redis = mocker.patch("click_writer.redis_client")
+    pipe = mock_redis.pipeline.return_value
+    pipe.execute.side_effect = [redis.ConnectionError("down"), []]
+    mock_conn = mocker.patch("click_writer.get_connection")
+    mock_conn.return_value.cursor.return_value.fetchall.return_value = []
+
+    write_clicks([make_click_row("url1", None, None, None, None)])
+    write_clicks([make_click_row("url1", None, None, None, None), make_click_row("url2", None, None, None, None)])
+
+    # The rows were committed the first time; only the increments are retried
+    assert mock_conn.return_value.commit.call_count == 2
+    assert mock_record.call_args[0][0] == {"url1": 2, "url2": 1}
+    assert sorted(url_id for url_id, _ in mock_trending.call_args[0][0]) == ["url1", "url1", "url2"]
+    retry_unsent_counters()
+    assert mock_record.call_count == 2  # nothing left over
+
+# ----------------------------
+# Test ClickBatchWriter
+# ----------------------------
+def test_writer_due_on_row_count(mocker):
+    mock_write = mocker.patch("click_writer.write_clicks")
+    writer = ClickBatchWriter(max_rows=2, flush_ms=60_000)
+    writer.add(make_click_row("url1", None, None, None, None))
+    assert not writer.due()
+    writer.add(make_click_row("url1", None, None, None, None))
+    assert writer.due()
+
+    assert writer.flush() == 2
+    mock_write.assert_called_once()
+    assert len(writer) == 0
+
+def test_writer_due_on_age(mocker):
+    clock = mocker.patch("click_writer.time.monotonic", return_value=10.0)
+    writer = ClickBatchWriter(max_rows=100, flush_ms=200)
+    writer.add(make_click_row("url1", None, None, None, None))
+    assert not writer.due()
+    clock.return_value = 10.3
+    assert writer.due()
+
+def test_writer_runs_hooks_only_for_new_rows(mocker):
+    old = make_click_row("url1", None, None, None, None, click_id="old")
+    new = make_click_row("url1", None, None, None, None, click_id="new")
+    cursor = object()
+
+    def fake_write(rows, in_transaction):
+        in_transaction(cursor, [new])
+        return [new]
+
+    mocker.patch("click_writer.write_clicks", side_effect=fake_write)
+    old_tx, old_after, new_tx, new_after = MagicMock(), MagicMock(), MagicMock(), MagicMock()
+    writer = ClickBatchWriter()
+    writer.add(old, in_transaction=old_tx, after_commit=old_after)
+    writer.add(new, in_transaction=new_tx, after_commit=new_after)
+
+    assert writer.flush() == 2
+    new_tx.assert_called_once_with(cursor)
+    new_after.assert_called_once()
+    old_tx.assert_not_called()
+    old_after.assert_not_called()
+
+def test_writer_runs_hooks_in_fingerprint_order(mocker):
+    rows = [make_click_row(url, None, None, None, fp, click_id=f"{fp}-{url}")
+            for fp, url in [("fp2", "u1"), ("fp1", "u1"), ("fp2", "u2"), (None, "u3"), ("fp1", "u2")]]
+    mocker.patch("click_writer.write_clicks",
+                 side_effect=lambda batch, in_transaction: in_transaction(object(), batch) or batch)
+    order = []
+    writer = ClickBatchWriter()
+    for row in rows:
+        writer.add(row, in_transaction=lambda cursor, row=row: order.append(row[0]))
+
+    writer.flush()
+
+    # Deterministic lock order across flushes; each visitor's clicks keep their event order
+    assert order == ["None-u3", "fp1-u1", "fp1-u2", "fp2-u1", "fp2-u2"]
+
+def test_writer_keeps_rows_when_flush_fails(mocker):
+    mocker.patch("click_writer.write_clicks", side_effect=Exception("db down"))
+    writer = ClickBatchWriter(max_rows=1)
+    writer.add(make_click_row("url1", None, None, None, None))
+
+    with pytest.raises(Exception):
+        writer.flush()
+    assert len(writer) == 1
@@ -0,0 +1,47 @@
+# tests/test_code_allocator.py
+from code_allocator import encode, lease_block, CodeAllocator
+
+# ----------------------------
+# Test encode
+# ----------------------------
+def test_encode_is_fixed_length_base36_and_collision_free():
+    codes = {encode(n) for n in range(50000)}
+    assert len(codes) == 50000
+    # One case only, so no two codes collide under urls.code's case-insensitive collation
+    assert all(len(code) == 8 and code.isalnum() and code == code.lower() for code in codes)
+
+# ----------------------------
+# Test lease_block
+# ----------------------------
+def test_lease_block_skips_codes_taken_in_any_case(mocker):
+    mock_redis = mocker.patch("code_allocator.redis_client")
+    mock_redis.incr.return_value = 3
+    block = [encode(n) for n in range(30, 40)]
+    mock_conn = mocker.patch("code_allocator.get_connection")
+    cursor = mock_conn.return_value.cursor.return_value
+    # urls.code is case-insensitive: MySQL returns the stored spelling of a matching code
+    cursor.fetchall.return_value = [(block[0].upper(),)]
+
+    codes = lease_block(size=10)
+
+    assert codes == block[1:]
+    assert cursor.execute.call_args[0][1] == tuple(block)
+
+# ----------------------------
+# Test CodeAllocator
+# ----------------------------
+def test_allocator_leases_again_only_when_empty(mocker):
+    lease = mocker.patch("code_allocator.lease_block", side_effect=[["a", "b", "c"], ["d", "e", "f"]])
+    allocator = CodeAllocator(block_size=3)
+
+    assert allocator.allocate(2) == ["a", "b"]
+    assert allocator.allocate(2) == ["c", "d"]
+    assert lease.call_count == 2
+
+def test_allocator_drops_codes_leased_before_fork(mocker):
+    mocker.patch("code_allocator.lease_block", side_effect=[["a", "b"], ["c", "d"]])
+    allocator = CodeAllocator(block_size=2)
+    allocator.allocate()
+    mocker.patch("code_allocator.os.getpid", return_value=-1)
+
+    assert allocator.allocate() == ["c"]
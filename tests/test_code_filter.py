@@ -0,0 +1,54 @@
+# tests/test_code_filter.py
+from code_filter import _positions, code_may_exist, remember_missing, add_codes
+from consts import CODE_FILTER_BITS, CODE_FILTER_HASHES
+
+def mock_pipeline(mocker, results):
+    mock_redis = mocker.patch("code_filter.redis_client")
+    pipe = mock_redis.pipeline.return_value
+    pipe.execute.return_value = results
+    return mock_redis, pipe
+
+# ----------------------------
+# Test hashing
+# ----------------------------
+def test_positions_are_stable_and_in_range():
+    positions = _positions("abc123")
+    assert positions == _positions("abc123")
+    assert len(positions) == CODE_FILTER_HASHES
+    assert all(0 <= p < CODE_FILTER_BITS for p in positions)
+
+# ----------------------------
+# Test code_may_exist
+# ----------------------------
+def test_rejects_when_any_bit_is_clear(mocker):
+    bits = [1] * (CODE_FILTER_HASHES - 1) + [0]
+    mock_pipeline(mocker, [0, 1, *bits])
+    assert code_may_exist("abc") is False
+
+def test_passes_when_all_bits_set(mocker):
+    mock_pipeline(mocker, [0, 1, *([1] * CODE_FILTER_HASHES)])
+    assert code_may_exist("abc") is True
+
+def test_negative_cache_rejects(mocker):
+    mock_pipeline(mocker, [1, 1, *([1] * CODE_FILTER_HASHES)])
+    assert code_may_exist("abc") is False
+
+def test_fails_open_until_filter_built(mocker):
+    mock_pipeline(mocker, [0, 0, *([0] * CODE_FILTER_HASHES)])
+    assert code_may_exist("abc") is True
+
+# ----------------------------
+# Test writes
+# ----------------------------
+def test_remember_missing_sets_short_ttl_key(mocker):
+    mock_redis = mocker.patch("code_filter.redis_client")
+    remember_missing("abc")
+    mock_redis.set.assert_called_once()
+    assert mock_redis.set.call_args[0][0] == "neg:abc"
+
+def test_add_codes_sets_bits_and_clears_negative_cache(mocker):
+    _, pipe = mock_pipeline(mocker, [])
+    add_codes(["abc"])
+    assert pipe.setbit.call_count == CODE_FILTER_HASHES
+    pipe.delete.assert_called_once_with("neg:abc")
+    pipe.execute.assert_called_once()
@@ -0,0 +1,81 @@
+# tests/test_fraud.py
+import time
+import pytest
+import fraud
+from fraud import check_request_rules, check_stateful_rules, evaluate_click, collect_fraud_gauges
+
+# ----------------------------
+# Test stateless rules
+# ----------------------------
+def test_request_rules_clean_click():
+    assert check_request_rules("Mozilla/5.0", "https://ref.com") == []
+
+def test_request_rules_flag_bots_and_referrers():
+    assert check_request_rules("Googlebot/2.1", None) == [
+        "unusual_user_agent", "bot_user_agent", "missing_referrer",
+    ]
+    assert check_request_rules("curl/8.0", "x" * 201) == ["unusual_user_agent", "long_referrer"]
+
+# ----------------------------
+# Test stateful rules (single script call)
+# ----------------------------
+def test_stateful_rules_single_script_call(mocker):
+    script = mocker.patch("fraud._FRAUD_SCRIPT", return_value=[0, 1, 1, 0, 0, 0])
+
+    reasons = check_stateful_rules("1.2.3.4", "abc", "fp123", clicked_at=600.0)
+
+    script.assert_called_once()
+    assert reasons == ["ip_clicks", "ip_url_clicks"]
+    keys = script.call_args.kwargs["keys"]
+    # Per-IP counters are bucketed by the click's minute, and the script runs on the click's time
+    assert "fraud:ip_url:1.2.3.4:abc:10" in keys
+    assert script.call_args.kwargs["args"][0] == "600.000000"
+    # Sliding-window velocity: one timestamp set per fingerprint
+    assert "velocity:fp123" in keys
+    assert not any(key.startswith(("last_click:", "click_count:")) for key in keys)
+
+def test_evaluate_click_combines_rules(mocker):
+    mocker.patch("fraud._FRAUD_SCRIPT", return_value=[0, 0, 0, 1, 0, 0])
+    mocker.patch("fraud.redis_client")
+
+    assert evaluate_click("1.2.3.4", "abc", "Mozilla/5.0", None, "fp123") == ["missing_referrer", "velocity"]
+
+def test_late_replay_of_spaced_out_clicks_is_not_flagged(mocker):
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    client = fakeredis.FakeRedis(decode_responses=True)
+    mocker.patch("fraud._FRAUD_SCRIPT", client.register_script(fraud._FRAUD_SCRIPT.script))
+    # Six clicks 90s apart, all checked at once long after they happened
+    started = time.time() - 3600
+    replayed = [check_stateful_rules("1.2.3.4", "abc", "fp123", clicked_at=started + i * 90) for i in range(6)]
+
+    assert replayed == [[]] * 6
+    # The same clicks really arriving together are a burst
+    burst = [check_stateful_rules("5.6.7.8", "abc", "fp456", clicked_at=started) for _ in range(6)]
+    assert {"velocity", "click_window", "ip_url_clicks", "repeated_sequence"} <= set(burst[-1])
+
+# ----------------------------
+# Test gauge collector
+# ----------------------------
+def test_collect_fraud_gauges_trims_and_counts(mocker):
+    redis_mock = mocker.patch("fraud.redis_client")
+    redis_mock.pipeline.return_value.execute.return_value = [2, 7, 0, 3]
+    ips = mocker.patch("fraud.SUSPICIOUS_IPS")
+    ip_urls = mocker.patch("fraud.SUSPICIOUS_IP_URLS")
+
+    collect_fraud_gauges(force=True)
+
+    redis_mock.keys.assert_not_called()
+    ips.set.assert_called_once_with(7)
+    ip_urls.set.assert_called_once_with(3)
+
+def test_collect_fraud_gauges_is_throttled(mocker):
+    redis_mock = mocker.patch("fraud.redis_client")
+    redis_mock.pipeline.return_value.execute.return_value = [0, 1, 0, 1]
+    mocker.patch("fraud.SUSPICIOUS_IPS")
+    mocker.patch("fraud.SUSPICIOUS_IP_URLS")
+
+    collect_fraud_gauges(force=True)
+    collect_fraud_gauges()
+
+    assert redis_mock.pipeline.call_count == 1
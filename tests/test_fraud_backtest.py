@@ -0,0 +1,81 @@
+# tests/test_fraud_backtest.py
+import numpy as np
+import pandas as pd
+from fraud_backtest import Backtest, _run_positions, _window_stats, run
+
+def clicks(rows):
+    """rows: (seconds, ip, fingerprint, url_id)"""
+    return pd.DataFrame({
+        "clicked_at": [pd.Timestamp("2025-01-01") + pd.Timedelta(seconds=s) for s, *_ in rows],
+        "id": [str(i) for i in range(len(rows))],
+        "ip": [r[1] for r in rows],
+        "fingerprint": [r[2] for r in rows],
+        "url_id": [r[3] for r in rows],
+        "user_agent": ["Mozilla/5.0"] * len(rows),
+        "referrer": ["https://ref.com"] * len(rows),
+    })
+
+def configured(report, rule):
+    return next(r["flagged"] for r in report["rules"][rule].values() if r["configured"])
+
+# ----------------------------
+# Test vectorized helpers
+# ----------------------------
+def test_run_positions_reset_after_counter_ttl():
+    keys = np.array(["a", "b", "a", "a"], dtype=object)
+    t = np.array([0.0, 1.0, 30.0, 100.0])
+
+    positions, _ = _run_positions(keys, t, Backtest._empty_state())
+
+    assert positions.tolist() == [1, 1, 2, 1]
+
+def test_window_stats_counts_sliding_window_per_key():
+    keys = np.array(["a", "a", "b", "a", "a"], dtype=object)
+    t = np.array([0.0, 0.5, 1.0, 9.0, 10.5])
+
+    gaps, counts = _window_stats(keys, t, [10])
+
+    assert gaps[1] == 0.5 and np.isinf(gaps[2])
+    # At 10.5 the window is (0.5, 10.5]: clicks at 0 and 0.5 have left it
+    assert counts[10].tolist() == [1, 2, 1, 3, 2]
+
+# ----------------------------
+# Test replay
+# ----------------------------
+def test_replay_flags_ip_url_and_repeated_sequence():
+    report = run(iter([clicks([(i * 2, "1.1.1.1", "fp", "u1") for i in range(8)])]))
+
+    assert report["clicks"] == 8
+    assert configured(report, "ip_url_clicks") == 3  # clicks 6..8 exceed 5 per IP+URL
+    assert configured(report, "repeated_sequence") == 3  # 5 identical before clicks 6..8
+    assert configured(report, "velocity") == 0
+
+def test_results_do_not_depend_on_chunking():
+    rng = np.random.default_rng(0)
+    rows = [(float(s), f"ip{rng.integers(3)}", f"fp{rng.integers(4)}", f"u{rng.integers(2)}")
+            for s in np.sort(rng.uniform(0, 600, 2000))]
+    df = clicks(rows)
+
+    whole = run(iter([df]))
+    chunked = run(iter([df[i:i + 150] for i in range(0, len(df), 150)]))
+
+    assert whole == chunked
+
+def test_null_fingerprints_are_skipped_by_fingerprint_rules():
+    rows = [(i * 0.1, f"ip{i}", None, f"u{i % 2}") for i in range(20)]
+    rows += [(5 + i * 2, "9.9.9.9", "fp", "u1") for i in range(7)]
+
+    report = run(iter([clicks(rows)]))
+
+    assert report["clicks"] == 27
+    assert report["clicks_without_fingerprint"] == 20
+    # Pooled under one empty key these 20 fast clicks would trip every fingerprint rule
+    assert configured(report, "velocity") == 0
+    assert configured(report, "click_window") == 0
+    assert configured(report, "repeated_sequence") == 2
+    rule = next(r for r in report["rules"]["repeated_sequence"].values() if r["configured"])
+    assert rule["rate"] == 2 / 7
+
+def test_grid_includes_configured_and_custom_values():
+    backtest = Backtest(grid={"ip_clicks": [3, 7]})
+    assert backtest.grid["ip_clicks"] == [3, 7, backtest.thresholds.ip_clicks]
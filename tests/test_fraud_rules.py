@@ -0,0 +1,50 @@
+# tests/test_fraud_rules.py
+import pytest
+from fraud_rules import RuleSet, load_rules, DEFAULT_RULES
+
+def make_rules(**overrides):
+    config = {section: dict(values) for section, values in DEFAULT_RULES.items()}
+    config.update(overrides)
+    return RuleSet(config)
+
+# ----------------------------
+# Test user-agent matching
+# ----------------------------
+def test_one_pattern_can_feed_several_reasons():
+    rules = make_rules()
+    assert rules.check_request("Mozilla/5.0 (compatible; Googlebot/2.1)", "https://ref.com") == [
+        "unusual_user_agent", "bot_user_agent",
+    ]
+
+def test_patterns_are_case_insensitive_and_escaped():
+    rules = make_rules(user_agent_rules={"scripted": ["python-requests", "a.b"]})
+    assert rules.check_request("Python-Requests/2.31", "https://ref.com") == ["scripted"]
+    assert rules.check_request("axb", "https://ref.com") == []
+
+def test_longer_pattern_keeps_contained_pattern_reasons():
+    rules = make_rules(user_agent_rules={"crawler": ["googlebot"], "bot": ["bot"]})
+    assert rules.check_request("googlebot", "https://ref.com") == ["crawler", "bot"]
+
+# ----------------------------
+# Test referrer rules and loading
+# ----------------------------
+def test_referrer_rules_can_be_disabled():
+    rules = make_rules(referrer_rules={"missing_referrer": False, "long_referrer": None})
+    assert rules.check_request("Mozilla/5.0", None) == []
+    assert rules.check_request("Mozilla/5.0", "x" * 500) == []
+
+def test_load_rules_merges_file_over_defaults(tmp_path):
+    path = tmp_path / "rules.yaml"
+    path.write_text("thresholds:\n  ip_clicks: 50\n")
+
+    rules = load_rules(str(path))
+
+    assert rules.thresholds.ip_clicks == 50
+    assert rules.thresholds.ip_url_clicks == DEFAULT_RULES["thresholds"]["ip_url_clicks"]
+    assert rules.check_request("curl/8.0", "https://ref.com") == ["unusual_user_agent"]
+
+def test_load_rules_rejects_unknown_sections(tmp_path):
+    path = tmp_path / "rules.yaml"
+    path.write_text("thresholdz: {}\n")
+    with pytest.raises(ValueError):
+        load_rules(str(path))
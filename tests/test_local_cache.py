@@ -0,0 +1,51 @@
+# tests/test_local_cache.py
+from local_cache import LocalCache
+
+# ----------------------------
+# Test LRU behaviour
+# ----------------------------
+def test_get_and_set():
+    cache = LocalCache("test", maxsize=2)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    assert cache.get("missing") is None
+    assert cache.get("missing", "default") == "default"
+
+def test_evicts_least_recently_used():
+    cache = LocalCache("test", maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")  # "b" is now least recently used
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+def test_zero_size_disables_cache():
+    cache = LocalCache("test", maxsize=0)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+
+# ----------------------------
+# Test TTL behaviour
+# ----------------------------
+def test_entries_expire(mocker):
+    clock = mocker.patch("local_cache.time.monotonic", return_value=100.0)
+    cache = LocalCache("test", maxsize=10, ttl=5)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=60)
+
+    clock.return_value = 106.0
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+
+def test_delete_and_clear():
+    cache = LocalCache("test", maxsize=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.delete("a")
+    assert cache.get("a") is None
+    cache.clear()
+    assert len(cache) == 0
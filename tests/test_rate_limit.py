@@ -0,0 +1,67 @@
+# tests/test_rate_limit.py
+import pytest
+import redis
+import rate_limit
+
+@pytest.fixture(autouse=True)
+def clear_denials():
+    rate_limit._denials.clear()
+    yield
+    rate_limit._denials.clear()
+
+# ----------------------------
+# Test decisions
+# ----------------------------
+def test_sliding_window_route_uses_tier_limit(mocker):
+    script = mocker.patch("rate_limit._SLIDING_WINDOW_SCRIPT", return_value=[1, 99, "0"])
+
+    decision = rate_limit.check("shorten", "user123", "admin")
+
+    assert decision.allowed and decision.remaining == 99
+    assert script.call_args.kwargs["keys"] == ["rl:shorten:admin:user123"]
+    assert script.call_args.kwargs["args"][:2] == [100, 60]
+
+def test_token_bucket_route_passes_refill_rate_and_cost(mocker):
+    script = mocker.patch("rate_limit._TOKEN_BUCKET_SCRIPT", return_value=[1, 55, "0"])
+
+    rate_limit.check("stats", "1.2.3.4", "ip", cost=5)
+
+    capacity, refill, _, cost = script.call_args.kwargs["args"]
+    assert (capacity, refill, cost) == (60, 1.0, 5)
+
+def test_cost_above_limit_is_rejected_without_redis(mocker):
+    script = mocker.patch("rate_limit._SLIDING_WINDOW_SCRIPT", return_value=[1, 0, "0"])
+
+    decision = rate_limit.check("shorten", "user123", cost=11)
+
+    # No finite wait makes 11 units fit a budget of 10
+    assert not decision.allowed and decision.retry_after == float("inf")
+    script.assert_not_called()
+    # Not remembered as a denial: a request that fits still goes to Redis
+    assert rate_limit.check("shorten", "user123", cost=10).allowed
+    script.assert_called_once()
+
+# ----------------------------
+# Test local pre-check
+# ----------------------------
+def test_denial_is_remembered_locally(mocker):
+    script = mocker.patch("rate_limit._SLIDING_WINDOW_SCRIPT", return_value=[0, 0, "12.5"])
+
+    first = rate_limit.check("shorten", "user123")
+    second = rate_limit.check("shorten", "user123")
+
+    assert not first.allowed and first.retry_after == 12.5
+    assert not second.allowed and 0 < second.retry_after <= 12.5
+    script.assert_called_once()
+
+def test_smaller_cost_still_asks_redis(mocker):
+    script = mocker.patch("rate_limit._SLIDING_WINDOW_SCRIPT", side_effect=[[0, 3, "5"], [1, 0, "0"]])
+
+    assert not rate_limit.check("shorten", "user123", cost=5).allowed
+    assert rate_limit.check("shorten", "user123", cost=1).allowed
+    assert script.call_count == 2
+
+def test_fails_open_when_redis_is_down(mocker):
+    mocker.patch("rate_limit._SLIDING_WINDOW_SCRIPT", side_effect=redis.ConnectionError("down"))
+
+    assert rate_limit.check("shorten", "user123").allowed
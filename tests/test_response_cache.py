@@ -0,0 +1,34 @@
+# tests/test_response_cache.py
+from flask import Flask, Response
+from response_cache import make_etag, query_params, not_modified, tag, get_cached_response
+
+app = Flask(__name__)
+
+
+def test_not_modified_when_client_has_current_etag():
+    etag = make_etag("url123", "granularity=day", 7)
+    with app.test_request_context(headers={"If-None-Match": f'"{etag}"'}):
+        response = not_modified(etag)
+        assert response is not None and response.status_code == 304
+        assert response.headers["ETag"] == f'"{etag}"'
+        assert not_modified(make_etag("url123", "granularity=day", 8)) is None
+
+
+def test_query_params_ignore_argument_order():
+    with app.test_request_context("/?to=2025-02-01&from=2025-01-01"):
+        first = query_params()
+    with app.test_request_context("/?from=2025-01-01&to=2025-02-01"):
+        assert query_params() == first
+
+
+def test_tag_requires_revalidation():
+    response = tag(Response("{}"), "abc")
+    assert response.headers["ETag"] == '"abc"'
+    assert "no-cache" in response.headers["Cache-Control"]
+
+
+def test_cached_response_fails_open(mocker):
+    import redis
+    mock_redis = mocker.patch("response_cache.redis_client")
+    mock_redis.get.side_effect = redis.RedisError("down")
+    assert get_cached_response("abc") is None
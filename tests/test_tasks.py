@@ -1,16 +1,15 @@
 # tests/test_tasks.py
 import pytest
 from unittest.mock import MagicMock
-from tasks import log_click, check_fraud, update_trending_urls
+import tasks
+from tasks import log_click, check_fraud, update_trending_urls, process_click, parse_user_agent, get_country_from_ip
 
 # ----------------------------
 # Test log_click
 # ----------------------------
 def test_log_click_runs_without_error(mocker):
-    # Mock DB connection
-    mock_conn = mocker.patch("tasks.get_connection")
-    mock_cursor = MagicMock()
-    mock_conn.return_value.cursor.return_value = mock_cursor
+    # Mock DB write
+    mock_write = mocker.patch("tasks.write_clicks")
 
     # Mock Redis
     mocker.patch("tasks.redis_client")
@@ -24,9 +23,8 @@ def test_log_click_runs_without_error(mocker):
     mocker.patch("tasks.CLICKS_BY_HOUR")
 
     # Mock analytics functions
-    mocker.patch("tasks.increment_hourly_analytics")
-    mocker.patch("tasks.update_user_sequence")
-    mocker.patch("tasks.update_url_referres")
+    mocker.patch("tasks.record_click_analytics")
+    mock_hll = mocker.patch("tasks.track_unique_visitor")
 
     # Mock helpers
     mocker.patch("tasks.get_country_from_ip", return_value="us")
@@ -43,17 +41,35 @@ def test_log_click_runs_without_error(mocker):
     )  # type: ignore
 
     assert result is None
-    assert mock_cursor.execute.called
+    mock_write.assert_called_once()
+    assert mock_write.call_args.kwargs["in_transaction"] is not None
+    mock_hll.assert_called_once()
     mock_metrics.labels().inc.assert_called()
 
+def test_process_click_buffers_rows_in_writer(mocker):
+    mock_write = mocker.patch("tasks.write_clicks")
+    mock_analytics = mocker.patch("tasks.record_click_analytics")
+    mocker.patch("tasks.track_unique_visitor")
+    mocker.patch("tasks.get_country_from_ip", return_value="us")
+    mocker.patch("tasks.parse_user_agent", return_value=("pc", "chrome"))
+    writer = MagicMock()
+
+    process_click("url123", "1.2.3.4", "Mozilla/5.0", "https://ref.com", "fp123", writer=writer)
+
+    writer.add.assert_called_once()
+    mock_write.assert_not_called()
+    # Analytics run in the batch transaction, only once the writer knows the row is new
+    mock_analytics.assert_not_called()
+    writer.add.call_args.kwargs["in_transaction"]("cursor")
+    assert mock_analytics.call_args[0] == ("url123", "fp123", "https://ref.com")
+    assert mock_analytics.call_args.kwargs["cursor"] == "cursor"
+
 # ----------------------------
 # Test check_fraud
 # ----------------------------
 def test_check_fraud_detects_suspicious(mocker):
     # Mock heuristic functions
-    mocker.patch("tasks.is_fraud", return_value=True)
-    mocker.patch("tasks.check_velocity", return_value=False)
-    mocker.patch("tasks.check_behavior", return_value=False)
+    mocker.patch("tasks.evaluate_click", return_value=["ip_clicks", "velocity"])
 
     # Mock DB & analytics
     mock_conn = mocker.patch("tasks.get_connection")
@@ -64,8 +80,6 @@ def test_check_fraud_detects_suspicious(mocker):
     # Mock metrics
     mocker.patch("tasks.SUSPICIOUS_REQUESTS")
     mocker.patch("tasks.SUSPICIOUS_CLICKS")
-    mocker.patch("tasks.SUSPICIOUS_IPS")
-    mocker.patch("tasks.SUSPICIOUS_IP_URLS")
     mocker.patch("uuid.uuid4", return_value="test-uuid")
 
     suspicious = check_fraud(
@@ -78,6 +92,32 @@ def test_check_fraud_detects_suspicious(mocker):
 
     assert suspicious is True
     assert mock_cursor.execute.called
+    # Per-rule reason codes instead of a generic label
+    assert mock_cursor.execute.call_args[0][1][5] == "ip_clicks,velocity"
+
+def test_suspicious_hourly_row_uses_resolved_url_id(mocker):
+    mocker.patch("tasks.evaluate_click", return_value=["ip_clicks"])
+    mocker.patch("tasks.get_connection")
+    mocker.patch("tasks.bump_analytics_version")
+    mock_hourly = mocker.patch("tasks.increment_hourly_analytics")
+
+    # The FK on url_analytics_hourly needs urls.id; the short code only goes to suspicious_clicks
+    check_fraud("1.2.3.4", "abc", "Mozilla/5.0", None, "fp123", "url123")  # type: ignore
+    assert mock_hourly.call_args[0][1] == "url123"
+
+    mock_hourly.reset_mock()
+    check_fraud("1.2.3.4", "abc", "Mozilla/5.0", None, "fp123")  # type: ignore
+    mock_hourly.assert_not_called()
+
+def test_log_click_with_code_also_checks_fraud(mocker):
+    mocker.patch("tasks.process_click")
+    mock_detect = mocker.patch("tasks.detect_fraud", side_effect=Exception("redis down"))
+
+    # Fraud errors are logged, not retried (the click is already written)
+    log_click("url123", "1.2.3.4", "Mozilla/5.0", None, "fp123", "abc", ["missing_referrer"])  # type: ignore
+
+    mock_detect.assert_called_once_with(
+        "1.2.3.4", "abc", "Mozilla/5.0", None, "fp123", "url123", ["missing_referrer"])
 
 # ----------------------------
 # Test update_trending_urls
@@ -87,17 +127,44 @@ def test_update_trending_urls(mocker):
     mock_conn = mocker.patch("tasks.get_connection")
     mock_cursor = MagicMock()
     mock_conn.return_value.cursor.return_value = mock_cursor
-    # Mock fetchall result
-    mock_cursor.fetchall.return_value = [
+
+    # Mock leaderboard
+    mock_rebuild = mocker.patch("tasks.rebuild_leaderboard")
+    mocker.patch("tasks.top_trending", return_value=[
         {"url_id": "url123", "trending_score": 10.0},
         {"url_id": "url456", "trending_score": 5.0},
-    ]
+    ])
 
-    # Mock Redis
-    mock_redis = mocker.patch("tasks.redis_client")
+    mock_duration = mocker.patch("tasks.TRENDING_UPDATE_DURATION")
 
     # Run task
     update_trending_urls(top_n=2)
 
-    assert mock_cursor.execute.called
-    mock_redis.set.assert_called()
+    mock_rebuild.assert_called_once()
+    # One set-based write-back for all rows
+    mock_cursor.execute.assert_called_once()
+    mock_duration.observe.assert_called_once()
+
+# ----------------------------
+# Test enrichment caches
+# ----------------------------
+def test_parse_user_agent_is_memoized(mocker):
+    tasks._ua_cache.clear()
+    parse = mocker.spy(tasks.user_agents, "parse")
+    ua = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120.0 Safari/537.36"
+
+    first = parse_user_agent(ua)
+    second = parse_user_agent(ua)
+
+    assert first == second
+    assert parse.call_count == 1
+
+def test_geoip_lookup_is_memoized_by_prefix(mocker):
+    tasks._geoip_cache.clear()
+    reader = mocker.patch("tasks.GEOIP_READER")
+    reader.city.return_value.country.iso_code = "DE"
+    mocker.patch("tasks.GEOIP_CACHE_BY_PREFIX", True)
+
+    assert get_country_from_ip("203.0.113.7") == "de"
+    assert get_country_from_ip("203.0.113.99") == "de"
+    reader.city.assert_called_once()
@@ -0,0 +1,70 @@
+# tests/test_trending.py
+from datetime import datetime
+from trending import record_trending, rebuild_leaderboard, top_trending, build_score_update, LEADERBOARD_KEY
+
+# ----------------------------
+# Test hourly buckets
+# ----------------------------
+def test_record_trending_groups_by_url_and_hour(mocker):
+    mock_redis = mocker.patch("trending.redis_client")
+    pipe = mock_redis.pipeline.return_value
+
+    record_trending([
+        ("url1", datetime(2025, 1, 1, 10, 5)),
+        ("url1", datetime(2025, 1, 1, 10, 55)),
+        ("url1", datetime(2025, 1, 1, 11, 0)),
+        ("url2", datetime(2025, 1, 1, 11, 1)),
+    ])
+
+    increments = sorted(c.args for c in pipe.zincrby.call_args_list)
+    assert increments == [
+        ("trending:2025010110", 2, "url1"),
+        ("trending:2025010111", 1, "url1"),
+        ("trending:2025010111", 1, "url2"),
+    ]
+    assert pipe.expire.call_count == 2
+    pipe.execute.assert_called_once()
+
+# ----------------------------
+# Test leaderboard
+# ----------------------------
+def test_rebuild_leaderboard_weights_last_four_hours(mocker):
+    mock_redis = mocker.patch("trending.redis_client")
+    pipe = mock_redis.pipeline.return_value
+    pipe.execute.return_value = [3, 3]
+
+    assert rebuild_leaderboard(datetime(2025, 1, 1, 10, 30)) == 3
+
+    key, weights = pipe.zunionstore.call_args[0]
+    assert key == LEADERBOARD_KEY
+    assert weights == {
+        "trending:2025010110": 1,
+        "trending:2025010109": 0.5,
+        "trending:2025010108": 0.25,
+        "trending:2025010107": 0.25,
+    }
+
+def test_top_trending_reads_sorted_set(mocker):
+    mock_redis = mocker.patch("trending.redis_client")
+    mock_redis.zrevrange.return_value = [("url1", 4.5), ("url2", 1.0)]
+
+    assert top_trending(2) == [
+        {"url_id": "url1", "trending_score": 4.5},
+        {"url_id": "url2", "trending_score": 1.0},
+    ]
+    mock_redis.zrevrange.assert_called_once_with(LEADERBOARD_KEY, 0, 1, withscores=True)
+
+# ----------------------------
+# Test write-back
+# ----------------------------
+def test_build_score_update_sets_top_and_resets_the_rest():
+    sql, params = build_score_update({"url1": 4.5, "url2": 1.0})
+
+    assert sql.count("WHEN %s THEN %s") == 2
+    assert "ELSE 0" in sql and "trending_score > 0 OR id IN (%s,%s)" in sql
+    assert params == ("url1", 4.5, "url2", 1.0, "url1", "url2")
+
+def test_build_score_update_without_trending_resets_all():
+    sql, params = build_score_update({})
+    assert sql == "UPDATE urls SET trending_score = 0 WHERE trending_score > 0"
+    assert params == ()
@@ -0,0 +1,106 @@
+# tests/test_url_cache.py
+import pytest
+from unittest.mock import MagicMock
+import url_cache
+from url_cache import cache_url_record, get_url_record, get_url_records, backfill_legacy_keys, publish_invalidation
+
+@pytest.fixture(autouse=True)
+def local_tier(mocker):
+    # No subscriber thread in tests; start every test with an empty hot tier
+    mocker.patch("url_cache._ensure_invalidation_listener")
+    url_cache._local_records.clear()
+    yield url_cache._local_records
+    url_cache._local_records.clear()
+
+# ----------------------------
+# Test get_url_record
+# ----------------------------
+def test_get_url_record_hit(mocker):
+    mock_redis = mocker.patch("url_cache.redis_client")
+    mock_redis.hgetall.return_value = {
+        "original_url": "https://example.com",
+        "url_id": "url123",
+        "user_id": "user123",
+        "flags": "0",
+    }
+
+    record = get_url_record("abc")
+
+    mock_redis.hgetall.assert_called_once_with("url:abc")
+    assert record == {
+        "original_url": "https://example.com",
+        "url_id": "url123",
+        "user_id": "user123",
+        "flags": 0,
+    }
+
+def test_get_url_record_served_from_local_tier(mocker):
+    mock_redis = mocker.patch("url_cache.redis_client")
+    mock_redis.hgetall.return_value = {"original_url": "https://example.com", "url_id": "url123"}
+
+    get_url_record("abc")
+    get_url_record("abc")
+
+    mock_redis.hgetall.assert_called_once()
+
+def test_publish_invalidation_drops_local_entry(mocker, local_tier):
+    mock_redis = mocker.patch("url_cache.redis_client")
+    local_tier.set("abc", {"url_id": "url123"})
+
+    publish_invalidation("abc")
+
+    assert local_tier.get("abc") is None
+    mock_redis.publish.assert_called_once_with(url_cache.INVALIDATION_CHANNEL, '["abc"]')
+
+def test_get_url_record_miss(mocker):
+    mock_redis = mocker.patch("url_cache.redis_client")
+    mock_redis.hgetall.return_value = {}
+    assert get_url_record("abc") is None
+
+def test_get_url_records_pipelines_local_misses(mocker, local_tier):
+    mock_redis = mocker.patch("url_cache.redis_client")
+    local_tier.set("abc", {"url_id": "url123"})
+    pipe = mock_redis.pipeline.return_value
+    pipe.execute.return_value = [{"original_url": "https://example.com", "url_id": "url456"}, {}]
+
+    records = get_url_records(["abc", "def", "ghi"])
+
+    assert set(records) == {"abc", "def"}
+    assert [c[0][0] for c in pipe.hgetall.call_args_list] == ["url:def", "url:ghi"]
+    assert local_tier.get("def")["url_id"] == "url456"
+
+# ----------------------------
+# Test cache_url_record
+# ----------------------------
+def test_cache_url_record_uses_single_pipeline(mocker):
+    mock_redis = mocker.patch("url_cache.redis_client")
+    pipe = mock_redis.pipeline.return_value
+
+    record = cache_url_record("abc", "url123", "https://example.com", "user123")
+
+    assert record["url_id"] == "url123"
+    pipe.hset.assert_called_once()
+    pipe.expire.assert_called_once()
+    pipe.execute.assert_called_once()
+
+# ----------------------------
+# Test backfill_legacy_keys
+# ----------------------------
+def test_backfill_only_migrates_known_codes(mocker):
+    mock_redis = mocker.patch("url_cache.redis_client")
+    mock_redis.scan_iter.return_value = ["abc", "trending_urls", "rate:user1", "zzz"]
+    pipe = mock_redis.pipeline.return_value
+
+    mock_conn = mocker.patch("url_cache.get_connection")
+    mock_cursor = MagicMock()
+    mock_conn.return_value.cursor.return_value = mock_cursor
+    mock_cursor.fetchall.return_value = [
+        {"id": "url123", "code": "abc", "original_url": "https://example.com", "user_id": "user123"},
+    ]
+
+    migrated = backfill_legacy_keys()
+
+    assert migrated == 1
+    _, params = mock_cursor.execute.call_args[0]
+    assert params == ("abc", "zzz")
+    pipe.delete.assert_called_once_with("abc")
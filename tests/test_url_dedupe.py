@@ -0,0 +1,26 @@
+# tests/test_url_dedupe.py
+from unittest.mock import MagicMock
+from url_dedupe import normalize_url, url_hash, find_code
+
+# ----------------------------
+# Test normalization and hashing
+# ----------------------------
+def test_normalize_url_folds_equivalent_spellings():
+    assert normalize_url(" HTTPS://Example.COM:443") == "https://example.com/"
+    assert normalize_url("http://example.com:8080/A?b=1#c") == "http://example.com:8080/A?b=1#c"
+
+def test_url_hash_is_per_user():
+    assert url_hash("user1", "https://example.com") == url_hash("user1", "https://EXAMPLE.com/")
+    assert url_hash("user1", "https://example.com") != url_hash("user2", "https://example.com")
+    assert len(url_hash("user1", "https://example.com")) == 64
+
+# ----------------------------
+# Test find_code
+# ----------------------------
+def test_find_code_filters_by_hash_and_owner():
+    cursor = MagicMock()
+    cursor.fetchone.return_value = {"code": "abc"}
+
+    assert find_code(cursor, "user1", "f" * 64) == "abc"
+    sql, params = cursor.execute.call_args[0]
+    assert "url_hash = %s AND user_id = %s" in sql and params == ("f" * 64, "user1")
@@ -0,0 +1,70 @@
+"""
+Trending URLs, maintained incrementally in Redis.
+
+    trending:<YYYYMMDDHH>   url_id -> clicks in that UTC hour (ZINCRBY per click batch)
+    trending:leaderboard    url_id -> decayed score, rebuilt every minute
+
+The leaderboard is one weighted ZUNIONSTORE over the last four hourly buckets,
+with the weights from trending_score_calculation.txt: the current hour counts 1,
+the previous hour 0.5, and the two before that 0.25. The top N are copied to
+urls.trending_score; every other url is reset to 0.
+"""
+from collections import Counter as TallyCounter
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Tuple
+
+from db import redis_client
+
+LEADERBOARD_KEY = "trending:leaderboard"
+BUCKET_WEIGHTS = [1, 0.5, 0.25, 0.25]  # hours ago -> weight
+BUCKET_RETENTION = timedelta(hours=len(BUCKET_WEIGHTS) + 1)
+
+
+def _bucket_key(when: datetime) -> str:
+    return f"trending:{when.strftime('%Y%m%d%H')}"
+
+
+def record_trending(clicks: Iterable[Tuple[str, datetime]], pipe=None) -> None:
+    """Add (url_id, clicked_at) clicks to their hourly buckets (one pipelined round trip)."""
+    counts = TallyCounter((url_id, _bucket_key(clicked_at)) for url_id, clicked_at in clicks)
+    client = pipe if pipe is not None else redis_client.pipeline(transaction=False)
+    for (url_id, key), delta in counts.items():
+        client.zincrby(key, delta, url_id)
+    for key in {key for _, key in counts}:
+        client.expire(key, BUCKET_RETENTION)
+    if pipe is None:
+        client.execute()
+
+
+def rebuild_leaderboard(now: datetime = None) -> int:  # type: ignore
+    """Recompute trending:leaderboard from the hourly buckets. Returns its size."""
+    now = (now or datetime.utcnow()).replace(minute=0, second=0, microsecond=0)
+    weights: Dict[str, float] = {
+        _bucket_key(now - timedelta(hours=hours_ago)): weight
+        for hours_ago, weight in enumerate(BUCKET_WEIGHTS)
+    }
+    pipe = redis_client.pipeline()
+    pipe.zunionstore(LEADERBOARD_KEY, weights)
+    pipe.zcard(LEADERBOARD_KEY)
+    return pipe.execute()[-1]
+
+
+def build_score_update(scores: Dict[str, float]) -> Tuple[str, tuple]:
+    """
+    One `UPDATE urls` that writes the new scores and zeroes every other
+    non-zero score (urls that left the top N), so no stale score survives a run.
+    """
+    if not scores:
+        return "UPDATE urls SET trending_score = 0 WHERE trending_score > 0", ()
+    cases = " ".join(["WHEN %s THEN %s"] * len(scores))
+    placeholders = ",".join(["%s"] * len(scores))
+    sql = (f"UPDATE urls SET trending_score = CASE id {cases} ELSE 0 END "
+           f"WHERE trending_score > 0 OR id IN ({placeholders})")
+    params = tuple(v for pair in scores.items() for v in pair) + tuple(scores)
+    return sql, params
+
+
+def top_trending(top_n: int = 20) -> List[Dict]:
+    """Top N urls by decayed score, highest first (one ZREVRANGE)."""
+    entries = redis_client.zrevrange(LEADERBOARD_KEY, 0, top_n - 1, withscores=True)
+    return [{"url_id": url_id, "trending_score": score} for url_id, score in entries]  # type: ignore
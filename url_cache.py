@@ -0,0 +1,258 @@
+import os
+import json
+import time
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple, TypedDict
+
+import redis
+from db import redis_client, get_connection, safe_close
+from consts import URL_CACHE_TTL, LOCAL_URL_CACHE_SIZE, LOCAL_URL_CACHE_TTL
+from local_cache import LocalCache
+from code_filter import add_codes
+
+logger = logging.getLogger(__name__)
+
+# Redirect records live in one hash per code: url:<code>
+URL_KEY_PREFIX = "url:"
+
+# Bit flags stored alongside the record (reserved, no flags are defined yet)
+FLAG_NONE = 0
+
+# Pub/sub channel used to drop records from every worker's local tier
+INVALIDATION_CHANNEL = "url_cache:invalidate"
+
+# Plain-string keys that are not short codes and must never be migrated
+NON_CODE_KEYS = {"trending_urls"}
+
+
+class URLRecord(TypedDict):
+    original_url: str
+    url_id: str
+    user_id: str
+    flags: int
+
+
+def url_cache_key(code: str) -> str:
+    return f"{URL_KEY_PREFIX}{code}"
+
+
+# ---------------------------
+# Per-worker hot tier
+# ---------------------------
+_local_records = LocalCache("url_records", maxsize=LOCAL_URL_CACHE_SIZE, ttl=LOCAL_URL_CACHE_TTL)
+_listener_pid: Optional[int] = None
+_listener_lock = threading.Lock()
+
+
+def _listen_for_invalidations():
+    while True:
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            # Messages may have been missed while (re)connecting
+            _local_records.clear()
+            for message in pubsub.listen():
+                for code in json.loads(message["data"]):
+                    _local_records.delete(code)
+        except (redis.RedisError, ValueError, TypeError):
+            logger.warning("URL cache invalidation listener failed, resubscribing", exc_info=True)
+        time.sleep(1)
+
+
+def _ensure_invalidation_listener():
+    """Start one subscriber thread per process (re-created after fork, like the MySQL pool)."""
+    global _listener_pid
+    pid = os.getpid()
+    if _listener_pid == pid or LOCAL_URL_CACHE_SIZE <= 0:
+        return
+    with _listener_lock:
+        if _listener_pid == pid:
+            return
+        # Entries inherited from the parent process were never covered by a subscriber
+        _local_records.clear()
+        threading.Thread(
+            target=_listen_for_invalidations, name="url-cache-invalidation", daemon=True
+        ).start()
+        _listener_pid = pid
+
+
+def publish_invalidation(*codes: str, pipe=None) -> None:
+    """Drop codes from the local tier of every worker (created, changed or deleted)."""
+    for code in codes:
+        _local_records.delete(code)
+    client = pipe if pipe is not None else redis_client
+    client.publish(INVALIDATION_CHANNEL, json.dumps(list(codes)))
+
+
+# ---------------------------
+# Read / write
+# ---------------------------
+def cache_url_record(code: str, url_id: str, original_url: str, user_id: str,
+                     flags: int = FLAG_NONE, pipe=None) -> URLRecord:
+    """
+    Store the redirect record for a code.
+    Pass `pipe` to batch the write into an existing pipeline, otherwise
+    HSET + EXPIRE are sent in a single round trip.
+    """
+    record: URLRecord = {
+        "original_url": original_url,
+        "url_id": url_id,
+        "user_id": user_id,
+        "flags": flags,
+    }
+    client = pipe if pipe is not None else redis_client.pipeline(transaction=False)
+    key = url_cache_key(code)
+    client.hset(key, mapping=record)  # type: ignore
+    client.expire(key, URL_CACHE_TTL)
+    if pipe is None:
+        client.execute()
+    return record
+
+
+def register_new_url(code: str, url_id: str, original_url: str, user_id: str, pipe=None) -> URLRecord:
+    """
+    Cache a freshly created code, add it to the short-code filter and tell other
+    workers about it, in one round trip.
+    """
+    client = pipe if pipe is not None else redis_client.pipeline(transaction=False)
+    record = cache_url_record(code, url_id, original_url, user_id, pipe=client)
+    add_codes([code], pipe=client)
+    publish_invalidation(code, pipe=client)
+    if pipe is None:
+        client.execute()
+    return record
+
+
+def register_new_urls(records: List[Tuple[str, str, str, str]], pipe=None) -> None:
+    """
+    Bulk form of register_new_url for (code, url_id, original_url, user_id) rows:
+    one pipeline and a single invalidation message for the whole batch.
+    """
+    if not records:
+        return
+    client = pipe if pipe is not None else redis_client.pipeline(transaction=False)
+    for code, url_id, original_url, user_id in records:
+        cache_url_record(code, url_id, original_url, user_id, pipe=client)
+    codes = [record[0] for record in records]
+    add_codes(codes, pipe=client)
+    publish_invalidation(*codes, pipe=client)
+    if pipe is None:
+        client.execute()
+
+
+def get_url_record(code: str) -> Optional[URLRecord]:
+    """
+    Return the redirect record for a code, or None on a miss.
+    Checks this worker's hot tier first, then Redis (one HGETALL).
+    """
+    _ensure_invalidation_listener()
+    record: Optional[URLRecord] = _local_records.get(code)
+    if record is not None:
+        return record
+
+    data: Dict[str, str] = redis_client.hgetall(url_cache_key(code))  # type: ignore
+    return _remember(code, data)
+
+
+def _remember(code: str, data: Dict[str, str]) -> Optional[URLRecord]:
+    if not data or not data.get("url_id") or not data.get("original_url"):
+        return None
+    record: URLRecord = {
+        "original_url": data["original_url"],
+        "url_id": data["url_id"],
+        "user_id": data.get("user_id", ""),
+        "flags": int(data.get("flags") or FLAG_NONE),
+    }
+    _local_records.set(code, record)
+    return record
+
+
+def get_url_records(codes: List[str]) -> Dict[str, URLRecord]:
+    """
+    Records for many codes: hot tier first, then one pipelined HGETALL per miss.
+    Codes missing from both tiers are left out of the result.
+    """
+    _ensure_invalidation_listener()
+    records: Dict[str, URLRecord] = {}
+    misses: List[str] = []
+    for code in codes:
+        record = _local_records.get(code)
+        if record is not None:
+            records[code] = record
+        else:
+            misses.append(code)
+    if misses:
+        pipe = redis_client.pipeline(transaction=False)
+        for code in misses:
+            pipe.hgetall(url_cache_key(code))
+        for code, data in zip(misses, pipe.execute()):
+            record = _remember(code, data)
+            if record is not None:
+                records[code] = record
+    return records
+
+
+def delete_url_record(code: str) -> None:
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.delete(url_cache_key(code))
+    publish_invalidation(code, pipe=pipe)
+    pipe.execute()
+
+
+# ---------------------------
+# Legacy migration
+# ---------------------------
+def _is_legacy_code_key(key: str) -> bool:
+    # Legacy entries were stored as SET <code> <original_url>; codes never contain ':'
+    return ":" not in key and len(key) <= 10 and key not in NON_CODE_KEYS
+
+
+def backfill_legacy_keys(batch_size: int = 500) -> int:
+    """
+    Convert plain-string `<code> -> original_url` keys into url:<code> hashes.
+    Keys are matched against `urls.code` in batches, so anything that is not a real
+    short code is left untouched. Safe to run repeatedly; returns the number migrated.
+    Legacy keys also expire on their own within URL_CACHE_TTL, so this is optional.
+    """
+    migrated = 0
+    batch: List[str] = []
+
+    def flush(codes: List[str]) -> int:
+        conn = get_connection()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            placeholders = ",".join(["%s"] * len(codes))
+            cursor.execute(
+                f"SELECT id, code, original_url, user_id FROM urls WHERE code IN ({placeholders})",
+                tuple(codes),
+            )
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+            safe_close(conn)
+
+        pipe = redis_client.pipeline(transaction=False)
+        for row in rows:
+            cache_url_record(row["code"], row["id"], row["original_url"], row["user_id"], pipe=pipe)  # type: ignore
+            pipe.delete(row["code"])  # type: ignore
+        pipe.execute()
+        return len(rows)
+
+    for key in redis_client.scan_iter(count=batch_size, _type="string"):
+        if not _is_legacy_code_key(key):  # type: ignore
+            continue
+        batch.append(key)  # type: ignore
+        if len(batch) >= batch_size:
+            migrated += flush(batch)
+            batch = []
+    if batch:
+        migrated += flush(batch)
+
+    logger.info(f"Backfilled {migrated} legacy redirect cache keys")
+    return migrated
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    backfill_legacy_keys()
@@ -0,0 +1,56 @@
+"""
+Per-user dedupe of destination URLs (POST /shorten with "dedupe": true).
+
+urls.original_url is TEXT and cannot be indexed, so every row also stores
+url_hash = SHA-256 of "<user_id>\\n<normalized url>" (indexed). The hash -> code
+mapping is cached in Redis (urlhash:<hash>), so a repeated submission costs one
+GET and a lookup of the cached redirect record.
+"""
+import hashlib
+from typing import Optional
+from urllib.parse import urlsplit, urlunsplit
+
+from db import redis_client
+from consts import URL_CACHE_TTL
+
+URL_HASH_PREFIX = "urlhash:"
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url: str) -> str:
+    """Case-fold scheme and host, drop a default port, use "/" for an empty path."""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    if parts.username:
+        credentials = parts.username + (f":{parts.password}" if parts.password is not None else "")
+        host = f"{credentials}@{host}"
+    return urlunsplit((scheme, host, parts.path or "/", parts.query, parts.fragment))
+
+
+def url_hash(user_id: str, url: str) -> str:
+    return hashlib.sha256(f"{user_id}\n{normalize_url(url)}".encode()).hexdigest()
+
+
+def _key(digest: str) -> str:
+    return f"{URL_HASH_PREFIX}{digest}"
+
+
+def cached_code(digest: str) -> Optional[str]:
+    return redis_client.get(_key(digest))  # type: ignore
+
+
+def find_code(cursor, user_id: str, digest: str) -> Optional[str]:
+    """The caller's existing code for a hash, from MySQL (idx_urls_url_hash)."""
+    cursor.execute("SELECT code FROM urls WHERE url_hash = %s AND user_id = %s LIMIT 1", (digest, user_id))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    return row["code"] if isinstance(row, dict) else row[0]
+
+
+def remember_code(digest: str, code: str, pipe=None) -> None:
+    client = pipe if pipe is not None else redis_client
+    client.set(_key(digest), code, ex=URL_CACHE_TTL)